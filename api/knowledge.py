@@ -1,28 +1,53 @@
 """
 知识库 CRUD API
 产品和供应商的增删改查
+
+异步引擎（asyncpg）：路由不占用线程池，连接池大小 / 溢出 / pre-ping / 语句超时见 services.db，
+连接池状态和取连接等待时间在 GET /api/v1/db/pool
 """
-from fastapi import APIRouter, HTTPException, Depends, Query
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Union
 from datetime import datetime
-import os
+from contextlib import asynccontextmanager
+import base64
+import asyncio
 
 # 数据库（生产环境用 SQLAlchemy + PostgreSQL）
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Index, func, select, text, update as sql_update
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, relationship, joinedload
 
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/printshop")
+from services.db import DATABASE_URL, DB_POOL_TIMEOUT, PoolMetrics, async_url, engine_options, timed_checkout
+from services.text_search import PG_SETTINGS, apply_name_search, prepare_name_search, register_sqlite
+from services.catalog_cache import create_catalog_cache
+from services.embedding_jobs import embedding_status
+from services.price_history import MAX_AS_OF_PRODUCTS, as_of_stmt
+from services.pricelist_export import (
+    EXPORT_BATCH_ROWS, EXPORT_CONCURRENCY, EXPORT_FORMATS, EXPORT_TIMEOUT,
+    encode, etag_matches, fingerprint_stmt, make_etag, pricelist_stmt
+)
+from services.bulk_products import iter_json_rows, check_lengths, upsert_chunk, BULK_CHUNK_ROWS
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_async_engine(async_url(DATABASE_URL), **engine_options(async_url(DATABASE_URL), PG_SETTINGS))
+# 本地 SQLite 开发库：名称检索用 FTS5 回退
+register_sqlite(engine.sync_engine)
+pool_metrics = PoolMetrics(engine.sync_engine)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+# get_product / get_supplier 读穿缓存（CATALOG_CACHE_BACKEND=local/redis/off）
+catalog_cache = create_catalog_cache()
 Base = declarative_base()
 
 # ============ 数据模型 ============
 
 class Supplier(Base):
     __tablename__ = "suppliers"
+    __table_args__ = (
+        # 与 schema.sql 一致：导入按名称查找/创建供应商
+        Index("idx_suppliers_name", "name", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
@@ -31,10 +56,15 @@ class Supplier(Base):
     email = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    products = relationship("Product", back_populates="supplier")
+    # 删除供应商时由 delete_supplier 先解除产品关联，不加载产品列表
+    products = relationship("Product", back_populates="supplier", passive_deletes=True)
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # 批量导入按 (供应商, 产品名) upsert
+        Index("idx_products_supplier_name", "supplier_id", "name", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, index=True)
@@ -46,9 +76,37 @@ class Product(Base):
     description = Column(Text)
     image_url = Column(String(500))
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 数据库时钟（与批量导入 / 上传导入的 NOW() 一致），价格表 ETag 依赖 max(updated_at)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # 向量本身不映射（只有检索用到），状态字段由 services/embedding_jobs.py 维护
+    embedding_hash = Column(String(40))
+    embedded_updated_at = Column(DateTime)
+    
+    # 禁止隐式懒加载（逐行一次查询）；需要供应商信息时用 joinedload
+    supplier = relationship("Supplier", back_populates="products", lazy="raise_on_sql")
+    
+    @property
+    def supplier_name(self) -> Optional[str]:
+        return self.supplier.name if self.supplier else None
+    
+    @property
+    def embedding_status(self) -> str:
+        return embedding_status(self.embedding_hash, self.embedded_updated_at, self.updated_at)
+
+class PriceHistory(Base):
+    __tablename__ = "price_history"
+    __table_args__ = (
+        # 按时刻查价格：每个产品倒序取 changed_at <= 时刻 的第一行
+        Index("idx_price_history_product_time", "product_id", text("changed_at DESC"), text("id DESC")),
+    )
     
-    supplier = relationship("Supplier", back_populates="products")
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    supplier_price = Column(Float)
+    retail_price = Column(Float)
+    # 与 ProductImporter 一致用数据库时间
+    changed_at = Column(DateTime, nullable=False, server_default=func.now())
+    changed_by = Column(String(100))
 
 # ============ Pydantic 模型 ============
 
@@ -89,10 +147,40 @@ class ProductResponse(BaseModel):
     min_quantity: Optional[int]
     description: Optional[str]
     created_at: datetime
+    embedding_status: str  # missing / stale / fresh
     
     class Config:
         from_attributes = True
 
+class ProductWithSupplierResponse(ProductResponse):
+    """产品 + 供应商名称（一次查询 JOIN 得到）"""
+    supplier_name: Optional[str]
+
+class PriceAsOfResponse(BaseModel):
+    """某时刻生效的价格（changed_at 为该价格开始生效的时间）"""
+    product_id: int
+    supplier_price: Optional[float]
+    retail_price: Optional[float]
+    changed_at: datetime
+    changed_by: Optional[str]
+
+class PriceAsOfRequest(BaseModel):
+    product_ids: List[int] = Field(..., min_length=1, max_length=MAX_AS_OF_PRODUCTS)
+    at: datetime
+
+class SupplierPage(BaseModel):
+    """paged=true 时的返回：本页数据 + 下一页游标（没有下一页为 null）"""
+    items: List[SupplierResponse]
+    next_cursor: Optional[str] = None
+
+class ProductPage(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str] = None
+
+class ProductWithSupplierPage(BaseModel):
+    items: List[ProductWithSupplierResponse]
+    next_cursor: Optional[str] = None
+
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
     supplier_price: Optional[float] = None
@@ -100,130 +188,451 @@ class ProductUpdate(BaseModel):
     unit: Optional[str] = None
     description: Optional[str] = None
 
-# ============ 依赖 ============
+# ============ 游标分页 ============
+
+def encode_cursor(last_id: int) -> str:
+    """最后一行 ID -> 不透明游标"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode()
 
-def get_db():
-    db = SessionLocal()
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """游标 -> 最后一行 ID；None / 空字符串表示从头开始，格式错误返回 400"""
+    if not cursor:
+        return None
     try:
+        prefix, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        assert prefix == "id"
+        return int(last_id)
+    except Exception:
+        raise HTTPException(400, "无效的游标")
+
+def use_ranking(q: Optional[str], cursor: Optional[str], paged: bool) -> bool:
+    """有关键词、没有游标、也没有要求分页信封时按相似度排序（cursor= 空值视同未传）"""
+    return bool(q) and not cursor and not paged
+
+def page_body(rows, next_cursor: Optional[str], paged: bool):
+    """paged=true 返回 {"items", "next_cursor"}，否则保持原来的列表"""
+    return {"items": rows, "next_cursor": next_cursor} if paged else rows
+
+async def paginate(db: AsyncSession, stmt, id_column, response: Response, skip: int, limit: int,
+                   cursor: Optional[str], ranked: bool):
+    """
+    ranked=True 时按相似度排序 + offset；
+    否则按 ID 升序，传了 cursor 时从游标之后开始（每页代价恒定，不随翻页深度增长），
+    还有下一页时在 X-Next-Cursor 响应头返回游标
+
+    Returns:
+        (本页数据, 下一页游标或 None)
+    """
+    if ranked:
+        return (await db.scalars(stmt.offset(skip).limit(limit))).all(), None
+    
+    stmt = stmt.order_by(id_column)
+    last_id = decode_cursor(cursor)
+    if last_id is not None:
+        stmt = stmt.where(id_column > last_id)
+    elif skip:
+        stmt = stmt.offset(skip)
+    # 多取一行判断是否还有下一页
+    rows = (await db.scalars(stmt.limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows, next_cursor
+
+def price_history_entry(product: Product, changed_by: str = "api") -> PriceHistory:
+    return PriceHistory(product_id=product.id, supplier_price=product.supplier_price,
+                        retail_price=product.retail_price, changed_by=changed_by)
+
+# ============ 依赖 ============
+
+@asynccontextmanager
+async def db_session():
+    """
+    打开会话并立即从连接池取连接、计时；连接池耗尽超过 DB_POOL_TIMEOUT 秒返回 503，
+    而不是让请求无限排队
+    """
+    async with SessionLocal() as db:
+        try:
+            with timed_checkout(pool_metrics):
+                await db.connection()
+        except PoolTimeout:
+            raise HTTPException(503, "数据库繁忙，请稍后重试", headers={"Retry-After": str(max(1, int(DB_POOL_TIMEOUT)))})
+        yield db
+
+async def get_db():
+    async with db_session() as db:
         yield db
-    finally:
-        db.close()
 
 # ============ 路由 ============
 
 router = APIRouter(prefix="/api/v1", tags=["knowledge"])
 
+@router.get("/db/pool")
+async def pool_status():
+    """连接池指标：使用中 / 空闲 / 溢出连接数，取连接等待时间（毫秒），超时次数"""
+    return pool_metrics.snapshot()
+
+@router.get("/cache/catalog")
+async def catalog_cache_status():
+    """产品 / 供应商缓存：命中率、失效次数、命中数据的年龄（秒）"""
+    return catalog_cache.snapshot()
+
 # --- 供应商 ---
 
 @router.post("/suppliers", response_model=SupplierResponse)
-def create_supplier(supplier: SupplierCreate, db: Session = Depends(get_db)):
-    """创建供应商"""
+async def create_supplier(supplier: SupplierCreate, db: AsyncSession = Depends(get_db)):
+    """创建供应商（名称唯一，已存在时返回 409）"""
     db_supplier = Supplier(**supplier.dict())
     db.add(db_supplier)
-    db.commit()
-    db.refresh(db_supplier)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(409, "供应商已存在")
+    await db.refresh(db_supplier)
     return db_supplier
 
-@router.get("/suppliers", response_model=List[SupplierResponse])
-def list_suppliers(
+@router.get("/suppliers", response_model=Union[List[SupplierResponse], SupplierPage])
+async def list_suppliers(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
     q: Optional[str] = None,
-    db: Session = Depends(get_db)
+    fuzzy: bool = False,
+    cursor: Optional[str] = None,
+    paged: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    """获取供应商列表"""
-    query = db.query(Supplier)
+    """
+    获取供应商列表（q 按名称检索，相似度高的在前；fuzzy=true 时容错别字）
+    
+    游标分页：按 ID 排序，下一页游标在 X-Next-Cursor 响应头；
+    paged=true 时返回 {"items": [...], "next_cursor": ...}，游标也在响应体中，
+    带关键词时用 paged=true 开始游标分页（此时按 ID 而不是相似度排序）。
+    cursor= 空值等同于不传
+    """
+    ranked = use_ranking(q, cursor, paged)
+    stmt = select(Supplier)
     if q:
-        query = query.filter(Supplier.name.ilike(f"%{q}%"))
-    return query.offset(skip).limit(limit).all()
+        await prepare_name_search(db, Supplier.name)
+        stmt = apply_name_search(stmt, db.get_bind().dialect.name, Supplier.name, q, fuzzy, rank=ranked)
+    rows, next_cursor = await paginate(db, stmt, Supplier.id, response, skip, limit, cursor, ranked)
+    return page_body(rows, next_cursor, paged)
 
 @router.get("/suppliers/{supplier_id}", response_model=SupplierResponse)
-def get_supplier(supplier_id: int, db: Session = Depends(get_db)):
-    """获取单个供应商"""
-    supplier = db.query(Supplier).filter(Supplier.id == supplier_id).first()
+async def get_supplier(supplier_id: int):
+    """获取单个供应商（读穿缓存，命中时不占用数据库连接）"""
+    async def load():
+        async with db_session() as db:
+            supplier = await db.get(Supplier, supplier_id)
+            return SupplierResponse.model_validate(supplier).model_dump(mode="json") if supplier else None
+    
+    supplier = await catalog_cache.get_or_load("supplier", supplier_id, load)
     if not supplier:
         raise HTTPException(404, "供应商不存在")
     return supplier
 
 @router.delete("/suppliers/{supplier_id}")
-def delete_supplier(supplier_id: int, db: Session = Depends(get_db)):
-    """删除供应商"""
-    supplier = db.query(Supplier).filter(Supplier.id == supplier_id).first()
+async def delete_supplier(supplier_id: int, db: AsyncSession = Depends(get_db)):
+    """删除供应商（其产品保留，供应商置空）"""
+    supplier = await db.get(Supplier, supplier_id)
     if not supplier:
         raise HTTPException(404, "供应商不存在")
-    db.delete(supplier)
-    db.commit()
+    product_ids = (await db.scalars(
+        sql_update(Product).where(Product.supplier_id == supplier_id).values(supplier_id=None).returning(Product.id)
+    )).all()
+    await db.delete(supplier)
+    await db.commit()
+    await catalog_cache.invalidate("supplier", [supplier_id])
+    await catalog_cache.invalidate("product", product_ids)
     return {"status": "deleted"}
 
 # --- 产品 ---
 
 @router.post("/products", response_model=ProductResponse)
-def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+async def create_product(product: ProductCreate, db: AsyncSession = Depends(get_db)):
     """创建产品"""
     db_product = Product(**product.dict())
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    await db.flush()
+    db.add(price_history_entry(db_product))
+    await db.commit()
+    await db.refresh(db_product)
     return db_product
 
-@router.get("/products", response_model=List[ProductResponse])
-def list_products(
+@router.get("/products", response_model=Union[List[ProductResponse], ProductPage])
+async def list_products(
+    response: Response,
+    skip: int = 0,
+    limit: int = 20,
+    q: Optional[str] = None,
+    supplier_id: Optional[int] = None,
+    fuzzy: bool = False,
+    cursor: Optional[str] = None,
+    paged: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取产品列表（q 按名称检索，相似度高的在前；fuzzy=true 时容错别字）
+    
+    游标分页同 list_suppliers：下一页游标在 X-Next-Cursor 响应头，paged=true 时也在响应体中
+    """
+    ranked = use_ranking(q, cursor, paged)
+    stmt = select(Product)
+    if q:
+        await prepare_name_search(db, Product.name)
+        stmt = apply_name_search(stmt, db.get_bind().dialect.name, Product.name, q, fuzzy, rank=ranked)
+    if supplier_id:
+        stmt = stmt.where(Product.supplier_id == supplier_id)
+    rows, next_cursor = await paginate(db, stmt, Product.id, response, skip, limit, cursor, ranked)
+    return page_body(rows, next_cursor, paged)
+
+@router.get("/products/with-supplier", response_model=Union[List[ProductWithSupplierResponse], ProductWithSupplierPage])
+async def list_products_with_supplier(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
     q: Optional[str] = None,
     supplier_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    fuzzy: bool = False,
+    cursor: Optional[str] = None,
+    paged: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    """获取产品列表（支持搜索）"""
-    query = db.query(Product)
+    """
+    产品列表，附带供应商名称（参数和分页同 list_products）
+    
+    供应商随产品一次 LEFT JOIN 查出，不需要逐个产品再查供应商
+    """
+    ranked = use_ranking(q, cursor, paged)
+    stmt = select(Product).options(joinedload(Product.supplier))
     if q:
-        query = query.filter(Product.name.ilike(f"%{q}%"))
+        await prepare_name_search(db, Product.name)
+        stmt = apply_name_search(stmt, db.get_bind().dialect.name, Product.name, q, fuzzy, rank=ranked)
     if supplier_id:
-        query = query.filter(Product.supplier_id == supplier_id)
-    return query.offset(skip).limit(limit).all()
+        stmt = stmt.where(Product.supplier_id == supplier_id)
+    rows, next_cursor = await paginate(db, stmt, Product.id, response, skip, limit, cursor, ranked)
+    return page_body(rows, next_cursor, paged)
+
+@router.get("/products/{product_id}/with-supplier", response_model=ProductWithSupplierResponse)
+async def get_product_with_supplier(product_id: int, db: AsyncSession = Depends(get_db)):
+    """获取单个产品，附带供应商名称（一次查询）"""
+    product = await db.get(Product, product_id, options=[joinedload(Product.supplier)])
+    if not product:
+        raise HTTPException(404, "产品不存在")
+    return product
 
 @router.get("/products/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    """获取单个产品"""
-    product = db.query(Product).filter(Product.id == product_id).first()
+async def get_product(product_id: int):
+    """获取单个产品（读穿缓存，命中时不占用数据库连接）"""
+    async def load():
+        async with db_session() as db:
+            product = await db.get(Product, product_id)
+            return ProductResponse.model_validate(product).model_dump(mode="json") if product else None
+    
+    product = await catalog_cache.get_or_load("product", product_id, load)
     if not product:
         raise HTTPException(404, "产品不存在")
     return product
 
 @router.put("/products/{product_id}", response_model=ProductResponse)
-def update_product(product_id: int, update: ProductUpdate, db: Session = Depends(get_db)):
+async def update_product(product_id: int, update: ProductUpdate, db: AsyncSession = Depends(get_db)):
     """更新产品"""
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = await db.get(Product, product_id)
     if not product:
         raise HTTPException(404, "产品不存在")
     
+    old_prices = (product.supplier_price, product.retail_price)
     for key, value in update.dict(exclude_unset=True).items():
         setattr(product, key, value)
+    # 价格变化与产品更新同一事务写入历史
+    if (product.supplier_price, product.retail_price) != old_prices:
+        db.add(price_history_entry(product))
     
-    db.commit()
-    db.refresh(product)
+    await db.commit()
+    await catalog_cache.invalidate("product", [product_id])
+    await db.refresh(product)
     return product
 
 @router.delete("/products/{product_id}")
-def delete_product(product_id: int, db: Session = Depends(get_db)):
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
     """删除产品"""
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = await db.get(Product, product_id)
     if not product:
         raise HTTPException(404, "产品不存在")
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    await db.commit()
+    await catalog_cache.invalidate("product", [product_id])
     return {"status": "deleted"}
 
+# --- 历史价格 ---
+
+@router.get("/products/{product_id}/price", response_model=PriceAsOfResponse)
+async def get_price_as_of(product_id: int, at: datetime, db: AsyncSession = Depends(get_db)):
+    """
+    产品在 at 时刻的价格（旧订单重新报价用）
+    
+    at 之前没有价格记录时返回 404
+    """
+    row = (await db.execute(as_of_stmt(Product.__table__, PriceHistory.__table__, [product_id], at))).first()
+    if not row:
+        raise HTTPException(404, "该时刻之前没有价格记录")
+    return row._asdict()
+
+@router.post("/prices/as-of", response_model=List[PriceAsOfResponse])
+async def get_prices_as_of(query: PriceAsOfRequest, db: AsyncSession = Depends(get_db)):
+    """
+    多个产品在同一时刻的价格，一次查询
+    
+    at 之前没有价格记录的产品不在结果中
+    """
+    rows = await db.execute(as_of_stmt(Product.__table__, PriceHistory.__table__, query.product_ids, query.at))
+    return [r._asdict() for r in rows]
+
+# --- 客户版价格表 ---
+
+# 导出名额：导出占用的连接数有上限，其余连接留给 CRUD
+export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+class ExportResponse(StreamingResponse):
+    """
+    超过 EXPORT_TIMEOUT 秒未发完时中断下载；无论正常结束、客户端断开还是超时，
+    都关闭数据库游标（归还连接）并释放导出名额
+    """
+    def __init__(self, content, finish, **kwargs):
+        super().__init__(content, **kwargs)
+        self.finish = finish
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await asyncio.wait_for(super().__call__(scope, receive, send), EXPORT_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"价格表导出超过 {EXPORT_TIMEOUT:.0f} 秒，已中断")
+        finally:
+            await self.finish()
+
+@router.get("/pricelist/export")
+async def export_pricelist(
+    format: str = Query("csv", pattern="^(csv|xlsx|jsonl)$"),
+    supplier_id: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    导出客户版价格表（不含供应商价），边查边发，整个目录也只占用常量内存
+    
+    响应带 ETag；客户端带 If-None-Match 且目录没有变化时返回 304，不重新发送。
+    下载期间占用一个数据库连接：同时最多 PRICELIST_EXPORT_CONCURRENCY 个导出（超出返回 503），
+    每个最长 PRICELIST_EXPORT_TIMEOUT 秒
+    """
+    async with db_session() as db:
+        fingerprint = (await db.execute(fingerprint_stmt(Product.__table__, Supplier.__table__, supplier_id))).one()
+    etag = make_etag(format, supplier_id, fingerprint)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    async def batches():
+        # 服务端游标（asyncpg 在事务内 DECLARE CURSOR），每次取 EXPORT_BATCH_ROWS 行
+        with timed_checkout(pool_metrics):
+            conn = await engine.connect()
+        try:
+            stmt = pricelist_stmt(Product.__table__, Supplier.__table__, supplier_id)
+            result = await conn.stream(stmt.execution_options(yield_per=EXPORT_BATCH_ROWS))
+            async for rows in result.mappings().partitions():
+                yield rows
+        finally:
+            await conn.close()
+    
+    if export_slots.locked():
+        raise HTTPException(503, "导出任务过多，请稍后重试", headers={"Retry-After": "30"})
+    await export_slots.acquire()
+    rows = batches()
+    
+    async def finish():
+        await rows.aclose()
+        export_slots.release()
+    
+    media_type, suffix = EXPORT_FORMATS[format]
+    headers["Content-Disposition"] = f'attachment; filename="pricelist.{suffix}"'
+    return ExportResponse(encode(rows, format), finish, media_type=media_type, headers=headers)
+
 # --- 批量导入 ---
 
 @router.post("/products/batch")
-def batch_import_products(products: List[ProductCreate], db: Session = Depends(get_db)):
-    """批量导入产品"""
-    created = []
-    for p in products:
-        db_product = Product(**p.dict())
-        db.add(db_product)
-        created.append(db_product)
-    
-    db.commit()
-    return {"status": "imported", "count": len(created)}
+async def batch_import_products(
+    request: Request,
+    on_conflict: str = Query("update", pattern="^(update|skip)$")
+):
+    """
+    批量导入产品（请求体为 ProductCreate 的 JSON 数组，或 NDJSON 每行一个）
+    
+    边读边写，每 BULK_CHUNK_ROWS 行一个事务；按 (supplier_id, name) 合并：
+    on_conflict=update 覆盖已有产品，skip 保留已有产品。
+    没有 supplier_id 的行与其他无供应商的同名产品合并；同一块内重复的行以最后一行为准，前面的行报错。
+    出错的行不影响其他行，在 errors 中按行号（从 0 开始）返回
+    """
+    result = {"created": [], "updated": [], "unchanged": [], "errors": []}
+    chunk = []
+    
+    async def flush():
+        with timed_checkout(pool_metrics):
+            conn = await engine.connect()
+        try:
+            async with conn.begin():
+                part = await conn.run_sync(upsert_chunk, Product.__table__, chunk, on_conflict, PriceHistory.__table__)
+        finally:
+            await conn.close()
+        # 新建的产品不会在缓存里，未变的不用失效
+        await catalog_cache.invalidate("product", part["updated"])
+        for key, values in part.items():
+            result[key].extend(values)
+        chunk.clear()
+    
+    index = 0
+    try:
+        async for item in iter_json_rows(request.stream()):
+            try:
+                row = ProductCreate.model_validate(item).model_dump()
+                problems = check_lengths(row)
+            except ValidationError as e:
+                problems = [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]
+            if problems:
+                result["errors"].append({"index": index, "error": "; ".join(problems)})
+            else:
+                chunk.append((index, row))
+            index += 1
+            if len(chunk) >= BULK_CHUNK_ROWS:
+                await flush()
+    except ValueError as e:
+        # 之前的分块已提交，告诉客户端从哪一行开始没有处理
+        result["errors"].append({"index": index, "error": f"{e}，之后的内容未处理"})
+    if chunk:
+        await flush()
+    
+    return {
+        "status": "imported",
+        "count": len(result["created"]) + len(result["updated"]),
+        **result
+    }
+
+# ============ 独立运行 ============
+
+def create_app() -> FastAPI:
+    """
+    只挂知识库路由的应用（压测 / 单独部署）：
+        uvicorn api.knowledge:create_app --factory --workers 4
+    """
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # 本地 SQLite 开发库自动建表；PostgreSQL 表结构由 schema.sql 维护
+        if engine.dialect.name == "sqlite":
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        yield
+        await engine.dispose()
+    
+    app = FastAPI(title="Printshop Knowledge API", lifespan=lifespan)
+    app.include_router(router)
+    return app
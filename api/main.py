@@ -1,17 +1,101 @@
 """
 PrintShop API - 供应商资料管理系统
 """
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Tuple
+from contextlib import asynccontextmanager
+from pathlib import Path
+import os
+import json
+import asyncio
+import hashlib
 import uuid
+import zipfile
 from datetime import datetime
 
+from services.jobs import ParseJob, QueueFull, create_queue
+from services.task_store import TaskStore, UNFINISHED_STATUSES
+from services.checkpoint import FileCheckpointStore
+from services.task_events import TaskEventBroker
+from services.product_import import ProductImporter
+from services.product_search import ProductSearch
+from services.embeddings import create_embedder
+from services.catalog_cache import create_remote_invalidator
+from services.embedding_jobs import EmbeddingBackfill
+
+# 上传文件目录（docker-compose 挂载 ./uploads）
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+# 上传分块大小 / 单文件大小上限
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+# 支持解析的文件类型 / 批量上传单批最多文件数（压缩包内文件也计入）
+ALLOWED_SUFFIXES = (".pdf", ".ppt", ".pptx")
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "50"))
+# 单个压缩包解压后的总字节上限（单个成员另受 MAX_UPLOAD_BYTES 限制）
+MAX_ARCHIVE_UNPACKED_BYTES = int(os.getenv("MAX_ARCHIVE_UNPACKED_MB", "500")) * 1024 * 1024
+
+# 清理过期任务的间隔（秒）
+TASK_PURGE_INTERVAL = int(os.getenv("TASK_PURGE_INTERVAL", "600"))
+# 启动时发现的中断任务的错误信息
+INTERRUPTED_ERROR = "任务中断（服务重启或解析进程退出），可 resume 从断点继续"
+# 是否在 API 进程内回填产品向量（也可以单独运行 python -m services.embedding_jobs）
+EMBEDDING_BACKFILL = os.getenv("EMBEDDING_BACKFILL", "1") == "1"
+# SSE 心跳间隔（秒），防止代理断开空闲连接
+SSE_HEARTBEAT_SECONDS = 15
+
+# 解析任务队列（JOB_BACKEND=local/redis）
+job_queue = None
+
+# 任务存储（parse_tasks 表，本地默认 SQLite）/ 解析断点（与 worker 共用目录）
+task_store = None
+checkpoints = None
+
+# 解析结果导入知识库 / 产品检索
+product_importer = None
+product_search = None
+# 知识库 API 的产品缓存失效（CATALOG_CACHE_BACKEND=redis 时才有，否则为 None，靠 TTL 过期）
+catalog_cache = None
+# 产品向量后台回填（配置了向量模型时启动）
+embedding_backfill = None
+
+# 任务进度推送（SSE 订阅）
+event_broker = TaskEventBroker()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动/停止解析队列、过期任务清理和向量回填"""
+    global job_queue, task_store, checkpoints, product_importer, product_search, catalog_cache, embedding_backfill
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    task_store = TaskStore()
+    checkpoints = FileCheckpointStore()
+    product_importer = ProductImporter()
+    embedder = create_embedder()
+    product_search = ProductSearch(embedder=embedder)
+    catalog_cache = create_remote_invalidator()
+    job_queue = create_queue(apply_event)
+    await job_queue.start()
+    await fail_orphaned_tasks()
+    purger = asyncio.create_task(purge_tasks_periodically())
+    if embedder is not None and EMBEDDING_BACKFILL:
+        # 重新生成了向量的产品，其缓存中的 embedding_status 已过时
+        embedding_backfill = EmbeddingBackfill(embedder, on_batch=invalidate_products)
+        await embedding_backfill.start()
+    yield
+    purger.cancel()
+    await job_queue.stop()
+    if embedding_backfill:
+        await embedding_backfill.stop()
+
+
 app = FastAPI(
     title="PrintShop API",
     description="供应商资料上传与解析系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -23,9 +107,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 模拟任务存储 (生产环境用 Redis/PostgreSQL)
-tasks_db = {}
-
 # ============ 数据模型 ============
 
 class TaskResponse(BaseModel):
@@ -33,16 +114,25 @@ class TaskResponse(BaseModel):
     filename: str
     status: str
     created_at: datetime
+    duplicate: bool = False  # 与已上传文件内容相同，复用原任务
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    tasks: List[TaskResponse]  # 按调度顺序（小文件在前）
+    skipped: List[dict] = []  # 未入队的文件及原因
 
 class TaskStatus(BaseModel):
     task_id: str
     status: str  # queued, processing, completed, failed
     progress: int
     result: Optional[dict] = None
+    wait_seconds: Optional[float] = None
+    error: Optional[str] = None
 
 class ProductImport(BaseModel):
     task_id: str
     confirmed: bool = True
+    supplier_name: Optional[str] = None  # 不传时用上传时填写的供应商
 
 class Product(BaseModel):
     id: int
@@ -50,125 +140,624 @@ class Product(BaseModel):
     supplier_name: Optional[str]
     supplier_price: Optional[float]
     retail_price: Optional[float]
+    unit: Optional[str] = None
     category: Optional[str]
+    score: Optional[float] = None  # 混合检索得分，无关键词时为空
+
+class ProductSearchResponse(BaseModel):
+    products: List[Product]
+    next_cursor: Optional[str] = None
+    query: Optional[str] = None
+    category: Optional[str] = None
 
 # ============ API 路由 ============
 
 @app.post("/api/v1/upload", response_model=TaskResponse)
 async def upload_file(
     file: UploadFile = File(...),
-    supplier_name: Optional[str] = None,
-    background_tasks: BackgroundTasks = None
+    supplier_name: Optional[str] = None
 ):
-    """上传供应商 PDF/PPT 文件"""
+    """上传供应商 PDF/PPT 文件，队列满时返回 429"""
     
     # 验证文件类型
-    allowed_types = [".pdf", ".ppt", ".pptx"]
     filename = file.filename.lower()
-    if not any(filename.endswith(t) for t in allowed_types):
+    if not filename.endswith(ALLOWED_SUFFIXES):
         raise HTTPException(400, "只支持 PDF、PPT、PPTX 文件")
     
-    # 创建任务
-    task_id = str(uuid.uuid4())
-    task = {
-        "task_id": task_id,
-        "filename": file.filename,
+    # 分块写盘并计算哈希，内存占用与文件大小无关
+    file_path, sha256, size = await spool_upload(file, Path(filename).suffix)
+    
+    try:
+        return await enqueue_upload(file.filename, file_path, sha256, size, supplier_name)
+    except QueueFull as e:
+        raise queue_full_error(e)
+
+@app.post("/api/v1/upload/batch", response_model=BatchResponse)
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    supplier_name: Optional[str] = None
+):
+    """
+    批量上传：多个 PDF/PPT 文件，或包含它们的 zip 压缩包
+    
+    每个文件一个子任务，按文件大小从小到大入队（队列同样按大小调度），
+    用返回的 batch_id 查询整批进度；整批放不进队列时返回 429，不会只入队一部分
+    """
+    entries = []  # (文件名, 路径, SHA-256, 字节数)
+    skipped = []
+    try:
+        for file in files:
+            filename = file.filename.lower()
+            if filename.endswith(".zip"):
+                # 压缩包用唯一的临时文件名：按哈希命名时，同一个包的并发上传会互相删掉对方正在解压的文件
+                archive_path, _, _ = await spool_to_temp(file)
+                try:
+                    members, rejected = await asyncio.to_thread(unpack_archive, archive_path, file.filename)
+                finally:
+                    archive_path.unlink(missing_ok=True)
+                entries.extend(members)
+                skipped.extend(rejected)
+            elif filename.endswith(ALLOWED_SUFFIXES):
+                entries.append((file.filename, *await spool_upload(file, Path(filename).suffix)))
+            else:
+                skipped.append({"filename": file.filename, "reason": "不支持的文件类型"})
+            
+            if len(entries) > MAX_BATCH_FILES:
+                raise HTTPException(413, f"单批最多 {MAX_BATCH_FILES} 个文件")
+    except BaseException:
+        await asyncio.to_thread(release_files, entries)
+        raise
+    
+    if not entries:
+        raise HTTPException(400, "没有可解析的 PDF、PPT、PPTX 文件")
+    
+    # 小文件先入队，先出结果
+    entries.sort(key=lambda e: e[3])
+    
+    # 整批检查容量：已有相同文件的任务直接复用、已有解析结果的复制给本供应商，都不占队列
+    new_count = await asyncio.to_thread(count_new_files, entries, supplier_name)
+    try:
+        await job_queue.ensure_capacity(new_count)
+    except QueueFull as e:
+        await asyncio.to_thread(release_files, entries)
+        raise queue_full_error(e)
+    
+    tasks = []
+    for i, (name, file_path, sha256, size) in enumerate(entries):
+        try:
+            tasks.append(await enqueue_upload(name, file_path, sha256, size, supplier_name))
+        except QueueFull:
+            # 检查之后队列被其他请求占满（Redis 多实例），剩余文件交给客户端稍后重传
+            await asyncio.to_thread(release_files, entries[i + 1:])
+            skipped.extend({"filename": n, "reason": "解析队列已满"} for n, _, _, _ in entries[i:])
+            break
+    
+    batch_id = str(uuid.uuid4())
+    await asyncio.to_thread(task_store.create_batch, {
+        "batch_id": batch_id,
         "supplier_name": supplier_name,
-        "status": "queued",
-        "progress": 0,
-        "result": None,
+        "task_ids": list(dict.fromkeys(t.task_id for t in tasks)),  # 批内相同文件只计一次
+        "skipped": skipped,
         "created_at": datetime.now()
-    }
-    tasks_db[task_id] = task
+    })
+    return BatchResponse(batch_id=batch_id, tasks=tasks, skipped=skipped)
+
+@app.get("/api/v1/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """批量上传的整体进度：各状态任务数、平均进度、每个子任务的状态"""
+    batch = await asyncio.to_thread(task_store.get_batch, batch_id)
+    if not batch:
+        raise HTTPException(404, "批次不存在")
     
-    # 后台处理解析
-    if background_tasks:
-        background_tasks.add_task(process_file, task_id, file)
+    tasks = batch["tasks"]
+    counts = {s: 0 for s in ("queued", "processing", "completed", "failed")}
+    for t in tasks:
+        counts[t["status"]] = counts.get(t["status"], 0) + 1
     
-    return TaskResponse(
-        task_id=task_id,
-        filename=file.filename,
-        status="queued",
-        created_at=task["created_at"]
-    )
+    if counts["queued"] == len(tasks):
+        status = "queued"
+    elif counts["queued"] or counts["processing"]:
+        status = "processing"
+    elif counts["failed"] == len(tasks):
+        status = "failed"
+    else:
+        status = "completed"  # 部分失败时看 counts.failed，可逐个 resume
+    
+    return {
+        "batch_id": batch["batch_id"],
+        "status": status,
+        "progress": sum(t["progress"] for t in tasks) // len(tasks) if tasks else 100,
+        "total": len(tasks),
+        "counts": counts,
+        "skipped": batch["skipped"],
+        "tasks": [
+            {
+                "task_id": t["task_id"],
+                "filename": t["filename"],
+                "status": t["status"],
+                "progress": t["progress"],
+                "file_size": t["file_size"],
+                "error": t["error"],
+            }
+            for t in tasks
+        ]
+    }
 
 @app.get("/api/v1/tasks/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
     """查询解析任务状态"""
-    if task_id not in tasks_db:
+    task = await asyncio.to_thread(task_store.get, task_id)
+    if not task:
         raise HTTPException(404, "任务不存在")
     
-    task = tasks_db[task_id]
     return TaskStatus(
         task_id=task_id,
         status=task["status"],
         progress=task["progress"],
-        result=task.get("result")
+        result=task.get("result"),
+        wait_seconds=task.get("wait_seconds"),
+        error=task.get("error")
     )
 
+@app.get("/api/v1/tasks/{task_id}/events")
+async def stream_task_events(task_id: str):
+    """
+    任务进度推送（Server-Sent Events）
+    
+    事件: progress（状态/进度）、page（单页提取的产品）、completed、failed
+    连接时先补发已完成的页面，之后推送实时事件，任务结束后关闭
+    """
+    if not await asyncio.to_thread(task_store.get, task_id):
+        raise HTTPException(404, "任务不存在")
+    
+    # 先订阅再读快照，避免两者之间的事件丢失；重复的页面按页码去重
+    queue = event_broker.subscribe(task_id)
+    
+    async def stream():
+        try:
+            task = await asyncio.to_thread(task_store.get, task_id)
+            yield sse_message("progress", {"status": task["status"], "progress": task["progress"]})
+            
+            sent_pages = set()
+            for page_no, products in await asyncio.to_thread(finished_pages, task):
+                sent_pages.add(page_no)
+                yield sse_message("page", {"page": page_no, "products": products})
+            
+            if task["status"] == "completed":
+                yield sse_message("completed", {"progress": 100})
+                return
+            if task["status"] == "failed":
+                yield sse_message("failed", {"error": task.get("error")})
+                return
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                
+                if event["type"] == "started":
+                    yield sse_message("progress", {"status": "processing", "progress": 0})
+                elif event["type"] == "page":
+                    if event["page"] in sent_pages:
+                        continue
+                    sent_pages.add(event["page"])
+                    yield sse_message("page", {
+                        "page": event["page"],
+                        "products": event["products"],
+                        "progress": min(99, event["pages_done"] * 100 // (event["total_pages"] or 1)),
+                    })
+                elif event["type"] == "completed":
+                    yield sse_message("completed", {"progress": 100, "total_pages": event["result"].get("total_pages")})
+                    return
+                elif event["type"] == "failed":
+                    yield sse_message("failed", {"error": event["error"]})
+                    return
+        finally:
+            event_broker.unsubscribe(task_id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/v1/tasks/{task_id}/resume", response_model=TaskStatus)
+async def resume_task(task_id: str):
+    """重新排队失败的任务，已完成的页面从断点恢复不再解析"""
+    task = await asyncio.to_thread(task_store.get, task_id)
+    if not task:
+        raise HTTPException(404, "任务不存在")
+    
+    if task["status"] != "failed":
+        raise HTTPException(400, "只能恢复失败的任务")
+    
+    # 先改为排队中再入队：worker 很快上报 started 时，processing 不会被这里覆盖回 queued
+    await asyncio.to_thread(task_store.update, task_id, status="queued", error=None, completed_at=None)
+    try:
+        await job_queue.submit(ParseJob(
+            task_id=task_id,
+            file_path=task["file_path"],
+            supplier_name=task["supplier_name"],
+            file_size=task["file_size"] or 0
+        ))
+    except QueueFull as e:
+        await asyncio.to_thread(
+            task_store.update, task_id, status="failed", error=task["error"], completed_at=task["completed_at"]
+        )
+        raise queue_full_error(e)
+    
+    return TaskStatus(task_id=task_id, status="queued", progress=task["progress"])
+
+@app.get("/api/v1/queue")
+async def queue_status():
+    """解析队列状态：排队深度、运行中任务数、排队等待时间"""
+    return await job_queue.snapshot()
+
 @app.get("/api/v1/tasks")
-async def list_tasks(limit: int = 20, offset: int = 0):
-    """获取任务列表"""
-    tasks = list(tasks_db.values())
-    tasks.sort(key=lambda x: x["created_at"], reverse=True)
+async def list_tasks(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    offset: int = 0,
+    count: bool = True
+):
+    """
+    获取任务列表（按创建时间倒序，游标分页）
+    
+    翻页时传入上一页的 next_cursor；offset 仅为兼容旧客户端保留。
+    total 为符合条件的任务总数（与旧接口一致）；只翻页不需要总数时传 count=false 省去统计（total 为 null）
+    """
+    try:
+        tasks, next_cursor = await asyncio.to_thread(
+            task_store.list, limit=limit, cursor=cursor, status=status, offset=offset
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    total = await asyncio.to_thread(task_store.count, status) if count else None
     return {
-        "tasks": tasks[offset:offset+limit],
-        "total": len(tasks)
+        "tasks": tasks,
+        "total": total,
+        "next_cursor": next_cursor
     }
 
 @app.post("/api/v1/products/import")
 async def import_products(data: ProductImport):
-    """将解析结果导入知识库"""
-    if data.task_id not in tasks_db:
+    """
+    将解析结果导入知识库
+    
+    按 (供应商, 产品名) 合并：已有产品更新，价格变化时记录价格历史；重复导入同一结果不产生改动
+    """
+    task = await asyncio.to_thread(task_store.get, data.task_id)
+    if not task:
         raise HTTPException(404, "任务不存在")
     
-    task = tasks_db[data.task_id]
     if task["status"] != "completed":
         raise HTTPException(400, "任务尚未完成")
     
-    # TODO: 实际导入到 PostgreSQL
-    return {"status": "imported", "products_count": len(task.get("result", {}).get("products", []))}
+    if not data.confirmed:
+        raise HTTPException(400, "请确认后再导入")
+    
+    supplier_name = data.supplier_name or task.get("supplier_name")
+    if not supplier_name:
+        raise HTTPException(400, "缺少供应商名称")
+    
+    products = (task.get("result") or {}).get("products", [])
+    # 一个事务的同步 SQL，放到线程里执行不阻塞事件循环
+    stats = await asyncio.to_thread(product_importer.import_products, products, supplier_name)
+    await invalidate_products(stats.pop("updated_ids"))
+    if embedding_backfill and (stats["inserted"] or stats["updated"]):
+        embedding_backfill.wake()
+    return {"status": "imported", "products_count": stats["total"], **stats}
 
-@app.get("/api/v1/products")
-async def search_products(q: Optional[str] = None, category: Optional[str] = None, limit: int = 20):
-    """搜索产品"""
-    # TODO: 实际从 PostgreSQL + 向量搜索
-    return {
-        "products": [],
-        "total": 0,
-        "query": q,
-        "category": category
+@app.get("/api/v1/embeddings/status")
+async def embedding_status():
+    """
+    产品向量状态：missing 没有向量 / stale 生成后有修改、等待回填 / fresh，以及回填 worker 进度
+    """
+    if embedding_backfill is None:
+        return {"enabled": False}
+    counts = await asyncio.to_thread(embedding_backfill.counts)
+    return {"enabled": True, "products": counts, "worker": embedding_backfill.snapshot()}
+
+@app.get("/api/v1/products", response_model=ProductSearchResponse)
+async def search_products(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    probes: Optional[int] = Query(None, ge=1, le=1000)
+):
+    """
+    搜索产品（全文 + 向量混合排序）
+    
+    category 按分类名过滤（含子分类）；翻页传入上一页的 next_cursor；
+    probes 覆盖 ivfflat.probes，调大召回更全、查询更慢
+    """
+    try:
+        products, next_cursor = await asyncio.to_thread(
+            product_search.search, q=q, category=category, limit=limit, cursor=cursor, probes=probes
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return ProductSearchResponse(products=products, next_cursor=next_cursor, query=q, category=category)
+
+# ============ 上传 ============
+
+async def enqueue_upload(filename: str, file_path: Path, sha256: str, size: int, supplier_name: Optional[str]) -> TaskResponse:
+    """
+    为已落盘的文件创建解析任务并入队
+    
+    相同文件、相同供应商已有任务（排队中/解析中/已完成）时直接复用；排队中/解析中的任务
+    已不在队列里（进程退出后遗留）时标记为失败，不再复用；
+    其他供应商已解析过该文件时，新建一个已完成的任务，复制解析结果并改为本供应商，不再解析；
+    队列满时撤销任务并抛出 QueueFull
+    """
+    existing = await asyncio.to_thread(task_store.find_by_hash, sha256, supplier_name)
+    if existing and existing["status"] in UNFINISHED_STATUSES and not await job_queue.is_active(existing["task_id"]):
+        await asyncio.to_thread(task_store.fail_unfinished, [existing["task_id"]], INTERRUPTED_ERROR)
+        existing = None
+    if existing:
+        return TaskResponse(
+            task_id=existing["task_id"],
+            filename=existing["filename"],
+            status=existing["status"],
+            created_at=existing["created_at"],
+            duplicate=True
+        )
+    
+    task_id = str(uuid.uuid4())
+    parsed = await asyncio.to_thread(task_store.find_result_by_hash, sha256)
+    if parsed and parsed.get("result") is not None:
+        now = datetime.now()
+        await asyncio.to_thread(task_store.create, {
+            "task_id": task_id,
+            "filename": filename,
+            "file_path": str(file_path),
+            "file_sha256": sha256,
+            "file_size": size,
+            "supplier_name": supplier_name,
+            "status": "completed",
+            "progress": 100,
+            "result": {**parsed["result"], "supplier": supplier_name or "未知供应商"},
+            "created_at": now,
+            "completed_at": now,
+        })
+        return TaskResponse(task_id=task_id, filename=filename, status="completed", created_at=now, duplicate=True)
+    
+    # 创建任务，worker 进程从上传目录读取文件
+    task = {
+        "task_id": task_id,
+        "filename": filename,
+        "file_path": str(file_path),
+        "file_sha256": sha256,
+        "file_size": size,
+        "supplier_name": supplier_name,
+        "status": "queued",
+        "progress": 0,
+        "created_at": datetime.now()
     }
+    await asyncio.to_thread(task_store.create, task)
+    
+    try:
+        await job_queue.submit(ParseJob(task_id=task_id, file_path=str(file_path), supplier_name=supplier_name, file_size=size))
+    except QueueFull:
+        await asyncio.to_thread(task_store.delete, task_id)
+        await asyncio.to_thread(release_files, [(filename, file_path, sha256, size)])
+        raise
+    
+    return TaskResponse(
+        task_id=task_id,
+        filename=filename,
+        status="queued",
+        created_at=task["created_at"]
+    )
+
+def count_new_files(entries: List[Tuple[str, Path, str, int]], supplier_name: Optional[str]) -> int:
+    """需要解析（占用队列）的文件数：已有同供应商任务或已有解析结果的不算"""
+    return len({
+        sha for _, _, sha, _ in entries
+        if not task_store.find_by_hash(sha, supplier_name) and not task_store.find_result_by_hash(sha)
+    })
+
+def release_files(entries: List[Tuple[str, Path, str, int]]):
+    """删除没有任务引用的上传文件（失败任务 resume 还需要它，所以有引用时保留；在线程中调用）"""
+    for _, file_path, sha256, _ in entries:
+        if not task_store.hash_in_use(sha256):
+            file_path.unlink(missing_ok=True)
+
+async def spool_upload(file: UploadFile, suffix: str) -> Tuple[Path, str, int]:
+    """
+    分块把上传文件写入 UPLOAD_DIR，同时计算 SHA-256
+    
+    文件按哈希命名，相同内容只存一份；超过 MAX_UPLOAD_BYTES 返回 413
+    
+    Returns:
+        (文件路径, SHA-256, 字节数)
+    """
+    tmp_path, sha256, size = await spool_to_temp(file)
+    return store_spooled(tmp_path, sha256, suffix), sha256, size
+
+async def spool_to_temp(file: UploadFile) -> Tuple[Path, str, int]:
+    """
+    分块写入 UPLOAD_DIR 下唯一命名的临时文件，同时计算 SHA-256；超过 MAX_UPLOAD_BYTES 返回 413
+    
+    Returns:
+        (临时文件路径, SHA-256, 字节数)，调用方负责改名或删除
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(413, f"文件超过 {MAX_UPLOAD_BYTES // 1024 // 1024}MB 上限")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, digest.hexdigest(), size
 
-# ============ 后台任务 ============
+def store_spooled(tmp_path: Path, sha256: str, suffix: str) -> Path:
+    """临时文件改名为 <sha256><suffix>，相同内容已存在时丢弃临时文件"""
+    file_path = UPLOAD_DIR / f"{sha256}{suffix}"
+    if file_path.exists():
+        tmp_path.unlink()
+    else:
+        os.replace(tmp_path, file_path)
+    return file_path
 
-async def process_file(task_id: str, file: UploadFile):
-    """后台处理文件解析"""
-    import asyncio
+def unpack_archive(archive_path: Path, archive_name: Optional[str] = None) -> Tuple[List[Tuple[str, Path, str, int]], List[dict]]:
+    """
+    逐个成员分块解压 zip 到 UPLOAD_DIR（在线程中执行），与 spool_upload 相同的哈希命名
     
-    task = tasks_db[task_id]
-    task["status"] = "processing"
+    只取 PDF/PPT/PPTX，忽略目录和 macOS 元数据；按实际解压字节数限制单个文件（MAX_UPLOAD_BYTES）
+    和整个包（MAX_ARCHIVE_UNPACKED_BYTES）的大小，防止压缩炸弹
     
+    Returns:
+        ([(文件名, 路径, SHA-256, 字节数)], [跳过的文件及原因])
+    """
+    entries, skipped = [], []
+    unpacked = 0  # 整个包已解压的字节数
     try:
-        # 模拟解析过程
-        for i in range(1, 11):
-            await asyncio.sleep(0.5)
-            task["progress"] = i * 10
-        
-        # 模拟解析结果
-        task["result"] = {
-            "supplier": task.get("supplier_name", "未知供应商"),
-            "products": [
-                {"name": "A4 打印", "supplier_price": 0.1, "retail_price": 0.15},
-                {"name": "名片印刷", "supplier_price": 50, "retail_price": 80},
-            ]
-        }
-        task["status"] = "completed"
-        task["progress"] = 100
-        
-    except Exception as e:
-        task["status"] = "failed"
-        task["error"] = str(e)
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        return entries, [{"filename": archive_name or archive_path.name, "reason": "压缩包损坏"}]
+    
+    with archive:
+        for info in archive.infolist():
+            name = Path(info.filename).name
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or name.startswith("."):
+                continue
+            if not name.lower().endswith(ALLOWED_SUFFIXES):
+                skipped.append({"filename": info.filename, "reason": "不支持的文件类型"})
+                continue
+            if len(entries) >= MAX_BATCH_FILES:
+                skipped.append({"filename": info.filename, "reason": f"超过单批 {MAX_BATCH_FILES} 个文件上限"})
+                continue
+            if unpacked >= MAX_ARCHIVE_UNPACKED_BYTES:
+                skipped.append({"filename": info.filename, "reason": archive_limit_reason()})
+                continue
+            
+            digest = hashlib.sha256()
+            size = 0
+            tmp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+            try:
+                with archive.open(info) as src, open(tmp_path, "wb") as f:
+                    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        unpacked += len(chunk)
+                        if size > MAX_UPLOAD_BYTES:
+                            raise ValueError(f"文件超过 {MAX_UPLOAD_BYTES // 1024 // 1024}MB 上限")
+                        if unpacked > MAX_ARCHIVE_UNPACKED_BYTES:
+                            raise ValueError(archive_limit_reason())
+                        digest.update(chunk)
+                        f.write(chunk)
+            except (ValueError, RuntimeError, zipfile.BadZipFile, NotImplementedError) as e:
+                # 超限、CRC 错误、加密或不支持的压缩方式：跳过该文件，其余照常处理
+                tmp_path.unlink(missing_ok=True)
+                skipped.append({"filename": info.filename, "reason": str(e)})
+                continue
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            
+            sha256 = digest.hexdigest()
+            file_path = store_spooled(tmp_path, sha256, Path(name).suffix.lower())
+            entries.append((name, file_path, sha256, size))
+    return entries, skipped
+
+def archive_limit_reason() -> str:
+    return f"压缩包解压后超过 {MAX_ARCHIVE_UNPACKED_BYTES // 1024 // 1024}MB 上限"
+
+# ============ 任务事件 ============
+
+def queue_full_error(e: QueueFull) -> HTTPException:
+    """队列满 -> 429 + Retry-After"""
+    return HTTPException(429, str(e), headers={"Retry-After": str(e.retry_after)})
+
+def sse_message(event: str, data: dict) -> str:
+    """格式化一条 SSE 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def finished_pages(task: dict) -> List[Tuple[int, list]]:
+    """已完成页面的产品：完成的任务取最终结果，进行中的任务取断点"""
+    pages = {}
+    if task["status"] == "completed":
+        for p in (task.get("result") or {}).get("products", []):
+            pages.setdefault(p.get("page", 0), []).append(p)
+    else:
+        checkpoint = checkpoints.load(task["task_id"])
+        if checkpoint:
+            pages = checkpoint.pages
+    return sorted(pages.items())
+
+async def apply_event(event: dict):
+    """
+    把 worker 上报的解析事件写回任务状态，再推送给订阅者
+    
+    先写库再推送：客户端收到 completed 后立即查询任务或导入时，看到的已是完成状态。
+    写库在线程中执行，不阻塞事件循环（队列按顺序 await，事件不会乱序）
+    """
+    task_id = event["task_id"]
+    values = {}
+    if event["type"] == "started":
+        values = {"status": "processing", "started_at": datetime.now()}
+    elif event["type"] == "page":
+        # 最后一页完成到结果汇总之间仍保持 99
+        total = event["total_pages"] or 1
+        values = {"progress": min(99, event["pages_done"] * 100 // total)}
+    elif event["type"] == "completed":
+        values = {"status": "completed", "progress": 100, "result": event["result"], "completed_at": datetime.now()}
+    elif event["type"] == "failed":
+        values = {"status": "failed", "error": event["error"], "completed_at": datetime.now()}
+    if values:
+        try:
+            await asyncio.to_thread(task_store.update, task_id, **values)
+        except Exception as e:
+            print(f"任务状态写入失败 {task_id}: {e}")
+    event_broker.publish(event)
+
+async def fail_orphaned_tasks():
+    """
+    启动时：数据库中排队中 / 解析中、但队列里已没有的任务（local 队列在内存中，重启即丢；
+    Redis 数据丢失）标记为失败，之后可以 resume 从断点继续，也不会挡住重新上传
+    """
+    orphaned = [
+        task_id for task_id in await asyncio.to_thread(task_store.unfinished_ids)
+        if not await job_queue.is_active(task_id)
+    ]
+    count = await asyncio.to_thread(task_store.fail_unfinished, orphaned, INTERRUPTED_ERROR)
+    if count:
+        print(f"⚠️ {count} 个任务因服务重启中断，已标记为失败（可 resume）")
+
+def purge_expired_tasks():
+    """删除过期任务及其断点、不再被引用的上传文件（在线程中调用）"""
+    for task in task_store.purge_expired():
+        checkpoints.delete(task["task_id"])
+        if task["file_path"] and not task_store.hash_in_use(task["file_sha256"]):
+            Path(task["file_path"]).unlink(missing_ok=True)
+
+async def invalidate_products(ids: List[int]):
+    """
+    失效知识库 API 中这些产品的缓存（导入、重新生成向量后调用）；
+    知识库 API 是独立进程，需要两边都配置 CATALOG_CACHE_BACKEND=redis，否则只能等 TTL 过期
+    """
+    if catalog_cache is not None and ids:
+        await catalog_cache.invalidate("product", ids)
+
+async def purge_tasks_periodically():
+    """定期删除过期的已完成/失败任务，以及不再被引用的上传文件和断点"""
+    while True:
+        await asyncio.sleep(TASK_PURGE_INTERVAL)
+        try:
+            await asyncio.to_thread(purge_expired_tasks)
+        except Exception as e:
+            print(f"清理过期任务失败: {e}")
 
 # ============ 健康检查 ============
 
@@ -3,12 +3,20 @@
 import { useState, useCallback } from 'react';
 import { useDropzone } from 'react-dropzone';
 
+interface Product {
+  name: string;
+  retail_price?: number;
+  unit?: string;
+  page?: number;
+}
+
 interface Task {
   task_id: string;
   filename: string;
   status: 'queued' | 'processing' | 'completed' | 'failed';
   progress: number;
   created_at: string;
+  products?: Product[];
 }
 
 export default function UploadPage() {
@@ -18,48 +26,69 @@ export default function UploadPage() {
   const onDrop = useCallback(async (acceptedFiles: File[]) => {
     setUploading(true);
     
+    // 单个文件走普通上传；多个文件或压缩包一次请求提交整批
+    const isBatch = acceptedFiles.length > 1 || acceptedFiles.some(f => f.name.toLowerCase().endsWith('.zip'));
+    const formData = new FormData();
     for (const file of acceptedFiles) {
-      const formData = new FormData();
-      formData.append('file', file);
+      formData.append(isBatch ? 'files' : 'file', file);
+    }
+    
+    try {
+      const res = await fetch(isBatch ? '/api/v1/upload/batch' : '/api/v1/upload', {
+        method: 'POST',
+        body: formData,
+      });
       
-      try {
-        const res = await fetch('/api/v1/upload', {
-          method: 'POST',
-          body: formData,
-        });
-        
-        if (res.ok) {
-          const task = await res.json();
-          setTasks(prev => [task, ...prev]);
-          // 开始轮询状态
-          pollTaskStatus(task.task_id);
+      if (res.ok) {
+        const data = await res.json();
+        const created: Task[] = isBatch ? data.tasks : [data];
+        if (isBatch && data.skipped.length > 0) {
+          console.warn('以下文件未入队:', data.skipped);
         }
-      } catch (error) {
-        console.error('上传失败:', error);
+        setTasks(prev => [...created, ...prev]);
+        // 订阅进度推送
+        created.forEach(task => subscribeTaskEvents(task.task_id));
       }
+    } catch (error) {
+      console.error('上传失败:', error);
     }
     
     setUploading(false);
   }, []);
 
-  const pollTaskStatus = async (taskId: string) => {
-    const interval = setInterval(async () => {
-      try {
-        const res = await fetch(`/api/v1/tasks/${taskId}`);
-        if (res.ok) {
-          const status = await res.json();
-          setTasks(prev => 
-            prev.map(t => t.task_id === taskId ? { ...t, ...status } : t)
-          );
-          
-          if (status.status === 'completed' || status.status === 'failed') {
-            clearInterval(interval);
-          }
-        }
-      } catch (error) {
-        clearInterval(interval);
-      }
-    }, 1000);
+  const subscribeTaskEvents = (taskId: string) => {
+    const updateTask = (patch: (t: Task) => Partial<Task>) =>
+      setTasks(prev => prev.map(t => t.task_id === taskId ? { ...t, ...patch(t) } : t));
+
+    const source = new EventSource(`/api/v1/tasks/${taskId}/events`);
+
+    source.addEventListener('progress', (e) => {
+      const data = JSON.parse((e as MessageEvent).data);
+      updateTask(() => ({ status: data.status, progress: data.progress }));
+    });
+
+    // 每页解析完就显示该页产品，不用等整份文档；
+    // 断线自动重连后服务端会重放已完成的页，按页码替换而不是追加，避免重复
+    source.addEventListener('page', (e) => {
+      const data = JSON.parse((e as MessageEvent).data);
+      const pageProducts = data.products.map((p: Product) => ({ ...p, page: data.page }));
+      updateTask(t => ({
+        status: 'processing',
+        progress: data.progress ?? t.progress,
+        products: [...(t.products ?? []).filter(p => p.page !== data.page), ...pageProducts]
+          .sort((a, b) => (a.page ?? 0) - (b.page ?? 0)),
+      }));
+    });
+
+    source.addEventListener('completed', () => {
+      updateTask(() => ({ status: 'completed', progress: 100 }));
+      source.close();
+    });
+
+    source.addEventListener('failed', () => {
+      updateTask(() => ({ status: 'failed' }));
+      source.close();
+    });
   };
 
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
@@ -68,6 +97,7 @@ export default function UploadPage() {
       'application/pdf': ['.pdf'],
       'application/vnd.ms-powerpoint': ['.ppt'],
       'application/vnd.openxmlformats-officedocument.presentationml.presentation': ['.pptx'],
+      'application/zip': ['.zip'],
     },
     maxSize: 50 * 1024 * 1024, // 50MB
   });
@@ -111,7 +141,7 @@ export default function UploadPage() {
                 拖拽文件到这里，或点击选择文件
               </p>
               <p className="text-sm text-gray-400">
-                支持格式：PDF、PPT、PPTX | 单文件最大 50MB
+                支持格式：PDF、PPT、PPTX、ZIP | 单文件最大 50MB
               </p>
             </>
           )}
@@ -137,7 +167,7 @@ export default function UploadPage() {
                       <p className="font-medium text-gray-900">{task.filename}</p>
                       <p className="text-sm text-gray-500">
                         {task.status === 'processing' 
-                          ? `解析中... ${task.progress}%` 
+                          ? `解析中... ${task.progress}%，已提取 ${task.products?.length ?? 0} 个产品` 
                           : task.status === 'completed'
                           ? '解析完成'
                           : task.status === 'failed'
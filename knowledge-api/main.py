@@ -95,6 +95,7 @@ class StatsResponse(BaseModel):
     """统计信息响应"""
     loaded: bool
     model: Optional[str] = None
+    generated_at: Optional[str] = None
     total_documents: Optional[int] = None
     embedding_dim: Optional[int] = None
     categories: Optional[dict] = None
@@ -29,6 +29,7 @@ class KnowledgeSearch:
         self.embeddings: np.ndarray = None
         self.model = None
         self.model_name: str = ""
+        self.generated_at: Optional[str] = None
         self._loaded = False
     
     def load(self) -> bool:
@@ -44,6 +45,7 @@ class KnowledgeSearch:
             data = json.load(f)
         
         self.model_name = data["metadata"]["model"]
+        self.generated_at = data["metadata"].get("generated_at")
         self.documents = data["documents"]
         
         # 提取嵌入向量为 numpy 数组（加速计算）
@@ -167,6 +169,7 @@ class KnowledgeSearch:
         return {
             "loaded": True,
             "model": self.model_name,
+            "generated_at": self.generated_at,
             "total_documents": len(self.documents),
             "embedding_dim": self.embeddings.shape[1] if self.embeddings is not None else 0,
             "categories": categories
@@ -3,6 +3,13 @@
 
 -- 启用向量扩展
 CREATE EXTENSION IF NOT EXISTS vector;
+-- 名称模糊检索（三元组）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 检索用文本：小写 + 汉字两侧加空格，让中文按单字参与三元组匹配（与 services/text_search.py 一致）
+CREATE OR REPLACE FUNCTION search_text(s TEXT) RETURNS TEXT AS $$
+  SELECT regexp_replace(lower(s), '([一-鿿])', ' \1 ', 'g')
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
 
 -- 供应商表
 CREATE TABLE suppliers (
@@ -36,7 +43,9 @@ CREATE TABLE products (
   min_quantity INT DEFAULT 1,
   description TEXT,
   image_url VARCHAR(500),
-  embedding VECTOR(1536), -- OpenAI embedding
+  embedding VECTOR(1536), -- 产品向量（EMBEDDING_BACKEND，services/embedding_jobs.py 回填）
+  embedding_hash VARCHAR(40), -- 生成向量时的 模型 + 文本 哈希
+  embedded_updated_at TIMESTAMP, -- 生成向量时行的 updated_at，与当前值不同即待回填
   created_at TIMESTAMP DEFAULT NOW(),
   updated_at TIMESTAMP DEFAULT NOW()
 );
@@ -54,7 +63,7 @@ CREATE TABLE price_history (
   product_id INT REFERENCES products(id) ON DELETE CASCADE,
   supplier_price DECIMAL(10,2),
   retail_price DECIMAL(10,2),
-  changed_at TIMESTAMP DEFAULT NOW(),
+  changed_at TIMESTAMP NOT NULL DEFAULT NOW(),
   changed_by VARCHAR(100)
 );
 
@@ -63,6 +72,8 @@ CREATE TABLE parse_tasks (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
   filename VARCHAR(255) NOT NULL,
   file_path VARCHAR(500),
+  file_sha256 CHAR(64), -- 文件内容哈希，相同文件复用解析结果
+  file_size BIGINT,
   supplier_name VARCHAR(255),
   status VARCHAR(50) DEFAULT 'queued', -- queued/processing/completed/failed
   progress INT DEFAULT 0,
@@ -74,11 +85,35 @@ CREATE TABLE parse_tasks (
   created_by VARCHAR(100)
 );
 
+-- 批量上传批次（子任务 ID 列表，去重复用的任务也记入）
+CREATE TABLE parse_batches (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  supplier_name VARCHAR(255),
+  task_ids JSONB NOT NULL,
+  skipped JSONB, -- 未入队的文件及原因
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
 -- 索引
 CREATE INDEX idx_products_supplier ON products(supplier_id);
+-- 导入按 (供应商, 产品名) upsert（ON CONFLICT 需要唯一索引）
+CREATE UNIQUE INDEX idx_products_supplier_name ON products(supplier_id, name);
+-- 导入时按名称查找/创建供应商（INSERT ... ON CONFLICT，并发导入不会重复创建）；
+-- 已有库先合并同名供应商再建索引
+CREATE UNIQUE INDEX idx_suppliers_name ON suppliers(name);
 CREATE INDEX idx_products_name ON products USING gin(to_tsvector('simple', name));
-CREATE INDEX idx_parse_tasks_status ON parse_tasks(status);
-CREATE INDEX idx_price_history_product ON price_history(product_id);
+-- 名称包含/相似检索（LIKE 与 <% 都可走索引，前置通配符也不会全表扫描）
+CREATE INDEX idx_products_name_trgm ON products USING gin(search_text(name) gin_trgm_ops);
+CREATE INDEX idx_suppliers_name_trgm ON suppliers USING gin(search_text(name) gin_trgm_ops);
+-- 任务列表按 (created_at, id) 游标分页；状态过滤 + 同序分页共用 idx_parse_tasks_status
+CREATE INDEX idx_parse_tasks_status ON parse_tasks(status, created_at DESC, id DESC);
+CREATE INDEX idx_parse_tasks_created ON parse_tasks(created_at DESC, id DESC);
+CREATE INDEX idx_parse_tasks_sha256 ON parse_tasks(file_sha256);
+CREATE INDEX idx_parse_batches_created ON parse_batches(created_at);
+-- 按时刻查价格（每个产品倒序取 changed_at <= 时刻 的第一行），也覆盖按 product_id 的查询
+CREATE INDEX idx_price_history_product_time ON price_history(product_id, changed_at DESC, id DESC);
 
 -- 向量相似度搜索索引
 CREATE INDEX idx_products_embedding ON products USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+-- 待回填向量的产品（条件与 services/embedding_jobs.py 的 STALE_CONDITION 一致）
+CREATE INDEX idx_products_embedding_stale ON products(id) WHERE embedded_updated_at IS DISTINCT FROM updated_at;
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+DocumentParser 多页打包基准
+对比逐页请求与多页打包的请求数、prompt token 数和总耗时（不调用真实 LLM）
+
+用法:
+    python scripts/bench-parser-packing.py --pages 40 --latency 1.5 --pack 1 4 8
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from services.parser import DocumentParser, DEFAULT_PACK_PAGES  # noqa: E402
+
+
+class FakeCompletions:
+    """模拟 chat.completions：固定延迟，按提示词中的页码返回产品"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def create(self, model, messages, max_tokens=None):
+        content = messages[0]["content"]
+        text = content[0]["text"]
+        images = content[1:]
+
+        # prompt token 估算：中文约 1 字 1 token，A4 150dpi 图片按 DocumentParser 的估算约 1105
+        prompt_tokens = len(text) + 1105 * len(images)
+        time.sleep(self.latency)
+
+        page_nos = [int(n) for n in re.findall(r"第 (\d+) 页", text)]
+        if page_nos:
+            body = {"pages": [
+                {"page": no, "products": [{"name": f"产品{no}", "retail_price": no}]}
+                for no in page_nos
+            ]}
+        else:
+            body = {"products": [{"name": "产品", "retail_price": 1}]}
+
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(body, ensure_ascii=False)))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens),
+        )
+
+
+def make_pages(count: int):
+    """生成稀疏页面（A4 150dpi，少量文字）"""
+    pages = []
+    for i in range(count):
+        img = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(img)
+        draw.text((100, 100), f"Page {i + 1}  A4 print 0.15/page", fill="black")
+        pages.append(img)
+    return pages
+
+
+def run(pages, pack: int, latency: float) -> dict:
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(latency)))
+    parser = DocumentParser(client=client, pack_pages=pack, use_rules=False)
+    parser._pdf_to_images = lambda _path: pages
+
+    start = time.perf_counter()
+    result = parser.parse_file("bench.pdf", "基准供应商")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "pack_pages": pack,
+        "pages": len(pages),
+        "requests": parser.stats["requests"],
+        "prompt_tokens": parser.stats["prompt_tokens"],
+        "products": len(result["products"]),
+        "wall_time_s": round(elapsed, 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--pages", type=int, default=40, help="页数")
+    ap.add_argument("--latency", type=float, default=1.0, help="模拟单次 LLM 延迟（秒）")
+    ap.add_argument("--pack", type=int, nargs="+", default=[1, DEFAULT_PACK_PAGES], help="打包页数（1 为逐页）")
+    args = ap.parse_args()
+
+    pages = make_pages(args.pages)
+    results = [run(pages, pack, args.latency) for pack in args.pack]
+
+    print(f"{'打包页数':>8} {'请求数':>6} {'prompt tokens':>14} {'耗时(s)':>8}")
+    for r in results:
+        print(f"{r['pack_pages']:>8} {r['requests']:>6} {r['prompt_tokens']:>14} {r['wall_time_s']:>8}")
+    print(json.dumps(results, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+DocumentParser 离线基准
+生成已知内容的 PDF/PPTX 样本，启动本地假 OpenAI 兼容服务（可配置延迟），
+按解析模式统计 页/分钟、峰值内存和各阶段耗时，结果输出为 JSON 便于跟踪回归
+
+用法:
+    python scripts/bench-parser.py --pages 20 --latency 0.8 --output bench.json
+    python scripts/bench-parser.py --modes pdf-single pdf-packed --responses canned.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import re
+from pathlib import Path
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+# 样本内容：每页的产品行（PPTX 用于规则模式，PDF 为纯图片页走 LLM）
+SAMPLE_LINES = [
+    "名片 300g铜版纸 0.3元/张，100张起订",
+    "户外喷绘 35元/平方 起订10平方",
+    "易拉宝 80x200cm 65元/个 3天出货",
+]
+# 促销行（规则模式不应提取为产品，也不应拉低页置信度）
+PROMO_LINES = [
+    "满100元包邮",
+    "会员价8折, 满200元减20元",
+]
+
+MODES = {
+    "pdf-single": {"fixture": "pdf", "pack_pages": 1, "use_rules": False},
+    "pdf-packed": {"fixture": "pdf", "pack_pages": 4, "use_rules": False},
+    "pptx-rules": {"fixture": "pptx", "pack_pages": 1, "use_rules": True},
+}
+
+
+# ============ 样本生成 ============
+
+def make_pdf(path: Path, pages: int):
+    """生成纯图片 PDF（A4 150dpi，无文本层），每页几行英文价格说明"""
+    from PIL import Image, ImageDraw
+
+    images = []
+    for i in range(pages):
+        img = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(img)
+        draw.text((100, 100), f"Page {i + 1}", fill="black")
+        for j, line in enumerate(["Business card 0.3/pc", "Banner 35/m2", "Roll-up 65/pc"]):
+            draw.text((100, 200 + j * 40), line, fill="black")
+        images.append(img)
+    images[0].save(path, save_all=True, append_images=images[1:])
+
+
+def make_pptx(path: Path, slides: int):
+    """生成每页带价格文本框的 PPTX"""
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    layout = prs.slide_layouts[6]  # 空白版式
+    for _ in range(slides):
+        slide = prs.slides.add_slide(layout)
+        box = slide.shapes.add_textbox(Inches(1), Inches(1), Inches(8), Inches(4))
+        frame = box.text_frame
+        frame.text = SAMPLE_LINES[0]
+        for line in SAMPLE_LINES[1:] + PROMO_LINES:
+            frame.add_paragraph().text = line
+    prs.save(path)
+
+
+# ============ 假 OpenAI 服务 ============
+
+class FakeLLMServer:
+    """本地 OpenAI 兼容服务：POST /v1/chat/completions，固定延迟后返回预设回复"""
+
+    def __init__(self, latency: float = 0.5, responses: list = None):
+        self.latency = latency
+        self.responses = responses or []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reply_for(self, text: str) -> str:
+        """预设回复按请求次数轮换；未配置时按提示词里的页码生成"""
+        with self._lock:
+            n = self.requests
+            self.requests += 1
+        if self.responses:
+            return self.responses[n % len(self.responses)]
+
+        product = {"name": "名片", "supplier_price": 0.2, "retail_price": 0.3, "unit": "张"}
+        page_nos = [int(no) for no in re.findall(r"第 (\d+) 页", text)]
+        if page_nos:
+            body = {"pages": [{"page": no, "products": [product] * 3} for no in page_nos]}
+        else:
+            body = {"products": [product] * 3}
+        return "```json\n" + json.dumps(body, ensure_ascii=False) + "\n```"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                content = payload["messages"][0]["content"]
+                text = content[0]["text"] if isinstance(content, list) else content
+                images = len(content) - 1 if isinstance(content, list) else 0
+
+                time.sleep(server.latency)
+                reply = server.reply_for(text)
+                body = json.dumps({
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "gpt-4o"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        # 中文约 1 字 1 token，A4 150dpi 图片约 1105 token
+                        "prompt_tokens": len(text) + 1105 * images,
+                        "completion_tokens": len(reply),
+                        "total_tokens": len(text) + 1105 * images + len(reply),
+                    },
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ============ 单模式运行（子进程，峰值内存互不干扰） ============
+
+def run_mode(mode: str, fixture: str, base_url: str, pages: int) -> dict:
+    from openai import OpenAI
+    from services.parser import DocumentParser
+
+    conf = MODES[mode]
+    client = OpenAI(api_key="bench", base_url=base_url, max_retries=0)
+    parser = DocumentParser(client=client, pack_pages=conf["pack_pages"], use_rules=conf["use_rules"])
+
+    start = time.perf_counter()
+    result = parser.parse_file(fixture, "基准供应商")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "pages": result["total_pages"],
+        "products": len(result["products"]),
+        "expected_products": pages * len(SAMPLE_LINES),
+        "requests": parser.stats["requests"],
+        "prompt_tokens": parser.stats["prompt_tokens"],
+        "rule_pages": parser.stats["rule_pages"],
+        "wall_time_s": round(elapsed, 3),
+        "pages_per_min": round(result["total_pages"] / elapsed * 60, 1) if elapsed else None,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "stages_s": {k: round(v, 4) for k, v in parser.timings.items()},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, default=20, help="样本页数")
+    ap.add_argument("--latency", type=float, default=0.5, help="假 LLM 单次延迟（秒）")
+    ap.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES), help="解析模式")
+    ap.add_argument("--responses", help="预设回复 JSON 文件（字符串数组，按请求轮换）")
+    ap.add_argument("--output", help="结果 JSON 输出路径，默认打印到标准输出")
+    ap.add_argument("--run", help=argparse.SUPPRESS)
+    ap.add_argument("--fixture", help=argparse.SUPPRESS)
+    ap.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    # 子进程：只跑一个模式，结果写到标准输出最后一行
+    if args.run:
+        print(json.dumps(run_mode(args.run, args.fixture, args.base_url, args.pages)))
+        return
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r", encoding="utf-8") as f:
+            responses = json.load(f)
+
+    server = FakeLLMServer(args.latency, responses).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fixtures = {"pdf": Path(tmpdir) / "catalog.pdf", "pptx": Path(tmpdir) / "catalog.pptx"}
+            make_pdf(fixtures["pdf"], args.pages)
+            make_pptx(fixtures["pptx"], args.pages)
+
+            for mode in args.modes:
+                print(f"▶ {mode}", file=sys.stderr)
+                proc = subprocess.run(
+                    [sys.executable, __file__, "--run", mode, "--pages", str(args.pages),
+                     "--fixture", str(fixtures[MODES[mode]["fixture"]]), "--base-url", server.base_url],
+                    capture_output=True, text=True, cwd=ROOT,
+                )
+                if proc.returncode != 0:
+                    print(proc.stderr, file=sys.stderr)
+                    results.append({"mode": mode, "error": proc.stderr.strip().splitlines()[-1:]})
+                    continue
+                results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    finally:
+        server.stop()
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {"pages": args.pages, "latency_s": args.latency, "canned_responses": bool(responses)},
+        "results": results,
+    }
+
+    print(f"{'模式':<12} {'页/分钟':>8} {'请求数':>6} {'峰值内存(MB)':>12}  阶段耗时(s)", file=sys.stderr)
+    for r in results:
+        if "error" in r:
+            print(f"{r['mode']:<12} 失败: {r['error']}", file=sys.stderr)
+            continue
+        stages = " ".join(f"{k}={v}" for k, v in r["stages_s"].items())
+        print(f"{r['mode']:<12} {r['pages_per_min']:>8} {r['requests']:>6} "
+              f"{r['peak_rss_kb'] / 1024:>12.1f}  {stages}", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+WebhookBot 发送基准
+本机启动一个假的企微 webhook（可配置处理延迟，可选自签名 HTTPS），
+对比 100 条消息突发时：每条消息新建连接（原实现） / 共享连接池逐条发送 / send_many 并发发送
+
+用法:
+    python scripts/bench-webhook-bot.py --messages 100 --rounds 5
+    python scripts/bench-webhook-bot.py --latency 0.02 --concurrency 10
+    python scripts/bench-webhook-bot.py --tls          # 需要 openssl 命令，握手开销更接近真实环境
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "wecom"))
+from webhook_bot import WebhookBot  # noqa: E402
+
+
+def make_stub(latency: float):
+    """最小 ASGI 应用：读完请求体，等待 latency 秒，返回 errcode 0"""
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        more = True
+        while more:
+            message = await receive()
+            more = message.get("more_body", False)
+        if latency:
+            await asyncio.sleep(latency)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"errcode":0,"errmsg":"ok"}'})
+    return app
+
+
+def self_signed_cert(directory: Path):
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+async def send_unpooled(url: str, messages, verify):
+    """原实现：每条消息一个新的 AsyncClient"""
+    for data in messages:
+        async with httpx.AsyncClient(verify=verify) as client:
+            (await client.post(url, json=data)).json()
+
+
+async def send_pooled(bot: WebhookBot, messages):
+    for data in messages:
+        await bot._send(data)
+
+
+async def timed(coro_factory, rounds: int):
+    """返回每轮耗时（毫秒）"""
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await coro_factory()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label: str, samples, messages: int):
+    samples = sorted(samples)
+    median = samples[len(samples) // 2]
+    print(f"{label:<28} 每轮 {median:8.1f}ms（中位数） 每条 {median / messages:6.2f}ms  "
+          f"最快 {samples[0]:8.1f}ms 最慢 {samples[-1]:8.1f}ms")
+    return median
+
+
+async def run(args):
+    ssl_args = {}
+    verify = True
+    scheme = "http"
+    if args.tls:
+        cert, key = self_signed_cert(Path(tempfile.mkdtemp()))
+        ssl_args = {"ssl_certfile": str(cert), "ssl_keyfile": str(key)}
+        verify = False
+        scheme = "https"
+
+    config = uvicorn.Config(make_stub(args.latency), host="127.0.0.1", port=args.port, log_level="warning",
+                            **ssl_args)
+    server = uvicorn.Server(config)
+    serve = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    url = f"{scheme}://127.0.0.1:{args.port}/cgi-bin/webhook/send?key=bench"
+    messages = [{"msgtype": "text", "text": {"content": f"消息 {i}"}} for i in range(args.messages)]
+    print(f"{args.messages} 条消息 × {args.rounds} 轮，服务端延迟 {args.latency * 1000:.0f}ms，{scheme.upper()}\n")
+
+    try:
+        baseline = report("每条新建连接（原实现）", await timed(lambda: send_unpooled(url, messages, verify), args.rounds),
+                          args.messages)
+        bot = WebhookBot(webhook_url=url)
+        await bot.start()
+        if args.tls:
+            # 自签名证书：换成不校验证书、其余参数相同的客户端
+            await bot.close()
+            bot._client = httpx.AsyncClient(verify=False, timeout=bot.timeout,
+                                            limits=httpx.Limits(max_connections=bot.max_connections,
+                                                                max_keepalive_connections=bot.max_connections))
+        try:
+            pooled = report("共享连接池，逐条发送", await timed(lambda: send_pooled(bot, messages), args.rounds),
+                            args.messages)
+            many = report(f"send_many（并发 {args.concurrency}）",
+                          await timed(lambda: bot.send_many(messages, args.concurrency), args.rounds), args.messages)
+        finally:
+            await bot.close()
+        print(f"\n共享连接池比原实现快 {baseline / pooled:.1f} 倍，send_many 快 {baseline / many:.1f} 倍")
+    finally:
+        server.should_exit = True
+        await serve
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--messages", type=int, default=100, help="每轮突发的消息数")
+    ap.add_argument("--rounds", type=int, default=5, help="轮数（取中位数）")
+    ap.add_argument("--latency", type=float, default=0.0, help="假 webhook 每条消息的处理延迟（秒）")
+    ap.add_argument("--concurrency", type=int, default=5, help="send_many 并发数")
+    ap.add_argument("--port", type=int, default=8766, help="假 webhook 端口")
+    ap.add_argument("--tls", action="store_true", help="假 webhook 使用自签名 HTTPS")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+知识库 API 查询次数检查
+在临时 SQLite 库中写入样本，统计每个接口单次请求执行的 SQL 条数，
+超过预期（出现逐行查询，N+1）时以非零状态退出，可放进 CI
+
+用法:
+    python scripts/check-query-count.py
+    python scripts/check-query-count.py --products 200 --verbose
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# (路径, 参数, 最多 SQL 条数)；条数与返回行数无关
+CASES = [
+    ("/api/v1/products/with-supplier", {"limit": 50, "cursor": ""}, 1),
+    ("/api/v1/products/with-supplier", {"limit": 50, "q": "名片"}, 1),
+    ("/api/v1/products/with-supplier", {"limit": 50, "supplier_id": 1}, 1),
+    ("/api/v1/products/1/with-supplier", {}, 1),
+    ("/api/v1/products", {"limit": 50, "cursor": ""}, 1),
+]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--products", type=int, default=100, help="样本产品数")
+    ap.add_argument("--verbose", action="store_true", help="打印执行的 SQL")
+    args = ap.parse_args()
+
+    db_path = Path(tempfile.mkdtemp()) / "check-query-count.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    import api.knowledge as knowledge
+
+    app = knowledge.create_app()
+    statements = []
+
+    @event.listens_for(knowledge.engine.sync_engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    failed = 0
+    with TestClient(app) as client:
+        for i in range(3):
+            client.post("/api/v1/suppliers", json={"name": f"供应商{i}"})
+        body = "\n".join(
+            f'{{"name": "铜版纸名片 {i}", "supplier_id": {i % 3 + 1}}}' for i in range(args.products)
+        )
+        client.post("/api/v1/products/batch", content=body.encode())
+        # 首次检索建 FTS 表的语句不计入
+        client.get("/api/v1/products", params={"q": "名片"})
+
+        for path, params, expected in CASES:
+            statements.clear()
+            r = client.get(path, params=params)
+            rows = len(r.json()) if isinstance(r.json(), list) else 1
+            ok = r.status_code == 200 and len(statements) <= expected
+            failed += not ok
+            print(f"{'✅' if ok else '❌'} GET {path} {params}: {rows} 行，{len(statements)} 条 SQL（预期 ≤ {expected}）")
+            if args.verbose or not ok:
+                for statement in statements:
+                    print("    " + " ".join(statement.split())[:200])
+
+    asyncio.run(knowledge.engine.dispose())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
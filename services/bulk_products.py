@@ -0,0 +1,247 @@
+"""
+产品批量写入
+请求体边读边解析（JSON 数组或 NDJSON），每 BULK_CHUNK_ROWS 行一个事务，多行 INSERT ... ON CONFLICT 写入，
+内存占用与导入总行数无关；单行出错只跳过该行并报告行号
+
+按 (supplier_id, name) 合并；没有 supplier_id 的产品按名称与其他无供应商的同名产品合并
+（唯一索引中 NULL 互不冲突，不能用 ON CONFLICT，见 _upsert_unowned）
+"""
+import os
+import json
+import codecs
+from typing import AsyncIterator, Any, List, Dict, Tuple
+
+from sqlalchemy import select, tuple_, or_, func, text, update, insert as sql_insert
+from sqlalchemy.exc import DBAPIError
+
+from services.price_history import price_changes, record_changes
+
+# 每个分块的行数（一个事务）
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "1000"))
+
+# upsert 时更新的列（冲突键 supplier_id + name 不变）
+UPDATE_COLUMNS = ("supplier_price", "retail_price", "unit", "min_quantity", "description", "image_url")
+
+# 列长度与 products 表一致，提前拦截，避免整块 INSERT 失败
+MAX_LENGTHS = {"name": 255, "unit": 50, "image_url": 500}
+
+
+async def iter_json_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    逐个产出请求体中的对象：以 [ 开头按 JSON 数组解析，否则按 NDJSON（每行一个对象）
+
+    格式错误抛 ValueError
+    """
+    parser = _JsonRows()
+    async for chunk in chunks:
+        for obj in parser.feed(chunk):
+            yield obj
+        if parser.error:
+            raise ValueError(parser.error)
+    for obj in parser.feed(b"", final=True):
+        yield obj
+    if parser.error:
+        raise ValueError(parser.error)
+
+
+class _JsonRows:
+    """增量解析状态：缓冲区只保留最后一个不完整的对象；出错前解析出的对象照常返回"""
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.mode = None  # array / ndjson
+        self.closed = False
+        self.error = None
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[Any]:
+        buf = self.buf + self.utf8.decode(chunk, final=final)
+        objs = []
+        pos = 0
+        while True:
+            # 跳过空白和数组元素之间的逗号
+            while pos < len(buf) and (buf[pos].isspace() or (self.mode == "array" and buf[pos] == ",")):
+                pos += 1
+            if pos >= len(buf):
+                break
+            if self.closed:
+                self.error = "JSON 数组结束后还有多余内容"
+                break
+            if self.mode is None:
+                self.mode = "array" if buf[pos] == "[" else "ndjson"
+                pos += self.mode == "array"
+                continue
+            if self.mode == "array" and buf[pos] == "]":
+                self.closed = True
+                pos += 1
+                continue
+            try:
+                obj, end = self.decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    self.error = "请求体不是合法的 JSON 数组或 NDJSON"
+                break  # 对象不完整，等下一块
+            # 数字等标量可能被分块截断，没有后续内容时等下一块再确认
+            if end == len(buf) and not final and not isinstance(obj, (dict, list)):
+                break
+            objs.append(obj)
+            pos = end
+        self.buf = buf[pos:]
+
+        if final and self.mode == "array" and not self.closed and not self.error:
+            self.error = "JSON 数组不完整"
+        return objs
+
+
+def check_lengths(row: Dict) -> List[str]:
+    return [f"{key} 超过 {limit} 个字符" for key, limit in MAX_LENGTHS.items() if len(row.get(key) or "") > limit]
+
+
+def upsert_chunk(conn, table, rows: List[Tuple[int, Dict]], on_conflict: str = "update", history=None) -> Dict[str, list]:
+    """
+    写入一块产品（调用方负责外层事务；异步引擎用 await conn.run_sync(upsert_chunk, ...)）
+
+    Args:
+        table: products 表（Product.__table__）
+        history: price_history 表；传入时新产品和价格变化的产品整块写一次价格历史
+        rows: [(请求中的行号, 字段字典)]；同一块内 (supplier_id, name) 相同的行以最后一行为准，
+            前面的行在 errors 中报告（同一条 INSERT 不能两次更新同一行）
+        on_conflict: update 覆盖已有产品 / skip 保留已有产品
+
+    Returns:
+        {"created": [id], "updated": [id], "unchanged": [id], "errors": [{"index", "error"}]}
+    """
+    result = {"created": [], "updated": [], "unchanged": [], "errors": []}
+    latest = {}
+    for index, values in rows:
+        key = (values.get("supplier_id"), values["name"])
+        if key in latest:
+            result["errors"].append({"index": latest[key][0], "error": f"与第 {index} 行重复（同一供应商、同名产品），以第 {index} 行为准"})
+        latest[key] = (index, values)
+    rows = sorted(latest.values(), key=lambda row: row[0])
+    try:
+        with conn.begin_nested():
+            _merge(result, _upsert(conn, table, rows, on_conflict, history))
+    except DBAPIError:
+        # 整块失败时逐行重试，定位出错的行，其余照常写入
+        for row in rows:
+            try:
+                with conn.begin_nested():
+                    _merge(result, _upsert(conn, table, [row], on_conflict, history))
+            except DBAPIError as e:
+                result["errors"].append({"index": row[0], "error": str(e.orig).strip()})
+    return result
+
+
+def _merge(result: Dict[str, list], part: Dict[str, list]):
+    for key, values in part.items():
+        result[key].extend(values)
+
+
+def _upsert(conn, table, rows: List[Tuple[int, Dict]], on_conflict: str, history=None) -> Dict[str, list]:
+    """rows 中 (supplier_id, name) 已去重"""
+    result = {"created": [], "updated": [], "unchanged": []}
+    owned = [values for _, values in rows if values.get("supplier_id") is not None]
+    unowned = [values for _, values in rows if values.get("supplier_id") is None]
+    if owned:
+        _merge(result, _upsert_owned(conn, table, owned, on_conflict, history))
+    if unowned:
+        _merge(result, _upsert_unowned(conn, table, unowned, on_conflict, history))
+    return result
+
+
+def _upsert_owned(conn, table, values_list: List[Dict], on_conflict: str, history=None) -> Dict[str, list]:
+    """有供应商的产品：多行 INSERT ... ON CONFLICT (supplier_id, name)"""
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    # 冲突前已存在的产品，用于区分新建 / 更新 / 未变
+    keys = [(values["supplier_id"], values["name"]) for values in values_list]
+    existing = {}
+    old_prices = {}
+    if keys:
+        found = conn.execute(
+            select(table.c.id, table.c.supplier_id, table.c.name, table.c.supplier_price, table.c.retail_price)
+            .where(tuple_(table.c.supplier_id, table.c.name).in_(keys))
+        ).all()
+        existing = {(r.supplier_id, r.name): r.id for r in found}
+        old_prices = {r.id: (r.supplier_price, r.retail_price) for r in found}
+
+    stmt = insert(table)
+    if on_conflict == "skip":
+        stmt = stmt.on_conflict_do_nothing(index_elements=["supplier_id", "name"])
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["supplier_id", "name"],
+            set_={**{c: stmt.excluded[c] for c in UPDATE_COLUMNS}, "updated_at": func.now()},
+            # 内容没变的行不写，重复导入不产生更新
+            where=or_(*[table.c[c].is_distinct_from(stmt.excluded[c]) for c in UPDATE_COLUMNS]),
+        )
+    # executemany + RETURNING：SQLAlchemy insertmanyvalues 拼成多行 VALUES，语句只编译一次并缓存
+    returned = conn.execute(
+        stmt.returning(table.c.id, table.c.supplier_id, table.c.name, table.c.supplier_price, table.c.retail_price),
+        values_list
+    ).all()
+    if history is not None:
+        record_changes(conn, history, price_changes((r._mapping for r in returned), old_prices, "batch"))
+
+    result = {"created": [], "updated": [], "unchanged": []}
+    written = set()
+    for r in returned:
+        key = (r.supplier_id, r.name)
+        written.add(key)
+        result["updated" if key in existing else "created"].append(r.id)
+    for key, product_id in existing.items():
+        if key not in written:
+            result["unchanged"].append(product_id)
+    return result
+
+
+def _upsert_unowned(conn, table, values_list: List[Dict], on_conflict: str, history=None) -> Dict[str, list]:
+    """
+    没有供应商的产品：按名称查找 supplier_id IS NULL 的产品，有则更新（同名多条时取 ID 最小的），
+    没有则插入。PostgreSQL 上先取事务级咨询锁，并发导入同名产品时不会各自新建一条
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('products:unowned'))"))
+    columns = (table.c.id, table.c.name, table.c.supplier_price, table.c.retail_price)
+    found = conn.execute(
+        select(*columns)
+        .where(table.c.supplier_id.is_(None), table.c.name.in_([values["name"] for values in values_list]))
+        .order_by(table.c.id)
+    ).all()
+    existing = {}
+    for r in found:
+        existing.setdefault(r.name, r)
+    old_prices = {r.id: (r.supplier_price, r.retail_price) for r in existing.values()}
+
+    result = {"created": [], "updated": [], "unchanged": []}
+    written = []
+    new_rows = [values for values in values_list if values["name"] not in existing]
+    if new_rows:
+        inserted = conn.execute(sql_insert(table).returning(*columns), new_rows).all()
+        result["created"].extend(r.id for r in inserted)
+        written.extend(inserted)
+    for values in values_list:
+        row = existing.get(values["name"])
+        if row is None:
+            continue
+        changed = None
+        if on_conflict != "skip":
+            changed = conn.execute(
+                update(table)
+                .where(table.c.id == row.id, or_(*[table.c[c].is_distinct_from(values.get(c)) for c in UPDATE_COLUMNS]))
+                .values(**{c: values.get(c) for c in UPDATE_COLUMNS}, updated_at=func.now())
+                .returning(*columns)
+            ).first()
+        if changed is None:
+            result["unchanged"].append(row.id)
+        else:
+            result["updated"].append(row.id)
+            written.append(changed)
+    if history is not None:
+        record_changes(conn, history, price_changes((r._mapping for r in written), old_prices, "batch"))
+    return result
@@ -0,0 +1,212 @@
+"""
+产品 / 供应商读穿缓存
+get_product / get_supplier 先查缓存，未命中再查库并写入；写操作提交后按 ID 精确失效
+
+- local: 进程内 LRU + TTL（默认），多进程部署时各进程各自缓存，其他进程的写入靠 TTL 兜底；
+  api.main（上传导入）是另一个进程，它导入的产品在知识库 API 中最多旧 CATALOG_CACHE_TTL 秒
+- redis: 共用 docker-compose 中的 Redis，多进程 / api.main 的导入也能互相失效（需要两边都配置
+  CATALOG_CACHE_BACKEND=redis）
+
+缓存的是响应字典（model_dump 结果），不是 ORM 对象
+"""
+import os
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+CATALOG_CACHE_BACKEND = os.getenv("CATALOG_CACHE_BACKEND", "local")  # local / redis / off
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "10000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))  # 秒
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+REDIS_KEY_PREFIX = "printshop:catalog"
+# 记录失效次数的键数上限，超出时淘汰最早失效的键
+CATALOG_GENERATIONS_SIZE = 100_000
+
+
+class LocalBackend:
+    """OrderedDict 实现的 LRU，条目为 (过期时间, 写入时间, 值)"""
+    name = "local"
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[2], entry[1]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        now = time.time()
+        self.entries[key] = (now + ttl, now, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, keys: Iterable[str]):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    def size(self) -> int:
+        return len(self.entries)
+
+
+class RedisBackend:
+    """Redis SETEX，值为 {"v": 值, "t": 写入时间} 的 JSON"""
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis.asyncio as redis
+
+        self.client = redis.Redis.from_url(url)
+        self.evictions = 0  # 由 Redis 自行淘汰，不统计
+
+    async def get(self, key: str) -> Optional[tuple]:
+        raw = await self.client.get(f"{REDIS_KEY_PREFIX}:{key}")
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["v"], data["t"]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        data = json.dumps({"v": value, "t": time.time()}, ensure_ascii=False, default=str)
+        await self.client.set(f"{REDIS_KEY_PREFIX}:{key}", data, ex=max(1, int(ttl)))
+
+    async def delete(self, keys: Iterable[str]):
+        keys = [f"{REDIS_KEY_PREFIX}:{key}" for key in keys]
+        if keys:
+            await self.client.delete(*keys)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class CatalogCache:
+    """读穿缓存 + 命中率 / 数据年龄统计"""
+
+    def __init__(self, backend, ttl: float = CATALOG_CACHE_TTL, window: int = 1000):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+        # 命中时返回数据的年龄（秒），即最多可能落后数据库多久
+        self.ages = deque(maxlen=window)
+        # 每个键的失效次数：查库期间被失效的结果不写回，避免把旧数据放回缓存。
+        # 按最近失效排序，超出上限淘汰最早失效的键（早已不在查库途中），不影响正在进行的判断
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+
+    async def get_or_load(self, kind: str, key_id: int, loader: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """
+        Args:
+            kind: product / supplier
+            loader: 未命中时查库，返回响应字典；不存在返回 None（不缓存）
+        """
+        key = f"{kind}:{key_id}"
+        try:
+            cached = await self.backend.get(key)
+        except Exception as e:
+            # 缓存不可用时直接查库
+            self.errors += 1
+            print(f"目录缓存读取失败: {e}")
+            cached = None
+        if cached is not None:
+            value, cached_at = cached
+            self.hits += 1
+            self.ages.append(time.time() - cached_at)
+            return value
+
+        self.misses += 1
+        generation = self._generations.get(key, 0)
+        value = await loader()
+        if value is not None and self._generations.get(key, 0) == generation:
+            try:
+                await self.backend.set(key, value, self.ttl)
+            except Exception as e:
+                self.errors += 1
+                print(f"目录缓存写入失败: {e}")
+        return value
+
+    async def invalidate(self, kind: str, ids: Iterable[int]):
+        """写操作提交后调用"""
+        keys = [f"{kind}:{i}" for i in ids]
+        if not keys:
+            return
+        for key in keys:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._generations.move_to_end(key)
+        while len(self._generations) > CATALOG_GENERATIONS_SIZE:
+            self._generations.popitem(last=False)
+        self.invalidations += len(keys)
+        try:
+            await self.backend.delete(keys)
+        except Exception as e:
+            self.errors += 1
+            print(f"目录缓存失效失败: {e}")
+
+    def snapshot(self) -> Dict:
+        lookups = self.hits + self.misses
+        ages = sorted(self.ages)
+        return {
+            "backend": self.backend.name,
+            "ttl_seconds": self.ttl,
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.backend.evictions,
+            "errors": self.errors,
+            "age_seconds": {
+                "avg": round(sum(ages) / len(ages), 3) if ages else 0.0,
+                "p95": round(ages[int(len(ages) * 0.95)], 3) if ages else 0.0,
+                "max": round(ages[-1], 3) if ages else 0.0,
+            },
+        }
+
+
+class _NoBackend:
+    """CATALOG_CACHE_BACKEND=off：每次都查库，统计照常"""
+    name = "off"
+    evictions = 0
+
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value, ttl):
+        pass
+
+    async def delete(self, keys):
+        pass
+
+    def size(self):
+        return 0
+
+
+def create_catalog_cache() -> CatalogCache:
+    """按 CATALOG_CACHE_BACKEND 创建"""
+    if CATALOG_CACHE_BACKEND == "redis":
+        return CatalogCache(RedisBackend())
+    if CATALOG_CACHE_BACKEND == "off":
+        return CatalogCache(_NoBackend())
+    return CatalogCache(LocalBackend())
+
+
+def create_remote_invalidator() -> Optional[CatalogCache]:
+    """
+    供其他进程（api.main 的导入、向量回填）失效知识库 API 的缓存：只有 redis 后端跨进程，
+    local / off 时返回 None（在本进程建 LRU 没有人读，失效了也传不到知识库 API）
+    """
+    if CATALOG_CACHE_BACKEND == "redis":
+        return CatalogCache(RedisBackend())
+    return None
@@ -0,0 +1,153 @@
+"""
+解析任务断点存储
+每解析完一页就持久化该页结果，进程崩溃或重新部署后可跳过已完成页面继续解析
+"""
+import os
+import json
+from pathlib import Path
+from typing import List, Dict, Optional
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Checkpoint:
+    """任务断点：任务参数 + 已完成页面（页码 -> 产品列表）"""
+    task_id: str
+    meta: Dict
+    pages: Dict[int, List[Dict]] = field(default_factory=dict)
+
+
+class CheckpointStore:
+    """断点存储接口"""
+
+    def start(self, task_id: str, meta: Dict):
+        """登记新任务（meta 至少包含 file_path / supplier_name）"""
+        raise NotImplementedError
+
+    def save_page(self, task_id: str, page_no: int, products: List[Dict]):
+        """保存一页的解析结果，返回前必须已落盘"""
+        raise NotImplementedError
+
+    def load(self, task_id: str) -> Optional[Checkpoint]:
+        """读取断点，不存在返回 None"""
+        raise NotImplementedError
+
+    def delete(self, task_id: str):
+        """删除断点（任务过期清理时调用）"""
+        raise NotImplementedError
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    本地文件断点：每个任务一个 JSONL 文件
+    第一行为任务参数，之后每行一页，追加写入后 fsync
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = Path(directory or os.getenv("PARSE_CHECKPOINT_DIR", "uploads/checkpoints"))
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, task_id: str) -> Path:
+        return self.directory / f"{task_id}.jsonl"
+
+    def _append(self, task_id: str, record: Dict):
+        with open(self._path(task_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, task_id: str, meta: Dict):
+        self._append(task_id, {"meta": meta})
+
+    def save_page(self, task_id: str, page_no: int, products: List[Dict]):
+        self._append(task_id, {"page": page_no, "products": products})
+
+    def load(self, task_id: str) -> Optional[Checkpoint]:
+        path = self._path(task_id)
+        if not path.exists():
+            return None
+
+        checkpoint = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能只写了一半，跳过即可（该页会重新解析）
+                    continue
+                if "meta" in record:
+                    checkpoint = Checkpoint(task_id=task_id, meta=record["meta"])
+                elif checkpoint is not None:
+                    checkpoint.pages[record["page"]] = record["products"]
+        return checkpoint
+
+    def delete(self, task_id: str):
+        self._path(task_id).unlink(missing_ok=True)
+
+
+class PgCheckpointStore(CheckpointStore):
+    """
+    PostgreSQL 断点：写入 parse_tasks.result 的 checkpoint 字段
+    结构为 {"checkpoint": {"meta": {...}, "pages": {"1": [...], ...}}}
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def start(self, task_id: str, meta: Dict):
+        from sqlalchemy import text
+
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO parse_tasks (id, filename, file_path, supplier_name, status, result)
+                VALUES (CAST(:task_id AS uuid), :filename, :file_path, :supplier_name, 'processing',
+                        jsonb_build_object('checkpoint',
+                            jsonb_build_object('meta', CAST(:meta AS jsonb), 'pages', '{}'::jsonb)))
+                ON CONFLICT (id) DO UPDATE SET
+                    result = COALESCE(parse_tasks.result, '{}'::jsonb) || EXCLUDED.result
+            """), {
+                "task_id": task_id,
+                "filename": Path(meta["file_path"]).name,
+                "file_path": meta["file_path"],
+                "supplier_name": meta.get("supplier_name"),
+                "meta": json.dumps(meta, ensure_ascii=False),
+            })
+
+    def save_page(self, task_id: str, page_no: int, products: List[Dict]):
+        from sqlalchemy import text
+
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE parse_tasks
+                SET result = jsonb_set(result, ARRAY['checkpoint', 'pages', :page], CAST(:products AS jsonb))
+                WHERE id = CAST(:task_id AS uuid)
+            """), {
+                "task_id": task_id,
+                "page": str(page_no),
+                "products": json.dumps(products, ensure_ascii=False),
+            })
+
+    def load(self, task_id: str) -> Optional[Checkpoint]:
+        from sqlalchemy import text
+
+        with self.engine.connect() as conn:
+            row = conn.execute(text("""
+                SELECT result->'checkpoint' FROM parse_tasks WHERE id = CAST(:task_id AS uuid)
+            """), {"task_id": task_id}).first()
+        if not row or not row[0]:
+            return None
+
+        data = row[0]
+        return Checkpoint(
+            task_id=task_id,
+            meta=data.get("meta", {}),
+            pages={int(no): products for no, products in data.get("pages", {}).items()},
+        )
+
+    def delete(self, task_id: str):
+        from sqlalchemy import text
+
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE parse_tasks SET result = result - 'checkpoint' WHERE id = CAST(:task_id AS uuid)
+            """), {"task_id": task_id})
@@ -0,0 +1,139 @@
+"""
+知识库数据库连接
+products / suppliers / price_history 等表所在的 PostgreSQL
+
+- 同步引擎（psycopg2）：解析结果导入、产品检索等在线程中执行的任务
+- 异步引擎（asyncpg）：api/knowledge.py 的 CRUD 接口
+两者共用连接池参数，连接池状态和取连接等待时间由 PoolMetrics 统计
+"""
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/printshop")
+
+# 连接池
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # 取连接最长等待（秒），超时返回 503
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# 单条语句超时（毫秒），0 表示不限制
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+_engine: Optional[Engine] = None
+
+
+def async_url(url: str) -> str:
+    """同步连接串 -> 异步驱动（postgresql -> asyncpg，sqlite -> aiosqlite）"""
+    u = make_url(url)
+    if u.get_backend_name() == "postgresql":
+        u = u.set(drivername="postgresql+asyncpg")
+    elif u.get_backend_name() == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+    return u.render_as_string(hide_password=False)
+
+
+def engine_options(url: str, settings: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    create_engine / create_async_engine 参数
+
+    Args:
+        settings: 额外的 PostgreSQL 会话参数（连接建立时设置，如 pg_trgm 阈值）
+    """
+    u = make_url(url)
+    if u.get_backend_name() != "postgresql":
+        return {}
+
+    settings = dict(settings or {})
+    if DB_STATEMENT_TIMEOUT_MS:
+        settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+    if u.get_driver_name() == "asyncpg":
+        connect_args = {"server_settings": settings}
+    else:
+        connect_args = {"options": " ".join(f"-c {k}={v}" for k, v in settings.items())}
+
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
+
+
+class PoolMetrics:
+    """连接池指标：使用中 / 空闲 / 溢出连接数，取连接等待时间，超时次数"""
+
+    def __init__(self, engine: Engine, window: int = 1000):
+        self.pool = engine.pool
+        self.waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "connect", self._on_connect)
+
+    def _on_checkout(self, *_):
+        self.checkouts += 1
+
+    def _on_connect(self, *_):
+        self.connects += 1
+
+    def observe_wait(self, seconds: float):
+        self.waits.append(seconds)
+
+    def snapshot(self) -> Dict:
+        waits = sorted(self.waits)
+        status = {}
+        # QueuePool 才有这些统计（SQLite 内存库等用其他连接池）
+        for name in ("size", "checkedout", "checkedin", "overflow"):
+            fn = getattr(self.pool, name, None)
+            if fn:
+                status[name] = fn()
+        return {
+            "pool": type(self.pool).__name__,
+            **status,
+            "in_use": status.get("checkedout"),
+            "max_connections": status.get("size", 0) + max(getattr(self.pool, "_max_overflow", 0), 0),
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "timeouts": self.timeouts,
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95)] * 1000, 3) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 3) if waits else 0.0,
+            },
+        }
+
+
+class timed_checkout:
+    """统计从连接池取连接的等待时间：with timed_checkout(metrics): 取连接"""
+
+    def __init__(self, metrics: PoolMetrics):
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+        if exc_type is not None and issubclass(exc_type, PoolTimeout):
+            self.metrics.timeouts += 1
+        self.metrics.observe_wait(time.perf_counter() - self.start)
+        return False
+
+
+def get_engine() -> Engine:
+    """首次使用时才创建，API 启动不依赖知识库可用"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+    return _engine
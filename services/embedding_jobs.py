@@ -0,0 +1,253 @@
+"""
+产品向量回填（仅 PostgreSQL）
+后台按 ID 顺序分批为 embedding 缺失或过期的产品生成向量，写入 products.embedding
+
+- 过期：embedded_updated_at（生成向量时行的 updated_at）与当前 updated_at 不同，
+  由部分索引 idx_products_embedding_stale 定位，新增 / 修改 / 导入后自动进入待处理
+- 只改了价格等非文本字段的行：文本哈希（含模型名）没变，不重新编码，只更新 embedded_updated_at
+- 进度保存在数据本身：中断后重启从未完成的行继续
+- 限速：每秒最多 EMBEDDING_MAX_ROWS_PER_SEC 行，批次之间至少间隔 EMBEDDING_BATCH_PAUSE 秒
+
+独立运行（一次性回填，处理完退出）：
+    python -m services.embedding_jobs
+    python -m services.embedding_jobs --reset   # 更换模型后全部重新生成
+"""
+import os
+import time
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from services.db import get_engine
+from services.embeddings import create_embedder, to_pgvector
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_ROWS_PER_SEC = float(os.getenv("EMBEDDING_MAX_ROWS_PER_SEC", "50"))
+EMBEDDING_BATCH_PAUSE = float(os.getenv("EMBEDDING_BATCH_PAUSE", "0.2"))
+# 没有待处理的行时的轮询间隔（秒）；写入接口可以 wake() 提前唤醒
+EMBEDDING_POLL_SECONDS = float(os.getenv("EMBEDDING_POLL_SECONDS", "30"))
+# 编码 / 写库失败后的重试间隔上限（秒）
+EMBEDDING_MAX_BACKOFF = 300
+
+# 与 schema.sql 中 idx_products_embedding_stale 的条件一致，才能走部分索引
+STALE_CONDITION = "embedded_updated_at IS DISTINCT FROM updated_at"
+
+PENDING_SQL = f"""
+SELECT id, name, unit, description, updated_at, embedding_hash
+FROM products
+WHERE {STALE_CONDITION} AND id > :after
+ORDER BY id
+LIMIT :limit
+"""
+
+# updated_at 不等说明编码期间行又被修改，跳过，留给下一轮
+WRITE_EMBEDDING_SQL = """
+UPDATE products
+SET embedding = CAST(:embedding AS vector), embedding_hash = :hash, embedded_updated_at = updated_at
+WHERE id = :id AND updated_at = :updated_at
+"""
+
+MARK_FRESH_SQL = """
+UPDATE products SET embedded_updated_at = updated_at
+WHERE id = :id AND updated_at = :updated_at
+"""
+
+STATUS_SQL = f"""
+SELECT
+  count(*) AS total,
+  count(*) FILTER (WHERE embedding_hash IS NULL) AS missing,
+  count(*) FILTER (WHERE embedding_hash IS NOT NULL AND {STALE_CONDITION}) AS stale
+FROM products
+"""
+
+
+def embedding_text(row) -> str:
+    """参与向量的文本：名称、单位、描述"""
+    return "\n".join(part for part in (row["name"], row["unit"], row["description"]) if part)
+
+
+def text_hash(model: str, value: str) -> str:
+    return hashlib.sha1(f"{model}\n{value}".encode("utf-8")).hexdigest()
+
+
+def embedding_status(embedding_hash: Optional[str], embedded_updated_at, updated_at) -> str:
+    """单行的向量状态：missing 没有向量 / stale 生成后行有修改，等待回填检查 / fresh"""
+    if embedding_hash is None:
+        return "missing"
+    if embedded_updated_at != updated_at:
+        return "stale"
+    return "fresh"
+
+
+class EmbeddingBackfill:
+    """后台回填 worker：单任务顺序执行，编码和写库在线程中进行"""
+
+    def __init__(
+        self,
+        embedder,
+        engine=None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_rows_per_sec: float = EMBEDDING_MAX_ROWS_PER_SEC,
+        poll_seconds: float = EMBEDDING_POLL_SECONDS,
+        on_batch: Optional[Callable[[List[int]], Awaitable[None]]] = None
+    ):
+        """
+        Args:
+            on_batch: 每批写入后在事件循环中回调（参数为 embedding_status 变化的产品 ID：
+                重新生成了向量的和只更新了 embedded_updated_at 的），用于失效缓存
+        """
+        self.embedder = embedder
+        self._engine = engine
+        self.batch_size = batch_size
+        self.max_rows_per_sec = max_rows_per_sec
+        self.poll_seconds = poll_seconds
+        self.on_batch = on_batch
+        self.after = 0  # 本轮扫描到的 ID
+        self.embedded = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_batch_at: Optional[float] = None
+        self._task = None
+        self._wake = asyncio.Event()
+
+    @property
+    def engine(self):
+        return self._engine or get_engine()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def wake(self):
+        """有新写入时调用，不等轮询间隔立即开始处理"""
+        self._wake.set()
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                start = time.monotonic()
+                done, touched_ids = await asyncio.to_thread(self.run_batch)
+                if self.on_batch and touched_ids:
+                    await self.on_batch(touched_ids)
+                backoff = 1.0
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"向量回填失败，{backoff:.0f} 秒后重试: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, EMBEDDING_MAX_BACKOFF)
+                continue
+
+            if done:
+                # 限速：保护数据库和向量服务
+                await asyncio.sleep(max(EMBEDDING_BATCH_PAUSE, done / self.max_rows_per_sec - (time.monotonic() - start)))
+            else:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    def run_batch(self) -> Tuple[int, List[int]]:
+        """
+        处理一批，返回 (处理的行数, 状态由 stale / missing 变为 fresh 的产品 ID)；
+        扫描到表尾时从头开始下一轮，返回 0
+
+        文本没变、只标记为 fresh 的行也在返回的 ID 中，否则缓存里的产品会一直显示 stale
+        （编码期间被再次修改而没写入的行也在其中，多失效一次无妨）
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(PENDING_SQL), {"after": self.after, "limit": self.batch_size}).mappings().all()
+        if not rows:
+            self.after = 0
+            return 0, []
+
+        changed, unchanged = [], []
+        for row in rows:
+            value = embedding_text(row)
+            digest = text_hash(self.embedder.model, value)
+            if digest == row["embedding_hash"]:
+                unchanged.append({"id": row["id"], "updated_at": row["updated_at"]})
+            else:
+                changed.append((row, value, digest))
+
+        vectors = self.embedder.embed([value for _, value, _ in changed]) if changed else []
+        with self.engine.begin() as conn:
+            written = 0
+            if changed:
+                written = conn.execute(text(WRITE_EMBEDDING_SQL), [
+                    {"id": row["id"], "updated_at": row["updated_at"], "hash": digest, "embedding": to_pgvector(vector)}
+                    for (row, _, digest), vector in zip(changed, vectors)
+                ]).rowcount
+            if unchanged:
+                conn.execute(text(MARK_FRESH_SQL), unchanged)
+
+        # rowcount 为 -1 时驱动不支持 executemany 计数，按全部写入算
+        if written < 0:
+            written = len(changed)
+        self.embedded += written
+        self.skipped += len(changed) - written
+        self.unchanged += len(unchanged)
+        self.after = rows[-1]["id"]
+        self.last_batch_at = time.time()
+        return len(rows), [row["id"] for row, _, _ in changed] + [item["id"] for item in unchanged]
+
+    def backfill(self) -> Dict:
+        """同步处理完所有待处理的行（命令行一次性回填）"""
+        self.after = 0
+        while True:
+            start = time.monotonic()
+            done, _ = self.run_batch()
+            if not done:
+                return self.snapshot()
+            print(f"已处理到 ID {self.after}：生成 {self.embedded}，未变 {self.unchanged}")
+            time.sleep(max(0.0, done / self.max_rows_per_sec - (time.monotonic() - start)))
+
+    def counts(self) -> Dict:
+        """各状态的产品数"""
+        with self.engine.connect() as conn:
+            row = conn.execute(text(STATUS_SQL)).mappings().one()
+        return {**row, "fresh": row["total"] - row["missing"] - row["stale"]}
+
+    def snapshot(self) -> Dict:
+        return {
+            "model": self.embedder.model,
+            "running": self._task is not None and not self._task.done(),
+            "cursor": self.after,
+            "embedded": self.embedded,
+            "unchanged": self.unchanged,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_batch_at": self.last_batch_at,
+        }
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description="产品向量回填")
+    ap.add_argument("--reset", action="store_true", help="全部标记为待处理（更换模型后使用，文本和模型都没变的行不会重新编码）")
+    args = ap.parse_args()
+
+    embedder = create_embedder()
+    if embedder is None:
+        raise SystemExit("未配置向量模型：设置 EMBEDDING_BACKEND（openai / local / hash）或 OPENAI_API_KEY")
+    backfill = EmbeddingBackfill(embedder)
+    if args.reset:
+        with backfill.engine.begin() as conn:
+            conn.execute(text("UPDATE products SET embedded_updated_at = NULL"))
+    print(backfill.backfill())
+    print(backfill.counts())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+文本向量
+products.embedding 为 VECTOR(1536)，入库与查询必须用同一模型（EMBEDDING_BACKEND）：
+
+- openai: OpenAI text-embedding-3-small（配置了 OPENAI_API_KEY 时的默认值）
+- local: sentence-transformers 本地模型（与 knowledge-api 相同的多语言模型），离线可用；
+  依赖较大（含 torch），不在 requirements.txt 默认安装，需要时 pip install sentence-transformers
+- hash: 字符 n-gram 特征哈希，不需要模型文件，用于离线开发和测试
+- 包名.模块:类名: 自定义编码器，需提供 model 属性和 embed(texts) 方法
+
+维度不足 1536 的向量在末尾补零（余弦相似度不变）
+"""
+import os
+import zlib
+import math
+import importlib
+import importlib.util
+from typing import List, Optional
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_DIM = 1536
+
+
+class OpenAIEmbedder:
+    """OpenAI 兼容的 embeddings 接口"""
+
+    def __init__(self, client=None, model: str = EMBEDDING_MODEL):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = client
+        self.model = model
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        return [d.embedding for d in response.data]
+
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers 本地模型，首次使用时加载"""
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL):
+        # 启动时就报缺少依赖，而不是等到第一次编码（后台回填里只会反复重试）
+        if importlib.util.find_spec("sentence_transformers") is None:
+            raise ImportError("EMBEDDING_BACKEND=local 需要安装 sentence-transformers: pip install sentence-transformers")
+        self.model = model
+        self._encoder = None
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.model)
+        vectors = self._encoder.encode(texts, normalize_embeddings=True)
+        return [pad(v.tolist()) for v in vectors]
+
+
+class HashingEmbedder:
+    """
+    字符 1-gram + 2-gram 特征哈希到 EMBEDDING_DIM 维并归一化
+    没有语义，只反映字面相似度；不依赖任何模型，结果稳定
+    """
+    model = "hash-ngram-v1"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(t) for t in texts]
+
+    @staticmethod
+    def _embed_one(text: str) -> List[float]:
+        vector = [0.0] * EMBEDDING_DIM
+        chars = [c for c in (text or "").lower() if not c.isspace()]
+        grams = chars + [a + b for a, b in zip(chars, chars[1:])]
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            vector[h % EMBEDDING_DIM] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+
+def pad(vector: List[float], dim: int = EMBEDDING_DIM) -> List[float]:
+    """补零到列维度；超过维度说明模型与表结构不匹配"""
+    if len(vector) > dim:
+        raise ValueError(f"向量维度 {len(vector)} 超过 {dim}")
+    return list(vector) + [0.0] * (dim - len(vector))
+
+
+def create_embedder():
+    """
+    按 EMBEDDING_BACKEND 创建编码器；未设置时有 OPENAI_API_KEY 用 OpenAI，
+    否则返回 None（检索退化为纯全文，不做向量回填）
+    """
+    backend = EMBEDDING_BACKEND or ("openai" if os.getenv("OPENAI_API_KEY") else "")
+    if not backend:
+        return None
+    if backend == "openai":
+        return OpenAIEmbedder()
+    if backend == "local":
+        return SentenceTransformerEmbedder()
+    if backend == "hash":
+        return HashingEmbedder()
+    module, _, name = backend.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+def to_pgvector(vector: List[float]) -> str:
+    """向量 -> pgvector 文本格式，SQL 中配合 CAST(:v AS vector) 使用"""
+    return "[" + ",".join(f"{x:.7g}" for x in vector) + "]"
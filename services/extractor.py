@@ -0,0 +1,285 @@
+"""
+规则价格提取模块
+将 scripts/chat-extract.sql 中 tenant.extract_price / extract_quantity /
+parse_supplier_product 的正则移植到 Python，在调用 LLM 前先做确定性提取
+"""
+import re
+from typing import List, Dict, Optional
+from dataclasses import dataclass, field
+
+
+# ============ 预编译正则（与 chat-extract.sql 保持一致） ============
+
+# 价格：¥35、35元、35块、35/
+PRICE_RE = re.compile(r"(?:¥|￥)?(\d+(?:\.\d{1,2})?)\s*(?:元|块|/)", re.I)
+
+# 数量：500张、100个、200本
+QUANTITY_RE = re.compile(r"(\d+)\s*(?:张|个|本|份|盒|箱)", re.I)
+
+# 产品名称：常见印刷品/礼品/材料在前，其余按名称后缀（纸、布、板……）兜底
+KNOWN_NAMES = (
+    "名片", "画册", "宣传册", "海报", "易拉宝", "X展架", "条幅", "横幅", "锦旗", "奖牌", "奖杯",
+    "保温杯", "笔记本", "签字笔", "U盘", "充电宝", "雨伞", "背包", "礼盒",
+    "铜版纸", "哑粉纸", "白卡纸", "牛皮纸", "特种纸",
+    "写真", "喷绘", "背胶", "灯布", "车贴", "KT板", "PVC板", "亚克力",
+)
+NAME_RE = re.compile(
+    r"(" + "|".join(KNOWN_NAMES) + r"|"
+    r"[^\s,，、：:]+(?:纸|布|板|膜|杯|本|笔|盘|宝|伞|包|盒|牌|架))",
+    re.I,
+)
+
+# 规格：克重 / 尺寸 / 开数
+WEIGHT_RE = re.compile(r"(\d+)[gG克]")
+SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*[xX×*]\s*(\d+(?:\.\d+)?)\s*(mm|cm|m|米)?", re.I)
+FORMAT_RE = re.compile(r"(大?16开|A[34]|对开|四开|八开)", re.I)
+
+# 价格格式1: ¥35/㎡, 35元/平方（同时给出计价单位）
+UNIT_PRICE_RE = re.compile(
+    r"(?:¥|￥)?(\d+(?:\.\d{1,2})?)\s*(?:元|块)?[/每]\s*(平方|㎡|张|个|本|盒|套|份|米|m)", re.I
+)
+# 价格格式2: 单价35元
+LABELED_PRICE_RE = re.compile(r"(?:单价|价格|报价)[：:\s]*(?:¥|￥)?(\d+(?:\.\d{1,2})?)", re.I)
+# 价格格式3: 35元起
+FROM_PRICE_RE = re.compile(r"(?:¥|￥)?(\d+(?:\.\d{1,2})?)\s*(?:元|块)?\s*起(?!订)", re.I)
+# 价格格式4: 500张35元（数量 + 总价，对应 chat-extract.sql 的价格阶梯）
+TIER_PRICE_RE = re.compile(r"(\d+)\s*(张|本|个|份|盒|套)[^\d]*?(\d+(?:\.\d{1,2})?)\s*(?:元|块)", re.I)
+
+# 起订量
+MIN_QTY_RE = re.compile(
+    r"(?:起订|最少|最低|MOQ)[：:\s]*(\d+)\s*(?:张|个|本|份|盒|箱|平方|㎡)?", re.I
+)
+MIN_QTY_SUFFIX_RE = re.compile(r"(\d+)\s*(?:张|个|本|份)?\s*起订", re.I)
+
+# 交期
+DELIVERY_RE = re.compile(
+    r"(?:交期|工期|周期|发货)[：:\s]*(\d+[-~到至]\d+|\d+)\s*(?:天|个?工作日|小时|h)", re.I
+)
+DELIVERY_SUFFIX_RE = re.compile(r"(\d+[-~到至]\d+|\d+)\s*(?:天|个?工作日)\s*(?:交货|发货|出货)", re.I)
+
+# 供应商名称
+SUPPLIER_RE = re.compile(r"([^\s,，、]+(?:厂|公司|店|印刷|广告))", re.I)
+
+# 促销用语：满100元包邮、满200元减20元、8折、会员价——其中的金额不是产品价格，提取前去掉
+PROMO_RE = re.compile(
+    r"满\s*\d+(?:\.\d+)?\s*(?:元|块|件|张|个|本|份)?\s*(?:减\s*\d+(?:\.\d+)?\s*(?:元|块)?|包邮|送[^\s,，。；;]*)?"
+    r"|包邮|打?\s*\d+(?:\.\d+)?\s*折(?!页)|会员价",
+    re.I,
+)
+
+# 名称兜底：去掉行首的列表序号
+LIST_MARK_RE = re.compile(r"^[\s\-•·*]*(?:\d+[.、)）]\s*)?")
+
+# 计价单位归一
+UNIT_ALIASES = {"平方": "㎡", "m": "米"}
+
+
+# ============ 单值提取（对应 SQL 辅助函数） ============
+
+def extract_price(text: str) -> Optional[float]:
+    """提取价格，对应 tenant.extract_price"""
+    m = PRICE_RE.search(text)
+    return float(m.group(1)) if m else None
+
+
+def extract_quantity(text: str) -> Optional[int]:
+    """提取数量，对应 tenant.extract_quantity"""
+    m = QUANTITY_RE.search(text)
+    return int(m.group(1)) if m else None
+
+
+def parse_supplier_product(text: str) -> Dict:
+    """解析供应商产品文本，对应 tenant.parse_supplier_product（字段名一致）"""
+    result: Dict = {}
+
+    m = NAME_RE.search(text)
+    if m:
+        result["name"] = m.group(1)
+
+    specs = {}
+    m = WEIGHT_RE.search(text)
+    if m:
+        specs["weight"] = m.group(1) + "g"
+    m = SIZE_RE.search(text)
+    if m:
+        specs["size"] = f"{m.group(1)}x{m.group(2)}{m.group(3) or ''}"
+    m = FORMAT_RE.search(text)
+    if m:
+        specs["format"] = m.group(1)
+    if specs:
+        result["specs"] = specs
+
+    price_unit = None
+    m = UNIT_PRICE_RE.search(text)
+    if m:
+        price_unit = m.group(2)
+    else:
+        m = LABELED_PRICE_RE.search(text) or FROM_PRICE_RE.search(text)
+    if m:
+        result["price"] = float(m.group(1))
+        if price_unit:
+            result["price_unit"] = UNIT_ALIASES.get(price_unit.lower(), price_unit)
+    else:
+        m = TIER_PRICE_RE.search(text)
+        if m:
+            # 500张35元：按整包计价，单位为 "500张"，起订量为包数量
+            result["price"] = float(m.group(3))
+            result["price_unit"] = f"{m.group(1)}{m.group(2)}"
+            result["min_order_qty"] = int(m.group(1))
+        else:
+            price = extract_price(text)
+            if price is not None:
+                result["price"] = price
+
+    m = MIN_QTY_RE.search(text) or MIN_QTY_SUFFIX_RE.search(text)
+    if m:
+        result["min_order_qty"] = int(m.group(1))
+
+    m = DELIVERY_RE.search(text) or DELIVERY_SUFFIX_RE.search(text)
+    if m:
+        result["delivery_time"] = m.group(1) + "天"
+
+    m = SUPPLIER_RE.search(text)
+    if m:
+        result["supplier_name"] = m.group(1)
+
+    return result
+
+
+# ============ 行 / 页级提取 ============
+
+@dataclass
+class ExtractResult:
+    """单行提取结果"""
+    product: Dict
+    confidence: float
+    source: str = ""
+
+
+@dataclass
+class PageExtract:
+    """整页提取结果"""
+    products: List[Dict] = field(default_factory=list)
+    confidence: float = 0.0
+
+
+def _leading_name(line: str) -> Optional[str]:
+    """取价格（或 "数量+总价"）之前的文字作为产品名称"""
+    m = (UNIT_PRICE_RE.search(line) or LABELED_PRICE_RE.search(line) or FROM_PRICE_RE.search(line)
+         or TIER_PRICE_RE.search(line) or PRICE_RE.search(line))
+    if not m:
+        return None
+    head = LIST_MARK_RE.sub("", line[:m.start()])
+    return head.strip(" \t:：|,，、-") or None
+
+
+def strip_promotions(line: str) -> str:
+    """去掉促销用语（满减、包邮、折扣），避免把 "满200元" 当成价格、"满100元包" 当成名称"""
+    return PROMO_RE.sub(" ", line)
+
+
+def extract_line(line: str) -> Optional[ExtractResult]:
+    """
+    从一行文本提取产品（先去掉促销用语）
+
+    Returns:
+        没有价格的行返回 None；置信度按名称/价格/单位/起订量命中情况累加
+    """
+    text = strip_promotions(line)
+    data = parse_supplier_product(text)
+    if "price" not in data:
+        return None
+
+    confidence = 0.4
+    name = data.get("name")
+    head = _leading_name(text)
+    first_word = head.split()[0] if head else None
+    if name and first_word and name in first_word and name != first_word:
+        # 名称只命中行首词的一部分（铜版纸名片 -> 铜版纸）：以整个词为名称，降低置信度交给 LLM 复核
+        name = first_word
+        confidence += 0.15
+    elif name and name not in KNOWN_NAMES:
+        # 只按后缀（纸、板、盒……）命中的名称
+        confidence += 0.15
+    elif name:
+        confidence += 0.4
+    else:
+        # 名称兜底：取价格前的文字，可信度较低
+        name = head
+        if name:
+            confidence += 0.25
+    if not name:
+        return None
+
+    if data.get("price_unit"):
+        confidence += 0.1
+    if data.get("min_order_qty"):
+        confidence += 0.1
+
+    product = {
+        "name": name,
+        "retail_price": data["price"],
+        "unit": data.get("price_unit"),
+        "min_quantity": data.get("min_order_qty", 1),
+        "description": line.strip(),
+    }
+    if data.get("specs"):
+        product["specs"] = data["specs"]
+    if data.get("delivery_time"):
+        product["delivery_time"] = data["delivery_time"]
+    return ExtractResult(product=product, confidence=round(min(confidence, 1.0), 2), source=line)
+
+
+def extract_products(text: str) -> PageExtract:
+    """
+    逐行提取整页文本中的产品
+
+    页置信度取各价格行置信度的平均值；没有价格行时为 0
+    """
+    page = PageExtract()
+    scores = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        r = extract_line(line)
+        if r is None:
+            # 只有促销用语的行（满100元包邮）不算解析失败
+            if PRICE_RE.search(strip_promotions(line)):
+                # 有价格但解析不出产品：拉低整页置信度，交给 LLM
+                scores.append(0.0)
+            continue
+        page.products.append(r.product)
+        scores.append(r.confidence)
+    if scores:
+        page.confidence = round(sum(scores) / len(scores), 2)
+    return page
+
+
+# 使用示例
+if __name__ == "__main__":
+    import time
+
+    samples = [
+        "名片 300g铜版纸 0.3元/张，100张起订",
+        "易拉宝 80x200cm 单价65元 3天出货",
+        "户外喷绘 35元/平方 起订10平方",
+        "A4 彩色打印 0.5元/张",
+        "铜版纸名片 0.3元/张，100张起订",
+        "名片 35元",
+        "名片500张35元",
+        "礼盒 12.5元/盒",
+        # 促销用语不是价格：前两行不提取产品，第三行价格为 35
+        "满100元包邮",
+        "会员价8折, 满200元减20元",
+        "名片 35元 满200元减20元",
+    ]
+    for s in samples:
+        print(s, "->", extract_line(s))
+
+    lines = samples * 2500
+    start = time.perf_counter()
+    for s in lines:
+        extract_line(s)
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(lines)} 行, {elapsed:.3f}s, {len(lines) / elapsed:.0f} 行/秒")
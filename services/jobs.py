@@ -0,0 +1,408 @@
+"""
+解析任务队列
+有界队列 + 固定数量的解析 worker，队列满时拒绝新任务（API 返回 429）
+
+- local: 进程内 asyncio 队列，解析在 ProcessPoolExecutor 子进程中执行，不占用 API 事件循环；
+  队列只在内存中，要求单个 API 进程，重启时未完成的任务由 API 标记为失败（可 resume）
+- redis: 任务写入 Redis 有序集合，由独立 worker 进程消费（python -m services.jobs）；
+  取出的任务先移入处理中集合（带可见性超时），解析完才删除，worker 被杀后超时重新入队
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, asdict
+from typing import Awaitable, Callable, Dict, Optional
+
+# 配置
+JOB_BACKEND = os.getenv("JOB_BACKEND", "local")  # local / redis
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+PARSE_QUEUE_SIZE = int(os.getenv("PARSE_QUEUE_SIZE", "20"))
+PARSE_PACK_PAGES = int(os.getenv("PARSE_PACK_PAGES", "1"))
+# 调度：按 入队时间 + 文件大小 / 该速率 排序，小文件先跑，大文件等得越久越靠前
+PARSE_PRIORITY_BYTES_PER_SEC = int(os.getenv("PARSE_PRIORITY_BYTES_PER_SEC", str(1024 * 1024)))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# Redis 键
+REDIS_QUEUE_KEY = "printshop:parse:queue"
+REDIS_EVENTS_KEY = "printshop:parse:events"
+# 处理中的任务：有序集合，分数为可见性截止时间，解析期间 worker 定时续期
+REDIS_PROCESSING_KEY = "printshop:parse:processing"
+# 已入队、尚未结束的 task_id（排队中 + 处理中，含等待超时重新入队的）
+REDIS_ACTIVE_KEY = "printshop:parse:active"
+REDIS_WAITS_KEY = "printshop:parse:waits"
+
+# 处理中的任务多久没有续期视为 worker 已退出（秒），重新入队
+PARSE_VISIBILITY_TIMEOUT = float(os.getenv("PARSE_VISIBILITY_TIMEOUT", "60"))
+# 队列为空时 worker 的轮询间隔（秒）
+PARSE_POLL_SECONDS = float(os.getenv("PARSE_POLL_SECONDS", "1"))
+
+# 原子地：把超时的处理中任务按原优先级放回队列，再取出优先级最高的任务移入处理中
+# KEYS: 队列, 处理中；ARGV: 当前时间, 可见性超时, PARSE_PRIORITY_BYTES_PER_SEC
+CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+  local job = cjson.decode(member)
+  redis.call('ZREM', KEYS[2], member)
+  redis.call('ZADD', KEYS[1], job['enqueued_at'] + (tonumber(job['file_size']) or 0) / tonumber(ARGV[3]), member)
+end
+local item = redis.call('ZPOPMIN', KEYS[1])
+if #item == 0 then
+  return false
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), item[1])
+return item[1]
+"""
+
+# 队列满时默认建议的重试间隔（秒），没有历史耗时数据时使用
+DEFAULT_RETRY_AFTER = 10
+
+
+class QueueFull(Exception):
+    """队列已满"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"解析队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+@dataclass
+class ParseJob:
+    """一个解析任务"""
+    task_id: str
+    file_path: str
+    supplier_name: Optional[str] = None
+    file_size: int = 0
+    enqueued_at: float = field(default_factory=time.time)
+
+    @property
+    def priority(self) -> float:
+        """越小越先执行：虚拟截止时间，避免小文件排在大画册后面，同时大文件不会饿死"""
+        return self.enqueued_at + self.file_size / PARSE_PRIORITY_BYTES_PER_SEC
+
+
+# ============ worker 端 ============
+
+def run_parse_job(job: ParseJob, events) -> None:
+    """
+    在 worker 进程中解析一个文件，进度通过 events.put(dict) 回传
+
+    事件类型: started / page / completed / failed
+    """
+    from services.parser import DocumentParser
+    from services.checkpoint import FileCheckpointStore
+
+    started_at = time.time()
+    events.put({"type": "started", "task_id": job.task_id, "wait_seconds": round(started_at - job.enqueued_at, 3)})
+
+    def on_page(page_no, products, done, total):
+        events.put({
+            "type": "page",
+            "task_id": job.task_id,
+            "page": page_no,
+            "products": products,
+            "pages_done": done,
+            "total_pages": total,
+        })
+
+    try:
+        parser = DocumentParser(
+            pack_pages=PARSE_PACK_PAGES,
+            checkpoints=FileCheckpointStore(),
+            on_page=on_page,
+        )
+        result = parser.parse_file(job.file_path, job.supplier_name, task_id=job.task_id)
+        events.put({
+            "type": "completed",
+            "task_id": job.task_id,
+            "result": result,
+            "run_seconds": round(time.time() - started_at, 3),
+        })
+    except Exception as e:
+        events.put({"type": "failed", "task_id": job.task_id, "error": str(e)})
+
+
+# ============ 队列统计 ============
+
+class WaitStats:
+    """最近任务的排队等待 / 运行耗时"""
+
+    def __init__(self, window: int = 100):
+        self.waits = deque(maxlen=window)
+        self.runs = deque(maxlen=window)
+
+    def snapshot(self) -> Dict:
+        waits = list(self.waits)
+        return {
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            "avg_run_seconds": round(sum(self.runs) / len(self.runs), 3) if self.runs else None,
+        }
+
+    def retry_after(self, workers: int) -> int:
+        """按平均运行时间估算队列腾出一个空位的时间"""
+        if not self.runs:
+            return DEFAULT_RETRY_AFTER
+        avg_run = sum(self.runs) / len(self.runs)
+        return max(1, round(avg_run / max(1, workers)))
+
+
+# ============ 本地队列 ============
+
+class LocalJobQueue:
+    """进程内有界优先队列，解析在进程池中执行"""
+
+    def __init__(self, on_event: Callable[[Dict], Awaitable[None]], workers: int = PARSE_WORKERS, maxsize: int = PARSE_QUEUE_SIZE):
+        self.on_event = on_event
+        self.workers = workers
+        self.maxsize = maxsize
+        self.running = 0
+        self.stats = WaitStats()
+        self._active = set()  # 已入队、尚未结束的 task_id
+        self.pool_restarts = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._events = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue(self.maxsize)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._manager = multiprocessing.Manager()
+        self._events = self._manager.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._pump()))
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._manager.shutdown()
+
+    async def ensure_capacity(self, count: int = 1):
+        """放不下 count 个任务时抛出 QueueFull（上传前检查，避免先落盘再拒绝）"""
+        if self.depth() + count > self.maxsize:
+            raise QueueFull(self.stats.retry_after(self.workers))
+
+    async def submit(self, job: ParseJob):
+        """入队，队列满时抛出 QueueFull"""
+        try:
+            # 序号保证同优先级先进先出，且不需要比较 ParseJob
+            self._seq += 1
+            self._queue.put_nowait((job.priority, self._seq, job))
+        except asyncio.QueueFull:
+            raise QueueFull(self.stats.retry_after(self.workers))
+        self._active.add(job.task_id)
+
+    async def is_active(self, task_id: str) -> bool:
+        """任务是否还在本队列中（排队或解析中）；重启前的任务不在"""
+        return task_id in self._active
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def snapshot(self) -> Dict:
+        return {
+            "backend": "local",
+            "depth": self.depth(),
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "running": self.running,
+            "pool_restarts": self.pool_restarts,
+            **self.stats.snapshot(),
+        }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self._queue.get()
+            self.running += 1
+            self.stats.waits.append(time.time() - job.enqueued_at)
+            pool = self._pool
+            try:
+                await loop.run_in_executor(pool, run_parse_job, job, self._events)
+            except BrokenProcessPool:
+                # 子进程异常退出（如被 OOM kill）：进程池整体不可用，池中正在解析的任务都会失败；
+                # 换一个新的进程池，后续任务不受影响。任务标记失败，断点保留可 resume
+                self._replace_pool(pool)
+                await self.on_event({"type": "failed", "task_id": job.task_id, "error": "解析进程异常退出（可能内存不足），可重试"})
+            except Exception as e:
+                await self.on_event({"type": "failed", "task_id": job.task_id, "error": str(e)})
+            finally:
+                self.running -= 1
+                self._active.discard(job.task_id)
+                self._queue.task_done()
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """多个 worker 同时发现同一个进程池损坏时只重建一次"""
+        if self._pool is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.pool_restarts += 1
+        print("⚠️ 解析进程池已损坏，已重建")
+
+    async def _pump(self):
+        """把子进程的进度事件转交给 API 进程"""
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, self._events.get)
+            if event["type"] == "completed":
+                self.stats.runs.append(event["run_seconds"])
+            await self.on_event(event)
+
+
+# ============ Redis 队列 ============
+
+class RedisEvents:
+    """worker 端事件写入 Redis 列表"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def put(self, event: Dict):
+        self.client.rpush(REDIS_EVENTS_KEY, json.dumps(event, ensure_ascii=False))
+
+
+class RedisJobQueue:
+    """
+    Redis 有界优先队列（有序集合），API 进程只负责入队和接收事件
+
+    API 进程使用 redis.asyncio，入队 / 统计不阻塞事件循环；worker 进程仍用同步客户端
+    """
+
+    def __init__(self, on_event: Callable[[Dict], Awaitable[None]], maxsize: int = PARSE_QUEUE_SIZE, url: str = REDIS_URL):
+        import redis.asyncio as redis
+
+        self.on_event = on_event
+        self.maxsize = maxsize
+        self.client = redis.Redis.from_url(url)
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._pump())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.client.aclose()
+
+    async def ensure_capacity(self, count: int = 1):
+        """放不下 count 个任务时抛出 QueueFull"""
+        if await self.depth() + count > self.maxsize:
+            raise QueueFull(DEFAULT_RETRY_AFTER)
+
+    async def submit(self, job: ParseJob):
+        """入队（有序集合，分数为优先级），ZCARD 与 ZADD 之间的竞争最多多放进几个任务，可以接受"""
+        await self.ensure_capacity()
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.sadd(REDIS_ACTIVE_KEY, job.task_id)
+            pipe.zadd(REDIS_QUEUE_KEY, {json.dumps(asdict(job), ensure_ascii=False): job.priority})
+            await pipe.execute()
+
+    async def is_active(self, task_id: str) -> bool:
+        """任务是否还在队列中（排队、解析中，或 worker 退出后等待重新入队）"""
+        return bool(await self.client.sismember(REDIS_ACTIVE_KEY, task_id))
+
+    async def depth(self) -> int:
+        return await self.client.zcard(REDIS_QUEUE_KEY)
+
+    async def snapshot(self) -> Dict:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zcard(REDIS_QUEUE_KEY)
+            pipe.zcard(REDIS_PROCESSING_KEY)
+            pipe.lrange(REDIS_WAITS_KEY, 0, -1)
+            depth, running, waits = await pipe.execute()
+        waits = [float(w) for w in waits]
+        return {
+            "backend": "redis",
+            "depth": depth,
+            "capacity": self.maxsize,
+            "running": running,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+        }
+
+    async def _pump(self):
+        while True:
+            try:
+                item = await self.client.blpop(REDIS_EVENTS_KEY, timeout=5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Redis 暂时不可用：稍后重连，事件留在列表中不会丢
+                print(f"读取解析事件失败: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item:
+                await self.on_event(json.loads(item[1]))
+
+
+def _keep_visible(client, member: str, done: threading.Event):
+    """解析期间定时延长处理中任务的截止时间；worker 进程被杀后不再续期，超时重新入队"""
+    while not done.wait(PARSE_VISIBILITY_TIMEOUT / 3):
+        client.zadd(REDIS_PROCESSING_KEY, {member: time.time() + PARSE_VISIBILITY_TIMEOUT}, xx=True)
+
+
+def redis_worker(url: str = REDIS_URL):
+    """
+    Redis worker 进程主循环：取优先级最高的任务移入处理中集合，解析完再删除
+
+    取任务时顺带把超时未续期（worker 已退出）的任务放回队列，按断点继续解析
+    """
+    import redis
+
+    client = redis.Redis.from_url(url)
+    claim = client.register_script(CLAIM_SCRIPT)
+    events = RedisEvents(client)
+    print(f"🔧 解析 worker 启动 (pid={os.getpid()})")
+    while True:
+        member = claim(keys=[REDIS_QUEUE_KEY, REDIS_PROCESSING_KEY],
+                       args=[time.time(), PARSE_VISIBILITY_TIMEOUT, PARSE_PRIORITY_BYTES_PER_SEC])
+        if not member:
+            time.sleep(PARSE_POLL_SECONDS)
+            continue
+        job = ParseJob(**json.loads(member))
+        client.lpush(REDIS_WAITS_KEY, time.time() - job.enqueued_at)
+        client.ltrim(REDIS_WAITS_KEY, 0, 99)
+        done = threading.Event()
+        heartbeat = threading.Thread(target=_keep_visible, args=(client, member, done), daemon=True)
+        heartbeat.start()
+        try:
+            run_parse_job(job, events)
+        finally:
+            done.set()
+            heartbeat.join()
+            with client.pipeline(transaction=True) as pipe:
+                pipe.zrem(REDIS_PROCESSING_KEY, member)
+                pipe.srem(REDIS_ACTIVE_KEY, job.task_id)
+                pipe.execute()
+
+
+def create_queue(on_event: Callable[[Dict], Awaitable[None]]):
+    """按 JOB_BACKEND 创建队列"""
+    if JOB_BACKEND == "redis":
+        return RedisJobQueue(on_event)
+    return LocalJobQueue(on_event)
+
+
+# 独立 worker 入口（Redis 模式），PARSE_WORKERS 个进程并行消费；
+# 子进程异常退出（如被 OOM kill）时重新拉起，它的任务超时后由其他 worker 接手
+if __name__ == "__main__":
+    processes = [multiprocessing.Process(target=redis_worker) for _ in range(PARSE_WORKERS)]
+    for p in processes:
+        p.start()
+    while True:
+        time.sleep(5)
+        for i, p in enumerate(processes):
+            if not p.is_alive():
+                print(f"⚠️ 解析 worker 退出 (pid={p.pid}, code={p.exitcode})，重新启动")
+                processes[i] = multiprocessing.Process(target=redis_worker)
+                processes[i].start()
@@ -5,12 +5,15 @@ PDF/PPT 智能解析模块
 import os
 import json
 import base64
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Callable
 from pathlib import Path
 import tempfile
+import subprocess
+import time
+from contextlib import contextmanager
 
 # PDF 处理
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 # PPT 处理
 from pptx import Presentation
 from PIL import Image
@@ -19,42 +22,250 @@ import io
 # LLM
 from openai import OpenAI
 
+# 规则提取
+from services.extractor import extract_products
+from services.checkpoint import CheckpointStore
+
+# 多页打包默认预算
+# 每次请求最多合并的页数 / 估算 token 上限 / base64 图片总字节上限
+DEFAULT_PACK_PAGES = 4
+DEFAULT_PACK_MAX_TOKENS = 8000
+DEFAULT_PACK_MAX_BYTES = 8 * 1024 * 1024
+
+# 规则提取的页置信度阈值
+RULE_MIN_CONFIDENCE = 0.8
+
+# 提示词（单页 / 多页共用的字段说明）
+PRODUCT_FIELDS = """{
+      "name": "产品名称",
+      "category": "产品分类（如：打印、喷绘、印刷等）",
+      "supplier_price": 供应商价格（数字，如果有的话）,
+      "retail_price": 零售价格（数字），
+      "unit": "单位（如：张、份、个）",
+      "min_quantity": 起订量（数字，默认1）,
+      "description": "产品描述或规格"
+    }"""
+
+
+class PageParseError(RuntimeError):
+    """部分页面解析失败：已完成的页面已写入断点，resume 时只重跑失败的页"""
+    
+    def __init__(self, failed_pages: List[int], total_pages: int):
+        self.failed_pages = failed_pages
+        self.total_pages = total_pages
+        super().__init__(
+            f"{len(failed_pages)}/{total_pages} 页解析失败（第 {', '.join(map(str, failed_pages))} 页），"
+            f"可调用 resume 重试"
+        )
+
+
 class DocumentParser:
     """文档解析器"""
     
-    def __init__(self, api_key: Optional[str] = None):
-        self.client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        pack_pages: int = 1,
+        pack_max_tokens: int = DEFAULT_PACK_MAX_TOKENS,
+        pack_max_bytes: int = DEFAULT_PACK_MAX_BYTES,
+        client=None,
+        use_rules: bool = True,
+        rule_min_confidence: float = RULE_MIN_CONFIDENCE,
+        checkpoints: Optional[CheckpointStore] = None,
+        on_page: Optional[Callable[[int, List[Dict], int, int], None]] = None,
+    ):
+        """
+        Args:
+            api_key: OpenAI API Key
+            pack_pages: 每次 LLM 请求最多合并的页数，1 表示逐页请求
+            pack_max_tokens: 单次请求图片部分的估算 token 上限
+            pack_max_bytes: 单次请求 base64 图片总字节上限
+            client: 自定义 OpenAI 兼容客户端（测试/基准用）
+            use_rules: 是否先对文本层做规则提取（services/extractor.py）
+            rule_min_confidence: 页置信度达到该值时直接采用规则结果，不调用 LLM
+            checkpoints: 断点存储（services/checkpoint.py），为空时不做断点
+            on_page: 每完成一页回调 (页码, 产品列表, 已完成页数, 总页数)
+        """
+        self.client = client or OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        self.pack_pages = max(1, pack_pages)
+        self.pack_max_tokens = pack_max_tokens
+        self.pack_max_bytes = pack_max_bytes
+        self.use_rules = use_rules
+        self.rule_min_confidence = rule_min_confidence
+        self.checkpoints = checkpoints
+        self.on_page = on_page
+        # 调用统计（请求数 / prompt token 数 / 规则命中页数）
+        self.stats = {"requests": 0, "prompt_tokens": 0, "rule_pages": 0}
+        # 各阶段累计耗时（秒）
+        self.timings = {"rules": 0.0, "rasterize": 0.0, "encode": 0.0, "request": 0.0, "extract_json": 0.0}
         
-    def parse_file(self, file_path: str, supplier_name: Optional[str] = None) -> Dict:
-        """解析 PDF/PPT 文件"""
+    def parse_file(self, file_path: str, supplier_name: Optional[str] = None, task_id: Optional[str] = None) -> Dict:
+        """
+        解析 PDF/PPT 文件
+        
+        Args:
+            file_path: 文件路径
+            supplier_name: 供应商名称
+            task_id: 任务 ID，配置了 checkpoints 时每页结果都会落盘，重跑同一任务跳过已完成页面
+        
+        Raises:
+            PageParseError: 有页面解析失败（其余页面照常解析并写入断点），任务据此标记为失败
+        """
         path = Path(file_path)
         
-        if path.suffix.lower() == '.pdf':
-            images = self._pdf_to_images(file_path)
-        elif path.suffix.lower() in ['.ppt', '.pptx']:
-            images = self._ppt_to_images(file_path)
-        else:
+        suffix = path.suffix.lower()
+        if suffix not in ['.pdf', '.ppt', '.pptx']:
             raise ValueError(f"不支持的文件格式: {path.suffix}")
         
-        # 解析每一页
-        all_products = []
-        for i, img in enumerate(images):
-            print(f"正在解析第 {i+1}/{len(images)} 页...")
-            products = self._parse_image(img, supplier_name)
-            all_products.extend(products)
+        # 读取断点，已完成的页面直接复用
+        done = {}
+        if self.checkpoints and task_id:
+            checkpoint = self.checkpoints.load(task_id)
+            if checkpoint:
+                done = checkpoint.pages
+                print(f"从断点恢复: 已完成 {len(done)} 页")
+            else:
+                self.checkpoints.start(task_id, {"file_path": str(file_path), "supplier_name": supplier_name})
+        all_products = [dict(p, page=no) for no, products in done.items() for p in products]
+        progress = {"done": len(done), "total": 0}
+        
+        def page_done(page_no: int, products: List[Dict]):
+            """单页完成：写断点并回调进度"""
+            self._save_page(task_id, page_no, products)
+            progress["done"] += 1
+            if self.on_page:
+                self.on_page(page_no, products, progress["done"], progress["total"])
+        
+        # 先用规则提取文本层，置信度足够的页不再调用 LLM
+        pending_nos = []
+        with self._timed("rules"):
+            texts = []
+            if self.use_rules:
+                texts = self._pdf_to_texts(file_path) if suffix == '.pdf' else self._ppt_to_texts(file_path)
+            progress["total"] = len(texts)
+            for i, text in enumerate(texts):
+                if i + 1 in done:
+                    continue
+                page = extract_products(text)
+                if page.products and page.confidence >= self.rule_min_confidence:
+                    for p in page.products:
+                        p["page"] = i + 1
+                    all_products.extend(page.products)
+                    self.stats["rule_pages"] += 1
+                    page_done(i + 1, page.products)
+                else:
+                    pending_nos.append(i + 1)
+        
+        # 剩余页面转图片交给 LLM（没有文本层且没有断点时整份转换）
+        with self._timed("rasterize"):
+            if suffix == '.pdf':
+                if not texts and done:
+                    total = pdfinfo_from_path(file_path)["Pages"]
+                    pending_nos = [no for no in range(1, total + 1) if no not in done]
+                if done or len(pending_nos) < len(texts):
+                    pages = [(no, img) for no in pending_nos for img in self._pdf_to_images(file_path, no)]
+                else:
+                    pages = list(enumerate(self._pdf_to_images(file_path), 1))
+            else:
+                pages = [(no, img) for no, img in enumerate(self._ppt_to_images(file_path), 1)
+                         if no not in done and (not texts or no in pending_nos)]
+        total_pages = max([len(texts)] + list(done) + [no for no, _ in pages])
+        progress["total"] = total_pages
+        failed_pages = []
+        
+        if self.pack_pages > 1:
+            # 多页打包：稀疏页（封面、单表页）合并到同一次请求
+            for pack in self._pack_pages(pages):
+                page_nos = [no for no, _ in pack]
+                print(f"正在解析第 {page_nos[0]}-{page_nos[-1]}/{total_pages} 页...")
+                products = self._parse_images(pack, supplier_name)
+                if products is None:
+                    failed_pages.extend(page_nos)
+                    continue
+                all_products.extend(products)
+                for no in page_nos:
+                    page_done(no, [p for p in products if p["page"] == no])
+        else:
+            # 解析每一页
+            for page_no, img in pages:
+                print(f"正在解析第 {page_no}/{total_pages} 页...")
+                products = self._parse_image(img, supplier_name)
+                if products is None:
+                    failed_pages.append(page_no)
+                    continue
+                for p in products:
+                    p.setdefault("page", page_no)
+                all_products.extend(products)
+                page_done(page_no, products)
+        
+        if failed_pages:
+            # 不返回缺页的结果：任务失败后 resume 跳过已完成的页，只重跑这些页
+            raise PageParseError(sorted(failed_pages), total_pages)
+        
+        all_products.sort(key=lambda p: p.get("page", 0))
         
         return {
             "supplier": supplier_name or "未知供应商",
             "source_file": path.name,
-            "total_pages": len(images),
+            "total_pages": total_pages,
             "products": all_products
         }
     
-    def _pdf_to_images(self, pdf_path: str) -> List[Image.Image]:
-        """将 PDF 转换为图片列表"""
+    def resume(self, task_id: str) -> Dict:
+        """按断点继续解析任务，已完成页面不再调用 LLM"""
+        if not self.checkpoints:
+            raise ValueError("未配置断点存储")
+        checkpoint = self.checkpoints.load(task_id)
+        if checkpoint is None:
+            raise ValueError(f"任务断点不存在: {task_id}")
+        meta = checkpoint.meta
+        return self.parse_file(meta["file_path"], meta.get("supplier_name"), task_id=task_id)
+    
+    def _save_page(self, task_id: Optional[str], page_no: int, products: List[Dict]):
+        """写入单页断点"""
+        if self.checkpoints and task_id:
+            self.checkpoints.save_page(task_id, page_no, [
+                {k: v for k, v in p.items() if k != "page"} for p in products
+            ])
+    
+    def _pdf_to_images(self, pdf_path: str, page_no: Optional[int] = None) -> List[Image.Image]:
+        """将 PDF 转换为图片列表（指定 page_no 时只转换该页）"""
+        if page_no is not None:
+            return convert_from_path(pdf_path, dpi=150, first_page=page_no, last_page=page_no)
         images = convert_from_path(pdf_path, dpi=150)
         return images
     
+    def _pdf_to_texts(self, pdf_path: str) -> List[str]:
+        """提取 PDF 每页文本层（pdftotext，来自 poppler-utils），扫描件返回空字符串"""
+        try:
+            out = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", pdf_path, "-"],
+                capture_output=True, check=True, timeout=120
+            ).stdout.decode("utf-8", errors="ignore")
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"文本层提取失败，全部交给 LLM: {e}")
+            return []
+        # 页与页之间以换页符分隔，最后一页后面也有一个
+        texts = out.split("\f")
+        if texts and not texts[-1].strip():
+            texts.pop()
+        return texts
+    
+    def _ppt_to_texts(self, ppt_path: str) -> List[str]:
+        """提取每张幻灯片的文本（文本框 + 表格）"""
+        prs = Presentation(ppt_path)
+        texts = []
+        for slide in prs.slides:
+            lines = []
+            for shape in slide.shapes:
+                if shape.has_text_frame:
+                    lines.extend(p.text for p in shape.text_frame.paragraphs)
+                elif getattr(shape, "has_table", False) and shape.has_table:
+                    for row in shape.table.rows:
+                        lines.append(" ".join(cell.text for cell in row.cells))
+            texts.append("\n".join(lines))
+        return texts
+    
     def _ppt_to_images(self, ppt_path: str) -> List[Image.Image]:
         """将 PPT 转换为图片列表"""
         prs = Presentation(ppt_path)
@@ -70,13 +281,66 @@ class DocumentParser:
         # 如果无法导出图片，返回空列表，改用文本解析
         return images
     
-    def _parse_image(self, image: Image.Image, supplier_name: Optional[str] = None) -> List[Dict]:
-        """使用 GPT-4V 解析图片中的产品信息"""
+    @contextmanager
+    def _timed(self, stage: str):
+        """累计某个阶段的耗时到 self.timings"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] += time.perf_counter() - start
+    
+    def _encode_image(self, image: Image.Image) -> str:
+        """将图片转为 base64"""
+        with self._timed("encode"):
+            buffered = io.BytesIO()
+            image.save(buffered, format="PNG")
+            return base64.b64encode(buffered.getvalue()).decode()
+    
+    @staticmethod
+    def _estimate_image_tokens(image: Image.Image) -> int:
+        """估算单张图片的 token 数（按 GPT-4o high detail 512px 分块计费）"""
+        width, height = image.size
+        # 先缩放到 2048 以内，再把短边缩到 768
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        tiles = -(-int(width) // 512) * -(-int(height) // 512)
+        return 85 + 170 * tiles
+    
+    def _pack_pages(self, pages: List[Tuple[int, Image.Image]]) -> List[List[Tuple[int, str]]]:
+        """
+        按页数 / token / 字节预算把连续页面分组
+        
+        Returns:
+            每组为 [(页码, base64 图片), ...]，单页超预算时独占一组
+        """
+        packs = []
+        current, tokens, size = [], 0, 0
+        for page_no, image in pages:
+            img_base64 = self._encode_image(image)
+            img_tokens = self._estimate_image_tokens(image)
+            img_size = len(img_base64)
+            if current and (
+                len(current) >= self.pack_pages
+                or tokens + img_tokens > self.pack_max_tokens
+                or size + img_size > self.pack_max_bytes
+            ):
+                packs.append(current)
+                current, tokens, size = [], 0, 0
+            current.append((page_no, img_base64))
+            tokens += img_tokens
+            size += img_size
+        if current:
+            packs.append(current)
+        return packs
+    
+    def _parse_image(self, image: Image.Image, supplier_name: Optional[str] = None) -> Optional[List[Dict]]:
+        """使用 GPT-4V 解析图片中的产品信息，失败返回 None"""
         
         # 将图片转为 base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
+        img_base64 = self._encode_image(image)
         
         prompt = f"""请分析这张供应商价格表图片，提取所有产品信息。
 
@@ -85,14 +349,44 @@ class DocumentParser:
 请提取以下信息并以 JSON 格式返回：
 {{
   "products": [
+    {PRODUCT_FIELDS}
+  ]
+}}
+
+注意：
+1. 如果价格表中同时有供应商价和零售价，请都提取
+2. 如果只有一个价格，默认为零售价
+3. 单位和起订量如果不明确，可以省略
+4. 只返回 JSON，不要其他内容"""
+
+        try:
+            content = self._chat(prompt, [img_base64])
+            result = self._extract_json(content)
+            return result.get("products", [])
+            
+        except Exception as e:
+            # 返回 None 以区别于"本页没有产品"，失败页不写断点
+            print(f"解析失败: {e}")
+            return None
+    
+    def _parse_images(self, pack: List[Tuple[int, str]], supplier_name: Optional[str] = None) -> Optional[List[Dict]]:
+        """一次请求解析多页，返回的产品带 page 页码，失败返回 None"""
+        page_nos = [no for no, _ in pack]
+        page_list = "、".join(f"第 {no} 页" for no in page_nos)
+        
+        prompt = f"""以下 {len(pack)} 张图片是同一份供应商价格表的连续页面，依次为：{page_list}。
+请分别分析每一页，提取所有产品信息。
+
+供应商名称：{supplier_name or '请识别'}
+
+请按页以 JSON 格式返回（page 为上面给出的页码，没有产品的页面 products 为空数组）：
+{{
+  "pages": [
     {{
-      "name": "产品名称",
-      "category": "产品分类（如：打印、喷绘、印刷等）",
-      "supplier_price": 供应商价格（数字，如果有的话）,
-      "retail_price": 零售价格（数字），
-      "unit": "单位（如：张、份、个）",
-      "min_quantity": 起订量（数字，默认1）,
-      "description": "产品描述或规格"
+      "page": 页码,
+      "products": [
+        {PRODUCT_FIELDS}
+      ]
     }}
   ]
 }}
@@ -104,39 +398,57 @@ class DocumentParser:
 4. 只返回 JSON，不要其他内容"""
 
         try:
+            content = self._chat(prompt, [b64 for _, b64 in pack])
+            result = self._extract_json(content)
+        except Exception as e:
+            print(f"解析失败: {e}")
+            return None
+        
+        products = []
+        for page in result.get("pages", []):
+            page_no = page.get("page")
+            # 页码不在本组内时归到本组第一页，避免丢数据
+            if page_no not in page_nos:
+                page_no = page_nos[0]
+            for p in page.get("products", []):
+                p["page"] = page_no
+                products.append(p)
+        return products
+    
+    def _chat(self, prompt: str, images_base64: List[str]) -> str:
+        """发送一次多模态请求，返回文本内容"""
+        content = [{"type": "text", "text": prompt}]
+        for img_base64 in images_base64:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/png;base64,{img_base64}"
+                }
+            })
+        
+        with self._timed("request"):
             response = self.client.chat.completions.create(
                 model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{img_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=[{"role": "user", "content": content}],
                 max_tokens=4096
             )
-            
-            content = response.choices[0].message.content
-            
-            # 提取 JSON
+        
+        self.stats["requests"] += 1
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.stats["prompt_tokens"] += usage.prompt_tokens or 0
+        
+        return response.choices[0].message.content
+    
+    def _extract_json(self, content: str) -> Dict:
+        """从模型回复中提取 JSON"""
+        with self._timed("extract_json"):
             if "```json" in content:
                 content = content.split("```json")[1].split("```")[0]
             elif "```" in content:
                 content = content.split("```")[1].split("```")[0]
             
-            result = json.loads(content.strip())
-            return result.get("products", [])
-            
-        except Exception as e:
-            print(f"解析失败: {e}")
-            return []
+            return json.loads(content.strip())
     
     def generate_customer_pricelist(self, products: List[Dict]) -> List[Dict]:
         """生成客户版价格表（去除供应商价）"""
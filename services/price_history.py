@@ -0,0 +1,64 @@
+"""
+价格历史
+写入：价格变化（含新产品）时追加一行，批量写入时整块一次 executemany
+查询：某时刻的价格 = 该产品 changed_at <= 时刻 的最后一行，
+走 idx_price_history_product_time (product_id, changed_at DESC, id DESC)，每个产品一次索引定位
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select, insert
+
+# 单次批量查询最多的产品数
+MAX_AS_OF_PRODUCTS = 1000
+
+
+def price_changes(rows: Iterable[Dict], old_prices: Dict[int, tuple], changed_by: Optional[str] = None) -> List[Dict]:
+    """
+    需要写入价格历史的行：新产品，或 (supplier_price, retail_price) 与旧值不同的产品
+
+    Args:
+        rows: 写入后的产品 {"id", "supplier_price", "retail_price"}
+        old_prices: 写入前已存在的产品 {id: (supplier_price, retail_price)}
+    """
+    changes = []
+    for row in rows:
+        prices = (row["supplier_price"], row["retail_price"])
+        if row["id"] not in old_prices or old_prices[row["id"]] != prices:
+            changes.append({
+                "product_id": row["id"],
+                "supplier_price": prices[0],
+                "retail_price": prices[1],
+                "changed_by": changed_by,
+            })
+    return changes
+
+
+def record_changes(conn, history, changes: List[Dict]):
+    """同步连接上整批写入（executemany），调用方负责事务"""
+    if changes:
+        conn.execute(insert(history), changes)
+
+
+def as_of_stmt(products, history, product_ids: List[int], at: datetime):
+    """
+    多个产品在同一时刻的价格，一条 SQL
+
+    每个产品用相关子查询取 changed_at <= at 的最后一条历史 ID（索引倒序扫描，第一行即停），
+    再按主键取价格；该时刻之前没有历史的产品不返回
+    """
+    latest_id = (
+        select(history.c.id)
+        .where(history.c.product_id == products.c.id, history.c.changed_at <= at)
+        .order_by(history.c.changed_at.desc(), history.c.id.desc())
+        .limit(1)
+        .correlate(products)
+        .scalar_subquery()
+    )
+    return (
+        select(history.c.product_id, history.c.supplier_price, history.c.retail_price,
+               history.c.changed_at, history.c.changed_by)
+        .select_from(products)
+        .join(history, history.c.id == latest_id)
+        .where(products.c.id.in_(product_ids))
+    )
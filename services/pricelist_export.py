@@ -0,0 +1,220 @@
+"""
+客户版价格表导出
+SQL 只选客户可见的列（不含 supplier_price），服务端游标分批读取，边读边编码为 CSV / XLSX / JSON Lines，
+内存占用与产品总数无关；ETag 由产品 / 供应商的聚合指纹计算，内容没变时返回 304
+"""
+import io
+import os
+import csv
+import json
+import re
+import zipfile
+import hashlib
+from decimal import Decimal
+from typing import AsyncIterator, Dict, List, Optional
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select, func, true
+
+# 服务端游标每批行数
+EXPORT_BATCH_ROWS = int(os.getenv("PRICELIST_EXPORT_BATCH_ROWS", "2000"))
+# 同时进行的导出数：每个导出在整个下载期间占用一个连接池连接和一个事务，超出返回 503
+EXPORT_CONCURRENCY = int(os.getenv("PRICELIST_EXPORT_CONCURRENCY", "2"))
+# 单次导出最长时间（秒，含客户端读取）：慢客户端不能无限期占着连接，超时断开
+EXPORT_TIMEOUT = float(os.getenv("PRICELIST_EXPORT_TIMEOUT", "300"))
+
+# (键, 表头)，客户可见的列
+EXPORT_COLUMNS = [
+    ("id", "编号"),
+    ("name", "产品名称"),
+    ("supplier_name", "供应商"),
+    ("retail_price", "零售价"),
+    ("unit", "单位"),
+    ("min_quantity", "起订量"),
+    ("description", "说明"),
+]
+
+# 格式 -> (Content-Type, 扩展名)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+}
+
+
+def pricelist_stmt(products, suppliers, supplier_id: Optional[int] = None):
+    """按 ID 顺序输出（走主键索引，不需要对整个目录排序）"""
+    stmt = (
+        select(products.c.id, products.c.name, suppliers.c.name.label("supplier_name"), products.c.retail_price,
+               products.c.unit, products.c.min_quantity, products.c.description)
+        .select_from(products.outerjoin(suppliers, suppliers.c.id == products.c.supplier_id))
+        .order_by(products.c.id)
+    )
+    if supplier_id:
+        stmt = stmt.where(products.c.supplier_id == supplier_id)
+    return stmt
+
+
+def fingerprint_stmt(products, suppliers, supplier_id: Optional[int] = None):
+    """
+    决定导出内容的聚合指纹（一行）：产品的增删改（行数、ID 和、最后更新时间），
+    供应商的增删（影响供应商名称列）
+    """
+    product_filter = [products.c.supplier_id == supplier_id] if supplier_id else []
+    p = select(
+        func.count().label("products"),
+        func.coalesce(func.sum(products.c.id), 0).label("product_ids"),
+        func.max(products.c.updated_at).label("updated_at"),
+    ).where(*product_filter).subquery()
+    s = select(
+        func.count().label("suppliers"),
+        func.coalesce(func.sum(suppliers.c.id), 0).label("supplier_ids"),
+    ).select_from(suppliers).subquery()
+    return select(p, s).select_from(p.join(s, true()))
+
+
+def make_etag(fmt: str, supplier_id: Optional[int], fingerprint) -> str:
+    digest = hashlib.sha1(repr((fmt, supplier_id, EXPORT_COLUMNS, tuple(fingerprint))).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 可以是多个 ETag 或 *；弱比较（忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in [t[2:] if t.startswith("W/") else t for t in tags]
+
+
+def encode(batches: AsyncIterator[List[Dict]], fmt: str) -> AsyncIterator[bytes]:
+    """分批行 -> 文件内容分块"""
+    if fmt == "csv":
+        return _encode_csv(batches)
+    if fmt == "xlsx":
+        return _encode_xlsx(batches)
+    return _encode_jsonl(batches)
+
+
+async def _encode_csv(batches):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # BOM：Excel 直接打开不乱码
+    buf.write("﻿")
+    writer.writerow([title for _, title in EXPORT_COLUMNS])
+    async for rows in batches:
+        writer.writerows([row[key] for key, _ in EXPORT_COLUMNS] for row in rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+async def _encode_jsonl(batches):
+    async for rows in batches:
+        yield "".join(
+            json.dumps({key: row[key] for key, _ in EXPORT_COLUMNS}, ensure_ascii=False, default=str) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+# ============ XLSX ============
+# 只写一个工作表、内联字符串，不依赖 openpyxl；zip 写到不可 seek 的管道，压缩后的数据逐批发出
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="价格表" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_TAIL = '</sheetData></worksheet>'
+
+# XML 1.0 不允许的控制字符
+INVALID_XML_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Pipe:
+    """zipfile 的输出端：只追加、不可 seek，写入的数据由 drain() 取走"""
+
+    def __init__(self):
+        self.chunks = []
+        self.pos = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(INVALID_XML_RE.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values) -> str:
+    return "<row>" + "".join(_xlsx_cell(v) for v in values) + "</row>"
+
+
+async def _encode_xlsx(batches):
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in XLSX_STATIC_PARTS.items():
+            zf.writestr(name, content)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((SHEET_HEAD + _xlsx_row(title for _, title in EXPORT_COLUMNS)).encode("utf-8"))
+            async for rows in batches:
+                sheet.write("".join(_xlsx_row(row[key] for key, _ in EXPORT_COLUMNS) for row in rows).encode("utf-8"))
+                data = pipe.drain()
+                if data:
+                    yield data
+            sheet.write(SHEET_TAIL.encode("utf-8"))
+    yield pipe.drain()
@@ -0,0 +1,185 @@
+"""
+解析结果批量导入知识库
+COPY 到临时暂存表，再用一条 SQL 按 (supplier_id, name) upsert 到 products，
+只有价格真正变化（或新产品）才写 price_history；整个导入在一个事务内完成（仅 PostgreSQL）
+"""
+import io
+import csv
+from decimal import Decimal, InvalidOperation
+from typing import List, Dict, Optional
+
+from sqlalchemy import text
+
+from services.db import get_engine
+
+# 暂存表列（seq 用于同名产品取最后一条）
+STAGING_COLUMNS = ("seq", "name", "supplier_price", "retail_price", "unit", "min_quantity", "description")
+
+CREATE_STAGING_SQL = """
+CREATE TEMP TABLE import_staging (
+  seq INT,
+  name VARCHAR(255),
+  supplier_price DECIMAL(10,2),
+  retail_price DECIMAL(10,2),
+  unit VARCHAR(50),
+  min_quantity INT,
+  description TEXT
+) ON COMMIT DROP
+"""
+
+# 暂存数据与库内数据按 DECIMAL(10,2) 比较，重复导入同一份价目表不会产生更新
+UPSERT_SQL = """
+WITH src AS (
+  SELECT DISTINCT ON (name) name, supplier_price, retail_price, unit, min_quantity, description
+  FROM import_staging
+  ORDER BY name, seq DESC
+),
+old AS (
+  SELECT p.id, p.supplier_price, p.retail_price
+  FROM products p JOIN src ON src.name = p.name
+  WHERE p.supplier_id = :supplier_id
+),
+up AS (
+  INSERT INTO products (name, supplier_id, supplier_price, retail_price, unit, min_quantity, description)
+  SELECT name, :supplier_id, supplier_price, retail_price, unit, COALESCE(min_quantity, 1), description
+  FROM src
+  ON CONFLICT (supplier_id, name) DO UPDATE SET
+    supplier_price = EXCLUDED.supplier_price,
+    retail_price = EXCLUDED.retail_price,
+    unit = EXCLUDED.unit,
+    min_quantity = EXCLUDED.min_quantity,
+    description = EXCLUDED.description,
+    updated_at = NOW()
+  WHERE (products.supplier_price, products.retail_price, products.unit, products.min_quantity, products.description)
+    IS DISTINCT FROM
+    (EXCLUDED.supplier_price, EXCLUDED.retail_price, EXCLUDED.unit, EXCLUDED.min_quantity, EXCLUDED.description)
+  RETURNING id, supplier_price, retail_price, (xmax = 0) AS inserted
+),
+history AS (
+  INSERT INTO price_history (product_id, supplier_price, retail_price, changed_by)
+  SELECT up.id, up.supplier_price, up.retail_price, :changed_by
+  FROM up LEFT JOIN old ON old.id = up.id
+  WHERE old.id IS NULL
+     OR (old.supplier_price, old.retail_price) IS DISTINCT FROM (up.supplier_price, up.retail_price)
+  RETURNING 1
+)
+SELECT
+  (SELECT count(*) FROM src) AS total,
+  (SELECT count(*) FROM up WHERE inserted) AS inserted,
+  (SELECT count(*) FROM up WHERE NOT inserted) AS updated,
+  (SELECT count(*) FROM history) AS price_changes,
+  ARRAY(SELECT id FROM up WHERE NOT inserted) AS updated_ids
+"""
+
+
+def _to_price(value) -> Optional[Decimal]:
+    """LLM 返回的价格可能是字符串（如 "¥12.5"），无法解析时为空"""
+    if value is None or value == "":
+        return None
+    try:
+        return Decimal(str(value).strip().lstrip("¥￥").replace(",", "")).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def staging_rows(products: List[Dict]) -> List[tuple]:
+    """解析结果 -> 暂存表行，跳过没有名称的产品"""
+    rows = []
+    for seq, p in enumerate(products):
+        name = (p.get("name") or "").strip()[:255]
+        if not name:
+            continue
+        rows.append((
+            seq,
+            name,
+            _to_price(p.get("supplier_price")),
+            _to_price(p.get("retail_price")),
+            (p.get("unit") or None) and str(p["unit"])[:50],
+            _to_int(p.get("min_quantity")),
+            p.get("description") or None,
+        ))
+    return rows
+
+
+class ProductImporter:
+    """把解析任务的产品列表导入 products 表"""
+
+    def __init__(self, engine=None):
+        self._engine = engine
+
+    @property
+    def engine(self):
+        return self._engine or get_engine()
+
+    def import_products(self, products: List[Dict], supplier_name: str, changed_by: Optional[str] = None) -> Dict:
+        """
+        一个事务内完成：查找/创建供应商 -> COPY 暂存 -> upsert + 价格历史
+
+        Returns:
+            {"supplier_id", "total", "inserted", "updated", "unchanged", "price_changes",
+             "updated_ids"（用于失效产品缓存）}
+        """
+        rows = staging_rows(products)
+
+        with self.engine.begin() as conn:
+            supplier_id = self._supplier_id(conn, supplier_name)
+            if not rows:
+                return {"supplier_id": supplier_id, "total": 0, "inserted": 0, "updated": 0,
+                        "unchanged": 0, "price_changes": 0, "updated_ids": []}
+
+            conn.execute(text(CREATE_STAGING_SQL))
+            self._copy_rows(conn, rows)
+            stats = conn.execute(text(UPSERT_SQL), {
+                "supplier_id": supplier_id,
+                "changed_by": changed_by,
+            }).one()._asdict()
+
+        stats["unchanged"] = stats["total"] - stats["inserted"] - stats["updated"]
+        return {"supplier_id": supplier_id, **stats}
+
+    @staticmethod
+    def _supplier_id(conn, supplier_name: str) -> int:
+        """
+        查找或创建供应商：先按唯一索引 idx_suppliers_name 插入，已存在（包括并发导入刚创建的）
+        时不插入，再查出 ID
+        """
+        row = conn.execute(
+            text("INSERT INTO suppliers (name) VALUES (:name) ON CONFLICT (name) DO NOTHING RETURNING id"),
+            {"name": supplier_name}
+        ).first()
+        if row:
+            return row.id
+        return conn.execute(
+            text("SELECT id FROM suppliers WHERE name = :name"),
+            {"name": supplier_name}
+        ).scalar_one()
+
+    @staticmethod
+    def _copy_rows(conn, rows: List[tuple]):
+        """psycopg2 用 COPY 一次写入；其他驱动退回 executemany"""
+        cursor = conn.connection.driver_connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):
+                buf = io.StringIO()
+                # CSV 格式下未加引号的空字段即 NULL
+                csv.writer(buf).writerows(["" if v is None else v for v in row] for row in rows)
+                buf.seek(0)
+                cursor.copy_expert(
+                    f"COPY import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf
+                )
+                return
+        finally:
+            cursor.close()
+
+        conn.execute(
+            text(f"INSERT INTO import_staging ({', '.join(STAGING_COLUMNS)}) "
+                 f"VALUES ({', '.join(':' + c for c in STAGING_COLUMNS)})"),
+            [dict(zip(STAGING_COLUMNS, row)) for row in rows]
+        )
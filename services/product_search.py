@@ -0,0 +1,221 @@
+"""
+产品检索
+名称（idx_products_name_trgm，search_text() + pg_trgm）+ 向量（idx_products_embedding，IVFFlat）混合排序，
+两路各取候选后按加权分数合并；分类过滤走 product_categories（含子分类）；游标分页
+"""
+import os
+import base64
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from services.db import get_engine
+from services.embeddings import to_pgvector
+from services.text_search import escape_like, search_text
+
+# 每一路最多取的候选数（也是搜索结果可翻页的上限）
+SEARCH_CANDIDATES = int(os.getenv("PRODUCT_SEARCH_CANDIDATES", "200"))
+# IVFFlat 查询的聚类数：越大召回越好、越慢（lists=100 时 10 约为 10%）
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+# 混合排序权重：score = 全文分 * TEXT_WEIGHT + 向量相似度 * (1 - TEXT_WEIGHT)
+TEXT_WEIGHT = float(os.getenv("PRODUCT_SEARCH_TEXT_WEIGHT", "0.4"))
+# 查询向量 LRU 条数：同一关键词只请求一次向量服务（OpenAI 一次往返就超过检索本身的耗时）
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2000"))
+
+# 分类及其所有子分类
+CATEGORY_TREE_SQL = """
+cat AS (
+  WITH RECURSIVE tree AS (
+    SELECT id FROM categories WHERE name = :category
+    UNION
+    SELECT c.id FROM categories c JOIN tree ON c.parent_id = tree.id
+  )
+  SELECT id FROM tree
+)"""
+
+CATEGORY_FILTER = """
+    AND EXISTS (
+      SELECT 1 FROM product_categories pc
+      WHERE pc.product_id = p.id AND pc.category_id IN (SELECT id FROM cat)
+    )"""
+
+# 与知识库 API 的名称检索相同（services/text_search.py）：search_text() 把汉字拆成单字，
+# "名片" 能命中 "铜版纸名片"（'simple' 分词不切中文，整串才算一个词）；
+# word_similarity 在 0~1 之间，与余弦相似度同量级
+TEXT_HITS_SQL = """
+text_hits AS (
+  SELECT p.id, word_similarity(:needle, search_text(p.name)) AS text_score
+  FROM products p
+  WHERE search_text(p.name) LIKE :pattern ESCAPE '\\'{category_filter}
+  ORDER BY text_score DESC
+  LIMIT :candidates
+)"""
+
+VECTOR_HITS_SQL = """
+vector_hits AS (
+  SELECT p.id, 1 - (p.embedding <=> CAST(:embedding AS vector)) AS vector_score
+  FROM products p
+  WHERE p.embedding IS NOT NULL{category_filter}
+  ORDER BY p.embedding <=> CAST(:embedding AS vector)
+  LIMIT :candidates
+)"""
+
+# 没有向量时用空集占位，保持后续 SQL 不变
+NO_VECTOR_HITS_SQL = """
+vector_hits AS (
+  SELECT NULL::int AS id, NULL::float8 AS vector_score WHERE false
+)"""
+
+PRODUCT_COLUMNS = """
+  p.id, p.name, s.name AS supplier_name, p.supplier_price, p.retail_price, p.unit,
+  (SELECT c.name FROM product_categories pc JOIN categories c ON c.id = pc.category_id
+   WHERE pc.product_id = p.id ORDER BY c.id LIMIT 1) AS category"""
+
+
+def normalize_query(q: str) -> str:
+    """查询向量缓存键：NFKC（全角转半角）、小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", q).lower().split())
+
+
+def encode_cursor(score: float, product_id: int) -> str:
+    """(score, id) -> 不透明游标"""
+    return base64.urlsafe_b64encode(f"{score!r}|{product_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """游标 -> (score, id)，格式错误抛 ValueError"""
+    try:
+        score, product_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return float(score), int(product_id)
+    except Exception:
+        raise ValueError("无效的游标")
+
+
+class ProductSearch:
+    """products 表检索"""
+
+    def __init__(self, engine=None, embedder=None, probes: int = IVFFLAT_PROBES,
+                 embedding_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self._engine = engine
+        self.embedder = embedder
+        self.probes = probes
+        # 归一化关键词 -> 查询向量；search 在线程池中执行，读写加锁
+        self.embedding_cache_size = embedding_cache_size
+        self._embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._embeddings_lock = threading.Lock()
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+
+    @property
+    def engine(self):
+        return self._engine or get_engine()
+
+    def search(
+        self,
+        q: Optional[str] = None,
+        category: Optional[str] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        probes: Optional[int] = None
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Args:
+            q: 关键词；为空时按 ID 倒序列出（可只按分类过滤）
+            category: 分类名，包含其子分类
+            cursor: 上一页返回的 next_cursor
+            probes: 覆盖默认的 ivfflat.probes
+
+        Returns:
+            (产品列表, 下一页游标；没有更多时为 None)
+        """
+        params = {"category": category, "limit": limit + 1}
+        ctes = [CATEGORY_TREE_SQL] if category else []
+        category_filter = CATEGORY_FILTER if category else ""
+
+        if q:
+            needle = search_text(q)
+            params.update(needle=needle, pattern=f"%{escape_like(needle)}%", candidates=SEARCH_CANDIDATES,
+                          w_text=TEXT_WEIGHT, w_vector=1 - TEXT_WEIGHT)
+            ctes.append(TEXT_HITS_SQL.format(category_filter=category_filter))
+            embedding = self._embed(q)
+            if embedding:
+                params["embedding"] = to_pgvector(embedding)
+                ctes.append(VECTOR_HITS_SQL.format(category_filter=category_filter))
+            else:
+                ctes.append(NO_VECTOR_HITS_SQL)
+            ctes.append("""
+ranked AS (
+  SELECT id,
+         CAST(COALESCE(t.text_score, 0) * :w_text + COALESCE(v.vector_score, 0) * :w_vector AS float8) AS score
+  FROM text_hits t FULL JOIN vector_hits v USING (id)
+)""")
+            where = ""
+            if cursor:
+                params["cursor_score"], params["cursor_id"] = decode_cursor(cursor)
+                where = "WHERE (r.score, r.id) < (:cursor_score, :cursor_id)"
+            sql = f"""
+WITH {','.join(ctes)}
+SELECT {PRODUCT_COLUMNS}, r.score
+FROM ranked r
+JOIN products p ON p.id = r.id
+LEFT JOIN suppliers s ON s.id = p.supplier_id
+{where}
+ORDER BY r.score DESC, r.id DESC
+LIMIT :limit"""
+        else:
+            # 没有关键词：按 ID 游标列出
+            where = "WHERE true" + category_filter
+            if cursor:
+                _, params["cursor_id"] = decode_cursor(cursor)
+                where += " AND p.id < :cursor_id"
+            sql = f"""
+{'WITH ' + ','.join(ctes) if ctes else ''}
+SELECT {PRODUCT_COLUMNS}, NULL AS score
+FROM products p
+LEFT JOIN suppliers s ON s.id = p.supplier_id
+{where}
+ORDER BY p.id DESC
+LIMIT :limit"""
+
+        with self.engine.begin() as conn:
+            # 只对本事务生效，不影响连接池里的其他连接
+            conn.execute(text("SELECT set_config('ivfflat.probes', :probes, true)"),
+                         {"probes": str(probes or self.probes)})
+            rows = conn.execute(text(sql), params).all()
+
+        products = [dict(r._mapping) for r in rows[:limit]]
+        for p in products:
+            for key in ("supplier_price", "retail_price"):
+                if p[key] is not None:
+                    p[key] = float(p[key])
+        next_cursor = None
+        if len(rows) > limit:
+            last = products[-1]
+            next_cursor = encode_cursor(last["score"] or 0.0, last["id"])
+        return products, next_cursor
+
+    def _embed(self, q: str) -> Optional[List[float]]:
+        """查询向量（LRU 缓存，翻页和热门关键词不再请求向量服务）；向量服务不可用时退化为纯全文检索"""
+        if self.embedder is None:
+            return None
+        key = normalize_query(q)
+        with self._embeddings_lock:
+            embedding = self._embeddings.get(key)
+            if embedding is not None:
+                self._embeddings.move_to_end(key)
+                self.embedding_hits += 1
+                return embedding
+            self.embedding_misses += 1
+        try:
+            embedding = self.embedder.embed([key])[0]
+        except Exception as e:
+            print(f"查询向量生成失败，仅使用全文检索: {e}")
+            return None
+        with self._embeddings_lock:
+            self._embeddings[key] = embedding
+            while len(self._embeddings) > self.embedding_cache_size:
+                self._embeddings.popitem(last=False)
+        return embedding
@@ -0,0 +1,38 @@
+"""
+任务进度事件分发
+API 进程内的发布/订阅：worker 上报的事件推送给正在订阅该任务的 SSE 连接
+"""
+import asyncio
+from collections import defaultdict
+from typing import Dict, Set
+
+# 单个订阅者最多积压的事件数，超出后丢弃（客户端可重连补发）
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class TaskEventBroker:
+    """按任务 ID 分发事件"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[task_id].add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[task_id]
+
+    def publish(self, event: Dict):
+        """必须在事件循环线程中调用"""
+        for queue in self._subscribers.get(event["task_id"], ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
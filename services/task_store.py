@@ -0,0 +1,296 @@
+"""
+解析任务持久化存储
+任务写入 parse_tasks 表（生产 PostgreSQL，本地默认 SQLite），重启不丢失
+列表按 (created_at, id) 游标分页，完成的任务按 TTL 清理
+"""
+import os
+import uuid
+import base64
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+
+from sqlalchemy import (
+    create_engine, MetaData, Table, Column, Index, String, Integer, BigInteger,
+    Text, DateTime, JSON, Uuid, select, insert, update, delete, tuple_, func
+)
+from sqlalchemy.dialects.postgresql import JSONB
+
+# 配置：未指定时沿用 DATABASE_URL，都没有则用本地 SQLite
+TASK_DATABASE_URL = os.getenv(
+    "TASK_DATABASE_URL",
+    os.getenv("DATABASE_URL", "sqlite:///uploads/tasks.db")
+)
+# 已完成/失败任务保留时长
+TASK_TTL_HOURS = int(os.getenv("TASK_TTL_HOURS", "72"))
+
+FINISHED_STATUSES = ("completed", "failed")
+UNFINISHED_STATUSES = ("queued", "processing")
+
+metadata = MetaData()
+
+# 与 schema.sql 中 parse_tasks 保持一致
+parse_tasks = Table(
+    "parse_tasks",
+    metadata,
+    Column("id", Uuid(as_uuid=False), primary_key=True),
+    Column("filename", String(255), nullable=False),
+    Column("file_path", String(500)),
+    Column("file_sha256", String(64)),
+    Column("file_size", BigInteger),
+    Column("supplier_name", String(255)),
+    Column("status", String(50), default="queued"),
+    Column("progress", Integer, default=0),
+    Column("result", JSON().with_variant(JSONB, "postgresql")),
+    Column("error_message", Text),
+    Column("created_at", DateTime, nullable=False),
+    Column("started_at", DateTime),
+    Column("completed_at", DateTime),
+    Column("created_by", String(100)),
+    Index("idx_parse_tasks_status", "status", "created_at", "id"),
+    Index("idx_parse_tasks_created", "created_at", "id"),
+    Index("idx_parse_tasks_sha256", "file_sha256"),
+)
+
+# 批量上传：一个批次对应多个子任务（去重复用的任务也会记入，所以不在 parse_tasks 上加外键）
+parse_batches = Table(
+    "parse_batches",
+    metadata,
+    Column("id", Uuid(as_uuid=False), primary_key=True),
+    Column("supplier_name", String(255)),
+    Column("task_ids", JSON().with_variant(JSONB, "postgresql"), nullable=False),
+    Column("skipped", JSON().with_variant(JSONB, "postgresql")),
+    Column("created_at", DateTime, nullable=False),
+    Index("idx_parse_batches_created", "created_at"),
+)
+
+# 列表不返回 result（可能很大），详情接口再取
+LIST_COLUMNS = [c for c in parse_tasks.c if c.name != "result"]
+
+
+def encode_cursor(created_at: datetime, task_id: str) -> str:
+    """(created_at, id) -> 不透明游标"""
+    raw = f"{created_at.isoformat()}|{task_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """游标 -> (created_at, id)，格式错误抛 ValueError"""
+    try:
+        created_at, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(task_id))
+    except Exception:
+        raise ValueError("无效的游标")
+
+
+class TaskStore:
+    """parse_tasks 表读写"""
+
+    def __init__(self, url: str = TASK_DATABASE_URL):
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            # 本地替身：自动建表
+            if self.engine.url.database:
+                Path(self.engine.url.database).parent.mkdir(parents=True, exist_ok=True)
+            metadata.create_all(self.engine)
+
+    @staticmethod
+    def _to_task(row) -> Dict:
+        """数据库行 -> API 使用的任务字典"""
+        task = dict(row._mapping)
+        task["task_id"] = str(task.pop("id"))
+        task["error"] = task.pop("error_message", None)
+        if task.get("started_at") and task.get("created_at"):
+            task["wait_seconds"] = round((task["started_at"] - task["created_at"]).total_seconds(), 3)
+        return task
+
+    def create(self, task: Dict):
+        with self.engine.begin() as conn:
+            conn.execute(insert(parse_tasks).values(
+                id=task["task_id"],
+                filename=task["filename"],
+                file_path=task.get("file_path"),
+                file_sha256=task.get("file_sha256"),
+                file_size=task.get("file_size"),
+                supplier_name=task.get("supplier_name"),
+                status=task.get("status", "queued"),
+                progress=task.get("progress", 0),
+                result=task.get("result"),
+                created_at=task["created_at"],
+                completed_at=task.get("completed_at"),
+            ))
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        try:
+            task_id = str(uuid.UUID(task_id))
+        except ValueError:
+            return None
+        with self.engine.connect() as conn:
+            row = conn.execute(select(parse_tasks).where(parse_tasks.c.id == task_id)).first()
+        return self._to_task(row) if row else None
+
+    def update(self, task_id: str, **values):
+        """更新任务字段（error 对应 error_message 列）"""
+        if "error" in values:
+            values["error_message"] = values.pop("error")
+        with self.engine.begin() as conn:
+            conn.execute(update(parse_tasks).where(parse_tasks.c.id == task_id).values(**values))
+
+    def unfinished_ids(self) -> List[str]:
+        """排队中 / 解析中的任务 ID（启动时检查是否还有队列任务对应）"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(parse_tasks.c.id).where(parse_tasks.c.status.in_(UNFINISHED_STATUSES))
+            ).all()
+        return [str(r.id) for r in rows]
+
+    def fail_unfinished(self, task_ids: List[str], error: str) -> int:
+        """把仍处于排队中 / 解析中的这些任务标记为失败（断点保留，可 resume），返回更新的行数"""
+        if not task_ids:
+            return 0
+        with self.engine.begin() as conn:
+            return conn.execute(
+                update(parse_tasks)
+                .where(parse_tasks.c.id.in_(task_ids), parse_tasks.c.status.in_(UNFINISHED_STATUSES))
+                .values(status="failed", error_message=error, completed_at=datetime.now())
+            ).rowcount
+
+    def delete(self, task_id: str):
+        with self.engine.begin() as conn:
+            conn.execute(delete(parse_tasks).where(parse_tasks.c.id == task_id))
+
+    def find_by_hash(self, sha256: str, supplier_name: Optional[str]) -> Optional[Dict]:
+        """
+        相同文件、相同供应商最近一次未失败的任务（供应商不同的结果不能直接复用）
+
+        排队中 / 解析中的任务可能已没有队列任务对应（进程退出），调用方复用前需确认仍在队列中
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(*LIST_COLUMNS)
+                .where(
+                    parse_tasks.c.file_sha256 == sha256,
+                    parse_tasks.c.supplier_name.is_not_distinct_from(supplier_name),
+                    parse_tasks.c.status != "failed",
+                )
+                .order_by(parse_tasks.c.created_at.desc())
+                .limit(1)
+            ).first()
+        return self._to_task(row) if row else None
+
+    def find_result_by_hash(self, sha256: str) -> Optional[Dict]:
+        """相同文件最近一次已完成的任务（含 result），任何供应商"""
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(parse_tasks)
+                .where(parse_tasks.c.file_sha256 == sha256, parse_tasks.c.status == "completed")
+                .order_by(parse_tasks.c.created_at.desc())
+                .limit(1)
+            ).first()
+        return self._to_task(row) if row else None
+
+    def list(
+        self,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        offset: int = 0
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        按创建时间倒序分页
+
+        Args:
+            cursor: 上一页返回的 next_cursor；给出时忽略 offset
+            status: 状态过滤（走 idx_parse_tasks_status）
+            offset: 兼容旧参数，深翻页会变慢
+
+        Returns:
+            (任务列表, 下一页游标；没有更多时为 None)
+        """
+        query = select(*LIST_COLUMNS)
+        if status:
+            query = query.where(parse_tasks.c.status == status)
+        if cursor:
+            created_at, task_id = decode_cursor(cursor)
+            query = query.where(tuple_(parse_tasks.c.created_at, parse_tasks.c.id) < tuple_(created_at, task_id))
+        elif offset:
+            query = query.offset(offset)
+        # 多取一行判断是否还有下一页
+        query = query.order_by(parse_tasks.c.created_at.desc(), parse_tasks.c.id.desc()).limit(limit + 1)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+
+        tasks = [self._to_task(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = tasks[-1]
+            next_cursor = encode_cursor(last["created_at"], last["task_id"])
+        return tasks, next_cursor
+
+    def count(self, status: Optional[str] = None) -> int:
+        """任务总数（可按状态过滤）"""
+        query = select(func.count()).select_from(parse_tasks)
+        if status:
+            query = query.where(parse_tasks.c.status == status)
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar_one()
+
+    def purge_expired(self, ttl_hours: int = TASK_TTL_HOURS) -> List[Dict]:
+        """
+        删除完成时间早于 TTL 的已完成/失败任务
+
+        Returns:
+            被删除的任务（供调用方清理上传文件）
+        """
+        cutoff = datetime.now() - timedelta(hours=ttl_hours)
+        with self.engine.begin() as conn:
+            conn.execute(delete(parse_batches).where(parse_batches.c.created_at < cutoff))
+        expired = (
+            (parse_tasks.c.status.in_(FINISHED_STATUSES))
+            & (func.coalesce(parse_tasks.c.completed_at, parse_tasks.c.created_at) < cutoff)
+        )
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(parse_tasks.c.id, parse_tasks.c.file_path, parse_tasks.c.file_sha256).where(expired)
+            ).all()
+            conn.execute(delete(parse_tasks).where(expired))
+        return [{"task_id": str(r.id), "file_path": r.file_path, "file_sha256": r.file_sha256} for r in rows]
+
+    def create_batch(self, batch: Dict):
+        with self.engine.begin() as conn:
+            conn.execute(insert(parse_batches).values(
+                id=batch["batch_id"],
+                supplier_name=batch.get("supplier_name"),
+                task_ids=batch["task_ids"],
+                skipped=batch.get("skipped", []),
+                created_at=batch["created_at"],
+            ))
+
+    def get_batch(self, batch_id: str) -> Optional[Dict]:
+        """批次及其子任务（子任务按批次内顺序，已被 TTL 清理的不返回）"""
+        try:
+            batch_id = str(uuid.UUID(batch_id))
+        except ValueError:
+            return None
+        with self.engine.connect() as conn:
+            row = conn.execute(select(parse_batches).where(parse_batches.c.id == batch_id)).first()
+            if not row:
+                return None
+            rows = conn.execute(select(*LIST_COLUMNS).where(parse_tasks.c.id.in_(row.task_ids))).all()
+
+        tasks = {t["task_id"]: t for t in map(self._to_task, rows)}
+        return {
+            "batch_id": str(row.id),
+            "supplier_name": row.supplier_name,
+            "created_at": row.created_at,
+            "skipped": row.skipped or [],
+            "tasks": [tasks[t] for t in row.task_ids if t in tasks],
+        }
+
+    def hash_in_use(self, sha256: str) -> bool:
+        """是否还有任务引用该文件"""
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(parse_tasks.c.id).where(parse_tasks.c.file_sha256 == sha256).limit(1)
+            ).first() is not None
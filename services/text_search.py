@@ -0,0 +1,130 @@
+"""
+名称模糊检索
+PostgreSQL：pg_trgm GIN 索引（idx_products_name_trgm / idx_suppliers_name_trgm），按相似度排序
+SQLite（本地开发）：FTS5 表 + 触发器维护
+
+中文词没有空格，整串只算一个"词"，"明片" 与 "名片" 之间没有任何相同的三元组；
+所以索引和查询都用 search_text()：转小写并在每个汉字两侧加空格，汉字按单字参与匹配，
+"明片" 仍能以 "片" 命中 "名片"，相似度低于完全匹配的结果
+"""
+import os
+import re
+import asyncio
+from typing import Optional
+
+from sqlalchemy import event, func, or_, text, literal, literal_column, table, column
+
+# 与 schema.sql 中 search_text() 一致
+CJK_RE = re.compile(r"([一-鿿])")
+# 模糊模式的 word_similarity 阈值（pg_trgm 默认 0.6，对单字匹配过严）
+FUZZY_THRESHOLD = float(os.getenv("FUZZY_SEARCH_THRESHOLD", "0.3"))
+# 建立连接时设置的会话参数（services.db.engine_options 的 settings）
+PG_SETTINGS = {"pg_trgm.word_similarity_threshold": str(FUZZY_THRESHOLD)}
+
+# 已建好 FTS5 表的 SQLite 表名
+_fts_ready = set()
+_fts_lock = asyncio.Lock()
+
+
+def search_text(value: Optional[str]) -> str:
+    """检索用文本：小写 + 汉字两侧加空格"""
+    return CJK_RE.sub(r" \1 ", (value or "").lower())
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def apply_name_search(stmt, dialect: str, name_column, q: str, fuzzy: bool = False, rank: bool = True):
+    """
+    给 select() 加上名称检索条件和相似度排序（SQLite 需先 await prepare_name_search）
+
+    Args:
+        dialect: 数据库方言名（postgresql / sqlite）
+        name_column: Product.name / Supplier.name
+        fuzzy: False 只返回包含关键词的结果；True 同时返回相似的结果（错别字）
+        rank: False 时只过滤不排序（游标分页按 ID 排序时）
+    """
+    if dialect == "sqlite":
+        return _apply_fts(stmt, name_column, q, fuzzy, rank)
+
+    indexed = func.search_text(name_column)
+    needle = search_text(q)
+    contains = indexed.like(f"%{escape_like(needle)}%", escape="\\")
+    if fuzzy:
+        # <% 走 GIN 索引，阈值在建立连接时设置（PG_SETTINGS）
+        stmt = stmt.where(or_(contains, literal(needle).op("<%")(indexed)))
+    else:
+        stmt = stmt.where(contains)
+    if not rank:
+        return stmt
+    return stmt.order_by(func.word_similarity(needle, indexed).desc(), func.length(name_column), name_column)
+
+
+async def prepare_name_search(db, name_column):
+    """SQLite：首次检索时建 FTS5 表并回填，之后由触发器同步；PostgreSQL 无需准备"""
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    name = name_column.table.name
+    if name in _fts_ready:
+        return
+    # 并发的首次检索只建一次
+    async with _fts_lock:
+        if name in _fts_ready:
+            return
+        exists = (await db.execute(text("SELECT 1 FROM sqlite_master WHERE name = :n"), {"n": f"{name}_fts"})).first()
+        if not exists:
+            for statement in fts_statements(name):
+                await db.execute(text(statement))
+            await db.commit()
+        _fts_ready.add(name)
+
+
+def _apply_fts(stmt, name_column, q: str, fuzzy: bool, rank: bool = True):
+    """SQLite：包含 -> 短语查询（最后一个词前缀匹配），模糊 -> 任一词命中，按 bm25 排序"""
+    terms = ['"' + t.replace('"', '""') + '"' for t in search_text(q).split()]
+    if not terms:
+        return stmt
+    if fuzzy:
+        match = " OR ".join(terms)
+    else:
+        match = " + ".join(terms) + "*"
+
+    fts_name = f"{name_column.table.name}_fts"
+    fts = table(fts_name, column("rowid"), column("rank"))
+    stmt = stmt.join(fts, fts.c.rowid == name_column.table.c.id).where(literal_column(fts_name).op("MATCH")(match))
+    return stmt.order_by(fts.c.rank) if rank else stmt
+
+
+def fts_statements(name: str):
+    """FTS5 表、回填和同步触发器的建表语句"""
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name}_fts USING fts5(name, content='')",
+        f"INSERT INTO {name}_fts(rowid, name) SELECT id, search_text(name) FROM {name}",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_fts_ai AFTER INSERT ON {name} BEGIN
+          INSERT INTO {name}_fts(rowid, name) VALUES (new.id, search_text(new.name));
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_fts_ad AFTER DELETE ON {name} BEGIN
+          INSERT INTO {name}_fts({name}_fts, rowid, name) VALUES ('delete', old.id, search_text(old.name));
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_fts_au AFTER UPDATE OF name ON {name} BEGIN
+          INSERT INTO {name}_fts({name}_fts, rowid, name) VALUES ('delete', old.id, search_text(old.name));
+          INSERT INTO {name}_fts(rowid, name) VALUES (new.id, search_text(new.name));
+        END""",
+    ]
+
+
+def register_sqlite(engine):
+    """
+    SQLite 连接注册 search_text()（FTS 触发器里要用），并开启外键约束
+    （与 PostgreSQL 一致，删除产品时级联删除价格历史）；异步引擎传 engine.sync_engine
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, _):
+        dbapi_conn.create_function("search_text", 1, search_text, deterministic=True)
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
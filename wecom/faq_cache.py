@@ -0,0 +1,175 @@
+"""
+常见问题回复缓存
+少数问题（名片报价、易拉宝尺寸、几天能出货……）占了大部分群消息，缓存知识库查询结果，
+命中时不查知识库；回复按提问者自己的问法格式化（同一个键的不同问法不会拿到别人问题的标题）
+
+- 键为归一化后的问题：全半角、大小写、空白、标点、句末语气词不影响命中
+- 启动时预热：FAQ 列表文件（每行一个问题）+ 最近查询日志中出现最多的问题
+- 查询日志在线程中追加，超过 FAQ_LOG_MAX_BYTES 时轮转为 .1（只保留一份旧日志）
+- 知识库索引变化（向量文件重新生成）时按新索引重新查询已缓存的问题
+- LRU，最多 FAQ_CACHE_SIZE 条
+"""
+import os
+import asyncio
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+FAQ_CACHE_SIZE = int(os.getenv("FAQ_CACHE_SIZE", "200"))
+# 预热问题列表，每行一个，# 开头为注释
+FAQ_PATH = os.getenv("FAQ_PATH", str(Path(__file__).parent / "faq.txt"))
+# 查询日志（每行一个问题），为空则不记录
+FAQ_QUERY_LOG = os.getenv("FAQ_QUERY_LOG", "")
+# 从查询日志最后多少行中取出现最多的前多少个问题预热
+FAQ_LOG_LINES = int(os.getenv("FAQ_LOG_LINES", "10000"))
+FAQ_WARM_TOP = int(os.getenv("FAQ_WARM_TOP", "50"))
+# 查询日志大小上限（字节），超过后改名为 <日志>.1 重新开始
+FAQ_LOG_MAX_BYTES = int(os.getenv("FAQ_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# 句末语气词
+TRAILING_PARTICLES = "吗呢啊呀吧哈嘛么"
+
+
+def normalize_question(question: str) -> str:
+    """NFKC（全角转半角）、小写、去掉空白和标点、去掉句末语气词"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZC")
+    return text.rstrip(TRAILING_PARTICLES) or text
+
+
+def load_questions(faq_path: str = FAQ_PATH, log_path: str = FAQ_QUERY_LOG, top: int = FAQ_WARM_TOP) -> List[str]:
+    """预热问题：FAQ 列表在前，再加查询日志中出现最多的 top 个（按归一化键去重）"""
+    questions = []
+    if faq_path and Path(faq_path).exists():
+        for line in Path(faq_path).read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                questions.append(line)
+
+    if log_path and top > 0:
+        # 先读轮转出去的旧日志，再读当前日志，保留最后 FAQ_LOG_LINES 行
+        recent = deque(maxlen=FAQ_LOG_LINES)
+        for path in (Path(f"{log_path}.1"), Path(log_path)):
+            if path.exists():
+                with open(path, encoding="utf-8") as f:
+                    recent.extend(line.strip() for line in f if line.strip())
+        counts = Counter(normalize_question(q) for q in recent)
+        # 每个键取最近一次的原始写法
+        latest = {normalize_question(q): q for q in recent}
+        questions.extend(latest[key] for key, _ in counts.most_common(top))
+
+    seen, unique = set(), []
+    for question in questions:
+        key = normalize_question(question)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique
+
+
+class FaqCache:
+    """归一化问题 -> (原始问题, 知识库查询结果) 的 LRU"""
+
+    def __init__(self, maxsize: int = FAQ_CACHE_SIZE, query_log: str = FAQ_QUERY_LOG,
+                 log_max_bytes: int = FAQ_LOG_MAX_BYTES):
+        self.maxsize = maxsize
+        self.query_log = query_log
+        self.log_max_bytes = log_max_bytes
+        # 多个 worker 的写入在不同线程中进行，轮转时不能交错
+        self._log_lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.version = None  # 生成缓存时的知识库索引版本
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def get(self, question: str) -> Optional[list]:
+        key = normalize_question(question)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, question: str, results: list):
+        key = normalize_question(question)
+        if not key:
+            return
+        self.entries[key] = (question, results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def log_query(self, question: str):
+        """追加到查询日志（在线程中写文件，不阻塞事件循环），下次启动时用于预热"""
+        line = question.replace("\n", " ").strip()
+        if self.query_log and line:
+            await asyncio.to_thread(self._append_query, line)
+
+    def _append_query(self, line: str):
+        with self._log_lock:
+            try:
+                if os.path.getsize(self.query_log) >= self.log_max_bytes:
+                    os.replace(self.query_log, f"{self.query_log}.1")
+            except FileNotFoundError:
+                pass
+            with open(self.query_log, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    async def warm(self, questions: List[str], search: Callable[[str], Awaitable[Optional[list]]]) -> int:
+        """
+        逐个查询知识库写入缓存，返回写入的条数
+
+        Args:
+            search: 查询知识库；没有结果 / 查询失败返回 None（不缓存）
+        """
+        warmed = 0
+        for question in questions[:self.maxsize]:
+            results = await search(question)
+            if results is not None:
+                self.put(question, results)
+                warmed += 1
+        return warmed
+
+    async def refresh(self, version, search: Callable[[str], Awaitable[Optional[list]]]) -> bool:
+        """
+        知识库索引版本变化时重新查询所有已缓存的问题（保留缓存中的问题，热门问题不会冷下来）
+
+        Returns:
+            是否发生了刷新
+        """
+        if version == self.version:
+            return False
+        if self.version is not None:
+            questions = [question for question, _ in self.entries.values()]
+            for question in questions:
+                results = await search(question)
+                key = normalize_question(question)
+                if results is None:
+                    self.entries.pop(key, None)
+                elif key in self.entries:
+                    self.entries[key] = (question, results)
+            self.refreshes += 1
+        self.version = version
+        return True
+
+    def snapshot(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "index_version": self.version,
+            # 最近使用的问题
+            "recent": [question for question, _ in reversed(self.entries.values())][:10],
+        }
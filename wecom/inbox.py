@@ -0,0 +1,141 @@
+"""
+企微回调消息的后台处理
+回调只做解析、去重、入队就返回，知识库查询和回复在固定数量的 worker 中进行，
+回调耗时与查询耗时无关，企微不会因为超时重推
+
+- 有界队列：满时拒绝（返回 503，企微稍后重推），不无限堆积
+- 去重：按消息 ID 记录 TTL 内已接收的消息，企微重推的同一条消息直接确认、不再处理
+"""
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Optional
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_INBOX_SIZE = int(os.getenv("WEBHOOK_INBOX_SIZE", "100"))
+# 企微约 5 秒未收到响应即重推，最多 3 次；保留时间远大于重推窗口
+WEBHOOK_DEDUPE_TTL = float(os.getenv("WEBHOOK_DEDUPE_TTL", "300"))
+WEBHOOK_DEDUPE_SIZE = 10000
+
+
+class SeenMessages:
+    """TTL 内见过的消息 ID（按插入顺序过期，超过 maxsize 淘汰最早的）"""
+
+    def __init__(self, ttl: float = WEBHOOK_DEDUPE_TTL, maxsize: int = WEBHOOK_DEDUPE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.entries:
+            key, expires = next(iter(self.entries.items()))
+            if expires > now and len(self.entries) <= self.maxsize:
+                break
+            self.entries.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        self._expire()
+        return key in self.entries
+
+    def add(self, key: str):
+        self.entries[key] = time.monotonic() + self.ttl
+        self._expire()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def message_key(data: dict) -> str:
+    """去重键：MsgId；没有时用 发送者 + 时间 + 内容 的哈希"""
+    msg_id = data.get("MsgId")
+    if msg_id:
+        return str(msg_id)
+    raw = f"{data.get('FromUserName', '')}\n{data.get('CreateTime', '')}\n{data.get('Content', '')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class Inbox:
+    """有界队列 + 固定数量的 worker"""
+
+    def __init__(
+        self,
+        handler: Callable[[dict], Awaitable[None]],
+        workers: int = WEBHOOK_WORKERS,
+        maxsize: int = WEBHOOK_INBOX_SIZE,
+        dedupe_ttl: float = WEBHOOK_DEDUPE_TTL
+    ):
+        """
+        Args:
+            handler: 处理一条消息（查询知识库并回复），异常只记录不影响其他消息
+        """
+        self.handler = handler
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.seen = SeenMessages(dedupe_ttl)
+        self.stats = {"accepted": 0, "duplicates": 0, "rejected": 0, "processed": 0, "failed": 0}
+        # 入队到处理完的耗时（秒）
+        self.latencies = deque(maxlen=1000)
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0):
+        """等待已接收的消息处理完（最多 timeout 秒），然后停止 worker"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"退出时仍有 {self.queue.qsize()} 条消息未处理")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, data: dict) -> Optional[bool]:
+        """
+        Returns:
+            True 已入队 / None 重复消息（已处理或处理中）/ False 队列已满
+        """
+        key = message_key(data)
+        if key in self.seen:
+            self.stats["duplicates"] += 1
+            return None
+        try:
+            self.queue.put_nowait((time.monotonic(), data))
+        except asyncio.QueueFull:
+            # 不记入去重集合，企微重推时还有机会处理
+            self.stats["rejected"] += 1
+            return False
+        self.seen.add(key)
+        self.stats["accepted"] += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            queued_at, data = await self.queue.get()
+            try:
+                await self.handler(data)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"消息处理失败: {e}")
+            finally:
+                self.latencies.append(time.monotonic() - queued_at)
+                self.queue.task_done()
+
+    def snapshot(self) -> Dict:
+        latencies = sorted(self.latencies)
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "dedupe_entries": len(self.seen),
+            **self.stats,
+            "latency_ms": {
+                "avg": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0.0,
+                "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            },
+        }
@@ -0,0 +1,247 @@
+"""
+企微群机器人发送队列
+群机器人每个 webhook 限制约每分钟 20 条，突发回复直接发送会被拒（errcode 45009）而丢失
+
+- 每个 webhook URL 一条通道：令牌桶限速，一个 worker 顺序发送
+- 积压时把排队中相邻的 markdown 回复合并为一条（不超过 4096 字节），少占发送额度
+- 限流 / 系统繁忙 / 网络错误按指数退避重试，超过次数或不可重试的错误码计为丢弃
+- 计数：入队、送达、合并、重试、丢弃
+
+用法:
+    queue = OutboundQueue()
+    await queue.submit(bot, {"msgtype": "markdown", "markdown": {"content": "..."}})
+    ...
+    await queue.close()
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from webhook_bot import WebhookBot
+
+# 令牌桶：每分钟条数与突发容量（企微按自然分钟统计，突发留余量，超出部分靠重试兜底）
+WEBHOOK_RATE_PER_MINUTE = float(os.getenv("WEBHOOK_RATE_PER_MINUTE", "20"))
+WEBHOOK_BURST = int(os.getenv("WEBHOOK_BURST", "5"))
+# 每个 URL 最多排队的消息数，超出直接丢弃
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "500"))
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", "5"))
+WEBHOOK_RETRY_BASE = float(os.getenv("WEBHOOK_RETRY_BASE", "2"))  # 秒，每次翻倍
+WEBHOOK_RETRY_MAX = 60.0
+
+# markdown 消息内容上限（字节）
+MARKDOWN_MAX_BYTES = 4096
+MERGE_SEPARATOR = "\n\n---\n\n"
+
+# 可重试的错误码：-1 系统繁忙，45009 接口调用超过限制
+RETRY_ERRCODES = {-1, 45009}
+THROTTLE_ERRCODE = 45009
+
+
+class TokenBucket:
+    """令牌桶：capacity 为突发容量，每秒补充 rate 个"""
+
+    def __init__(self, rate_per_minute: float = WEBHOOK_RATE_PER_MINUTE, capacity: int = WEBHOOK_BURST):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """取一个令牌，不够时等待"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self):
+        """服务端已限流：清空令牌，按补充速度重新积累"""
+        self._refill()
+        self.tokens = 0.0
+
+
+def _mask(url: str) -> str:
+    """统计中不暴露完整的 webhook key"""
+    if "key=" not in url:
+        return url
+    prefix, key = url.split("key=", 1)
+    return f"{prefix}key=…{key[-4:]}"
+
+
+def _markdown_content(data: dict) -> Optional[str]:
+    if data.get("msgtype") == "markdown":
+        return data["markdown"]["content"]
+    return None
+
+
+def coalesce(pending: Deque[dict], max_bytes: int = MARKDOWN_MAX_BYTES) -> tuple:
+    """
+    从队首取出一条待发送的消息；队首是 markdown 时，把后面相邻的 markdown 合并进来，
+    合并后不超过 max_bytes
+
+    Returns:
+        (消息体, 包含的原始消息数)
+    """
+    first = pending.popleft()
+    content = _markdown_content(first)
+    if content is None:
+        return first, 1
+
+    parts = [content]
+    size = len(content.encode("utf-8"))
+    separator_size = len(MERGE_SEPARATOR.encode("utf-8"))
+    while pending:
+        following = _markdown_content(pending[0])
+        if following is None:
+            break
+        following_size = separator_size + len(following.encode("utf-8"))
+        if size + following_size > max_bytes:
+            break
+        pending.popleft()
+        parts.append(following)
+        size += following_size
+    if len(parts) == 1:
+        return first, 1
+    return {"msgtype": "markdown", "markdown": {"content": MERGE_SEPARATOR.join(parts)}}, len(parts)
+
+
+class _Lane:
+    """一个 webhook URL 的队列、令牌桶和发送 worker"""
+
+    def __init__(self, bot: WebhookBot, queue: "OutboundQueue"):
+        self.bot = bot
+        self.queue = queue
+        self.bucket = TokenBucket(queue.rate_per_minute, queue.burst)
+        self.pending: Deque[dict] = deque()
+        self.ready = asyncio.Event()
+        self.stats = {"enqueued": 0, "delivered": 0, "merged": 0, "retried": 0, "dropped": 0}
+        self.last_error: Optional[str] = None
+        self.sending = 0  # 正在发送（含重试等待）的原始消息数
+        self.task = asyncio.create_task(self._run())
+
+    def put(self, data: dict) -> bool:
+        if len(self.pending) >= self.queue.max_pending:
+            self.stats["dropped"] += 1
+            self.last_error = "队列已满"
+            return False
+        self.pending.append(data)
+        self.stats["enqueued"] += 1
+        self.ready.set()
+        return True
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self.ready.clear()
+                await self.ready.wait()
+            await self.bucket.acquire()
+            # 等令牌期间积压的消息在这里合并
+            data, count = coalesce(self.pending)
+            if count > 1:
+                self.stats["merged"] += count - 1
+            self.sending = count
+            try:
+                await self._deliver(data, count)
+            finally:
+                self.sending = 0
+
+    async def _deliver(self, data: dict, count: int):
+        """发送一条（可能是合并后的）消息，失败时退避重试；重试也要取令牌"""
+        for attempt in range(self.queue.max_retries + 1):
+            if attempt:
+                self.stats["retried"] += 1
+                await asyncio.sleep(min(self.queue.retry_base * 2 ** (attempt - 1), WEBHOOK_RETRY_MAX))
+                await self.bucket.acquire()
+            try:
+                result = await self.bot.send(data)
+                errcode = result.get("errcode", -1)
+                error = f"errcode {errcode}: {result.get('errmsg', '')}"
+            except Exception as e:
+                errcode, error = -1, str(e)
+
+            if errcode == 0:
+                self.stats["delivered"] += count
+                return
+            self.last_error = error
+            if errcode == THROTTLE_ERRCODE:
+                self.bucket.drain()
+            if errcode not in RETRY_ERRCODES:
+                break
+        print(f"企微消息发送失败，丢弃 {count} 条: {self.last_error}")
+        self.stats["dropped"] += count
+
+
+class OutboundQueue:
+    """所有 webhook URL 的发送队列"""
+
+    def __init__(
+        self,
+        rate_per_minute: float = WEBHOOK_RATE_PER_MINUTE,
+        burst: int = WEBHOOK_BURST,
+        max_pending: int = WEBHOOK_QUEUE_SIZE,
+        max_retries: int = WEBHOOK_MAX_RETRIES,
+        retry_base: float = WEBHOOK_RETRY_BASE
+    ):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.lanes: Dict[str, _Lane] = {}
+
+    async def submit(self, bot: WebhookBot, data: dict) -> bool:
+        """入队后立即返回；队列已满返回 False"""
+        lane = self.lanes.get(bot.webhook_url)
+        if lane is None:
+            lane = self.lanes[bot.webhook_url] = _Lane(bot, self)
+        return lane.put(data)
+
+    async def submit_markdown(self, bot: WebhookBot, content: str) -> bool:
+        return await self.submit(bot, {"msgtype": "markdown", "markdown": {"content": content}})
+
+    async def submit_text(self, bot: WebhookBot, content: str) -> bool:
+        return await self.submit(bot, {"msgtype": "text", "text": {"content": content}})
+
+    async def join(self, timeout: float):
+        """等待队列发完（最多 timeout 秒），用于退出前尽量送出积压"""
+        deadline = time.monotonic() + timeout
+        while any(lane.pending or lane.sending for lane in self.lanes.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def close(self):
+        """停止 worker，未发出的消息计为丢弃"""
+        for lane in self.lanes.values():
+            lane.task.cancel()
+            lane.stats["dropped"] += len(lane.pending) + lane.sending
+            lane.pending.clear()
+        await asyncio.gather(*[lane.task for lane in self.lanes.values()], return_exceptions=True)
+
+    def snapshot(self) -> Dict:
+        totals = {"enqueued": 0, "delivered": 0, "merged": 0, "retried": 0, "dropped": 0}
+        lanes: List[Dict] = []
+        for url, lane in self.lanes.items():
+            for name, value in lane.stats.items():
+                totals[name] += value
+            lanes.append({
+                "webhook": _mask(url),
+                "pending": len(lane.pending),
+                "sending": lane.sending,
+                "tokens": round(lane.bucket.tokens, 2),
+                **lane.stats,
+                "last_error": lane.last_error,
+            })
+        return {
+            "rate_per_minute": self.rate_per_minute,
+            "burst": self.burst,
+            "pending": sum(len(lane.pending) for lane in self.lanes.values()),
+            **totals,
+            "lanes": lanes,
+        }
@@ -1,12 +1,25 @@
 """
 企业微信 Webhook 机器人
 用于接收和发送群消息
+
+所有消息共用一个长连接 httpx.AsyncClient（keep-alive），不必每条消息重新做 DNS / TCP / TLS 握手；
+服务进程在启动 / 退出时调用 start() / close()，或者用 async with WebhookBot(...) as bot
 """
+import os
+import asyncio
 import httpx
 import hashlib
 import base64
-from typing import Optional
-from dataclasses import dataclass
+from typing import Optional, List
+from dataclasses import dataclass, field
+
+# 连接池与超时
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "10"))
+WEBHOOK_KEEPALIVE_EXPIRY = float(os.getenv("WEBHOOK_KEEPALIVE_EXPIRY", "60"))
+WEBHOOK_CONNECT_TIMEOUT = float(os.getenv("WEBHOOK_CONNECT_TIMEOUT", "5"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+# send_many 默认并发数
+WEBHOOK_SEND_CONCURRENCY = int(os.getenv("WEBHOOK_SEND_CONCURRENCY", "5"))
 
 
 @dataclass
@@ -14,6 +27,34 @@ class WebhookBot:
     """企业微信群机器人（Webhook 方式）"""
     
     webhook_url: str  # 群机器人 webhook 地址
+    max_connections: int = WEBHOOK_MAX_CONNECTIONS
+    timeout: float = WEBHOOK_TIMEOUT
+    _client: Optional[httpx.AsyncClient] = field(default=None, init=False, repr=False)
+    
+    async def start(self):
+        """创建共享连接池（重复调用无影响）"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=WEBHOOK_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=WEBHOOK_KEEPALIVE_EXPIRY,
+                ),
+            )
+    
+    async def close(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def __aenter__(self):
+        await self.start()
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.close()
     
     async def send_text(self, content: str, mentioned_list: Optional[list] = None) -> dict:
         """
@@ -81,29 +122,50 @@ class WebhookBot:
         }
         return await self._send(data)
     
+    async def send(self, data: dict) -> dict:
+        """
+        发送完整的消息体，如 {"msgtype": "markdown", "markdown": {"content": "..."}}
+        
+        Returns:
+            企微返回的 {"errcode", "errmsg"}；网络错误直接抛出
+        """
+        return await self._send(data)
+    
+    async def send_many(self, messages: List[dict], concurrency: int = WEBHOOK_SEND_CONCURRENCY) -> List[dict]:
+        """
+        并发发送多条消息（最多 concurrency 条同时进行）
+        
+        Args:
+            messages: 完整的消息体，如 {"msgtype": "text", "text": {"content": "..."}}
+        
+        Returns:
+            与 messages 顺序一致的结果；单条失败不影响其他消息，结果为 {"errcode": -1, "errmsg": 错误}
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def send_one(data: dict) -> dict:
+            async with semaphore:
+                try:
+                    return await self._send(data)
+                except Exception as e:
+                    return {"errcode": -1, "errmsg": str(e)}
+        
+        return await asyncio.gather(*[send_one(m) for m in messages])
+    
     async def _send(self, data: dict) -> dict:
-        """发送消息到 webhook"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(self.webhook_url, json=data)
-            return response.json()
+        """发送消息到 webhook（未调用 start() 时首次发送自动创建连接池）"""
+        if self._client is None:
+            await self.start()
+        response = await self._client.post(self.webhook_url, json=data)
+        return response.json()
 
 
 # 使用示例
 if __name__ == "__main__":
-    import asyncio
-    
     # 替换为实际的 webhook URL
     WEBHOOK_URL = "https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=YOUR_KEY"
     
-    bot = WebhookBot(webhook_url=WEBHOOK_URL)
-    
-    async def test():
-        # 发送文本
-        result = await bot.send_text("Hello from PrintShop AI!")
-        print(f"Text result: {result}")
-        
-        # 发送 Markdown
-        md_content = """
+    md_content = """
 ## 报价单
 **客户**: 测试客户
 **产品**: 名片 500张
@@ -114,7 +176,16 @@ if __name__ == "__main__":
 | 覆膜 | ¥0.1 | 500 | ¥50 |
 | **合计** | | | **¥200** |
 """
-        result = await bot.send_markdown(md_content)
-        print(f"Markdown result: {result}")
+    
+    async def test():
+        # 两条消息共用一个连接
+        async with WebhookBot(webhook_url=WEBHOOK_URL) as bot:
+            # 发送文本
+            result = await bot.send_text("Hello from PrintShop AI!")
+            print(f"Text result: {result}")
+            
+            # 发送 Markdown
+            result = await bot.send_markdown(md_content)
+            print(f"Markdown result: {result}")
     
     asyncio.run(test())
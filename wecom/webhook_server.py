@@ -1,20 +1,219 @@
 """
 企业微信 Webhook 服务器
-接收企微群消息，调用知识库 API，返回回复
+接收企微群消息，查询知识库，返回回复
+
+知识库查询两种部署方式（KNOWLEDGE_MODE）：
+- http: 调用独立的 knowledge-api 服务（共享连接池）
+- inprocess: 在本进程内加载 KnowledgeSearch（向量文件 + 模型），单机部署省掉一跳 HTTP 和 JSON 编解码
 """
+import os
+import sys
+import asyncio
 import hashlib
 import json
 import httpx
+from contextlib import asynccontextmanager
+from pathlib import Path
 from fastapi import FastAPI, Request, Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 import xml.etree.ElementTree as ET
 
-app = FastAPI(title="PrintShop WeChat Webhook")
+from webhook_bot import WebhookBot
+from outbound_queue import OutboundQueue
+from inbox import Inbox
+from faq_cache import FaqCache, load_questions
 
 # 配置
-KNOWLEDGE_API_URL = "http://localhost:8001"
-WEBHOOK_URL = ""  # 需要配置：群机器人 webhook URL
+KNOWLEDGE_MODE = os.getenv("KNOWLEDGE_MODE", "http")  # http / inprocess
+KNOWLEDGE_API_URL = os.getenv("KNOWLEDGE_API_URL", "http://localhost:8001")
+KNOWLEDGE_TIMEOUT = float(os.getenv("KNOWLEDGE_TIMEOUT", "10"))
+# inprocess 模式的向量文件（与 knowledge-api 相同）
+EMBEDDINGS_PATH = os.getenv(
+    "EMBEDDINGS_PATH",
+    str(Path(__file__).parent.parent / "embeddings" / "knowledge-vectors.json")
+)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # 需要配置：群机器人 webhook URL
+
+
+class HttpKnowledge:
+    """通过 knowledge-api 查询，所有请求共用一个 keep-alive 客户端"""
+    
+    def __init__(self, base_url: str = KNOWLEDGE_API_URL, timeout: float = KNOWLEDGE_TIMEOUT):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+    
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        )
+    
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+    
+    async def query(self, question: str, top_k: int) -> List[dict]:
+        response = await self.client.post("/query", json={"question": question, "top_k": top_k})
+        if response.status_code != 200:
+            raise RuntimeError(f"knowledge-api 返回 {response.status_code}")
+        return response.json().get("results", [])
+    
+    async def version(self):
+        """索引版本：knowledge-api 加载的向量文件（重新生成向量并重启后变化）"""
+        response = await self.client.get("/stats")
+        response.raise_for_status()
+        stats = response.json()
+        return f"{stats.get('model')}@{stats.get('generated_at')}/{stats.get('total_documents')}"
+
+
+class LocalKnowledge:
+    """进程内 KnowledgeSearch：启动时加载向量和模型，查询在线程中执行（编码和矩阵计算占 CPU）"""
+    
+    def __init__(self, embeddings_path: str = EMBEDDINGS_PATH):
+        # knowledge-api 目录名带连字符，不能作为包导入
+        sys.path.insert(0, str(Path(__file__).parent.parent / "knowledge-api"))
+        from search import KnowledgeSearch
+        
+        self.search_class = KnowledgeSearch
+        self.embeddings_path = Path(embeddings_path)
+        self.engine = KnowledgeSearch(embeddings_path)
+        self.signature = None  # 已加载的向量文件 (mtime, size)
+    
+    async def start(self):
+        await asyncio.to_thread(self._load)
+    
+    def _file_signature(self):
+        stat = self.embeddings_path.stat()
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    
+    def _load(self):
+        self.signature = self._file_signature()
+        self.engine.load()
+        # 与 knowledge-api 一致：模型加载失败时首次查询再加载
+        try:
+            self.engine.load_model()
+        except ImportError as e:
+            print(f"⚠️ 模型未加载: {e}")
+    
+    def _reload(self):
+        """向量文件变化：加载新文件后整体替换，模型没变时复用已加载的模型"""
+        signature = self._file_signature()
+        engine = self.search_class(str(self.embeddings_path))
+        engine.load()
+        if engine.model_name == self.engine.model_name:
+            engine.model = self.engine.model
+        self.engine = engine
+        self.signature = signature
+    
+    async def version(self):
+        """索引版本：向量文件的修改时间和大小，文件变化时先重新加载"""
+        if self._file_signature() != self.signature:
+            await asyncio.to_thread(self._reload)
+        return self.signature
+    
+    async def close(self):
+        pass
+    
+    async def query(self, question: str, top_k: int) -> List[dict]:
+        results = await asyncio.to_thread(self.engine.search, question, top_k)
+        # 与 knowledge-api /query 的结果格式一致
+        return [
+            {"id": r.id, "title": r.title, "content": r.content, "category": r.category,
+             "path": r.path, "similarity": round(r.similarity, 4)}
+            for r in results
+        ]
+
+
+def create_knowledge():
+    if KNOWLEDGE_MODE == "inprocess":
+        return LocalKnowledge()
+    return HttpKnowledge()
+
+
+# 退出时等待发送队列送出积压的最长时间（秒）
+OUTBOUND_DRAIN_SECONDS = float(os.getenv("OUTBOUND_DRAIN_SECONDS", "5"))
+# 检查知识库索引是否变化的间隔（秒）
+FAQ_REFRESH_SECONDS = float(os.getenv("FAQ_REFRESH_SECONDS", "60"))
+# 预热失败（知识库未就绪）后的重试间隔上限（秒），从 5 秒开始翻倍
+FAQ_WARM_MAX_BACKOFF = 300.0
+
+# 知识库查询 / 回复用的群机器人 / 发送队列，随服务启动 / 关闭
+knowledge = None
+reply_bot: Optional[WebhookBot] = None
+outbound: Optional[OutboundQueue] = None
+inbox: Optional[Inbox] = None
+faq_cache = FaqCache()
+
+
+async def search_knowledge(question: str) -> Optional[list]:
+    """查询知识库；没有结果时返回 None（不缓存，可能是知识库暂时不可用）"""
+    results = await query_knowledge(question)
+    return results or None
+
+
+async def warm_faq_cache():
+    """
+    预热常见问题；知识库不可用（取不到索引版本或一个问题都没查到）时退避重试直到成功。
+    成功后才记录索引版本，之后的 refresh 以它为基准
+    """
+    questions = await asyncio.to_thread(load_questions)
+    if not questions:
+        return
+    delay = 5.0
+    while True:
+        try:
+            version = await knowledge.version()
+            warmed = await faq_cache.warm(questions, search_knowledge)
+            if warmed:
+                faq_cache.version = version
+                print(f"常见问题缓存预热: {warmed} 条")
+                return
+            reason = "没有查到任何结果"
+        except Exception as e:
+            reason = str(e)
+        print(f"常见问题缓存预热失败（{reason}），{delay:.0f} 秒后重试")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, FAQ_WARM_MAX_BACKOFF)
+
+
+async def maintain_faq_cache():
+    """启动时预热常见问题（知识库未就绪时重试），之后定期检查知识库索引，变化时重新查询缓存的问题"""
+    await warm_faq_cache()
+    while True:
+        await asyncio.sleep(FAQ_REFRESH_SECONDS)
+        try:
+            if await faq_cache.refresh(await knowledge.version(), search_knowledge):
+                print(f"知识库索引已更新，重新查询 {len(faq_cache.entries)} 条常见问题")
+        except Exception as e:
+            print(f"常见问题缓存刷新失败: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global knowledge, reply_bot, outbound, inbox
+    knowledge = create_knowledge()
+    await knowledge.start()
+    outbound = OutboundQueue()
+    if WEBHOOK_URL:
+        reply_bot = WebhookBot(webhook_url=WEBHOOK_URL)
+        await reply_bot.start()
+    inbox = Inbox(handle_message)
+    await inbox.start()
+    faq_task = asyncio.create_task(maintain_faq_cache())
+    yield
+    faq_task.cancel()
+    await inbox.stop()
+    await outbound.join(OUTBOUND_DRAIN_SECONDS)
+    await outbound.close()
+    await knowledge.close()
+    if reply_bot:
+        await reply_bot.close()
+
+
+app = FastAPI(title="PrintShop WeChat Webhook", lifespan=lifespan)
 
 
 class WebhookMessage(BaseModel):
@@ -25,35 +224,24 @@ class WebhookMessage(BaseModel):
 
 
 async def query_knowledge(question: str, top_k: int = 3) -> list:
-    """查询知识库"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{KNOWLEDGE_API_URL}/query",
-                json={"question": question, "top_k": top_k},
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("results", [])
-        except Exception as e:
-            print(f"Knowledge API error: {e}")
+    """查询知识库（失败时返回空列表，回复"没有找到"）"""
+    try:
+        return await knowledge.query(question, top_k)
+    except Exception as e:
+        print(f"Knowledge API error: {e}")
     return []
 
 
 async def send_webhook_reply(content: str, use_markdown: bool = True):
-    """发送 webhook 回复"""
-    if not WEBHOOK_URL:
+    """发送 webhook 回复：放入发送队列（限速、合并、重试），不等待发送完成"""
+    if not reply_bot:
         print("Warning: WEBHOOK_URL not configured")
         return
     
-    async with httpx.AsyncClient() as client:
-        if use_markdown:
-            data = {"msgtype": "markdown", "markdown": {"content": content}}
-        else:
-            data = {"msgtype": "text", "text": {"content": content}}
-        
-        await client.post(WEBHOOK_URL, json=data)
+    if use_markdown:
+        await outbound.submit_markdown(reply_bot, content)
+    else:
+        await outbound.submit_text(reply_bot, content)
 
 
 def format_knowledge_response(question: str, results: list) -> str:
@@ -80,13 +268,48 @@ def format_knowledge_response(question: str, results: list) -> str:
 @app.get("/health")
 async def health():
     """健康检查"""
-    return {"status": "ok", "service": "printshop-wecom-webhook"}
+    return {"status": "ok", "service": "printshop-wecom-webhook", "knowledge_mode": KNOWLEDGE_MODE}
+
+
+@app.get("/outbound")
+async def outbound_stats():
+    """发送队列统计：排队、送达、合并、重试、丢弃"""
+    return outbound.snapshot()
+
+
+@app.get("/faq-cache")
+async def faq_cache_stats():
+    """常见问题回复缓存统计"""
+    return faq_cache.snapshot()
+
+
+@app.get("/inbox")
+async def inbox_stats():
+    """回调消息处理统计：排队、重复、拒绝、处理耗时"""
+    return inbox.snapshot()
+
+
+async def handle_message(data: dict):
+    """后台 worker 中处理一条消息：常见问题直接用缓存的查询结果，否则查询知识库；按本次的问法格式化，放入发送队列"""
+    content = data.get("Content", "")
+    await faq_cache.log_query(content)
+    
+    results = faq_cache.get(content)
+    if results is None:
+        # 查询知识库
+        results = await search_knowledge(content)
+        if results is not None:
+            faq_cache.put(content, results)
+    reply = format_knowledge_response(content, results or [])
+    
+    # 发送回复
+    await send_webhook_reply(reply)
 
 
 @app.post("/webhook")
 async def receive_webhook(request: Request):
     """
-    接收企微消息回调
+    接收企微消息回调：解析、去重、入队后立即确认，查询和回复由后台 worker 完成
     
     注意：这是简化版本，实际需要：
     1. 验证签名
@@ -104,15 +327,13 @@ async def receive_webhook(request: Request):
         if msg_type == "text":
             content = data.get("Content", "")
         
-        if content:
-            # 查询知识库
-            results = await query_knowledge(content)
-            
-            # 格式化回复
-            reply = format_knowledge_response(content, results)
-            
-            # 发送回复
-            await send_webhook_reply(reply)
+        if content and inbox.submit(data) is False:
+            # 队列已满：不确认，企微稍后重推
+            return Response(
+                content=json.dumps({"errcode": -1, "errmsg": "busy"}),
+                status_code=503,
+                media_type="application/json"
+            )
         
         return {"errcode": 0, "errmsg": "ok"}
     